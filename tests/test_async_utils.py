@@ -2,8 +2,16 @@ import asynctest
 from asynctest.mock import patch, MagicMock
 import aiohttp
 
+import asyncio
+import json
+
 from wayback_google_analytics.async_utils import (
+    get_snapshot_rows,
+    get_capture_index,
+    pick_smallest_per_bucket,
     get_codes_from_single_timestamp,
+    get_records_from_snapshots,
+    get_deadline,
     get_codes_from_snapshots,
     get_snapshot_timestamps,
     DEFAULT_HEADERS,
@@ -21,7 +29,10 @@ class AsyncUtilsTestCase(asynctest.TestCase):
         mock_response = MagicMock()
 
         async def mock_text_method():
-            return "20120101000000\n20130102000000\n20140103000000\n20150104000000\n20160105000000\n20170106000000\n20180107000000\n20190108000000\n20200109000000\n20210110000000"
+            return json.dumps(
+                [["timestamp", "length", "mimetype"]]
+                + [[f"20{year}0101000000", "1000", "text/html"] for year in range(12, 22)]
+            )
 
         mock_response.text = mock_text_method
 
@@ -40,65 +51,244 @@ class AsyncUtilsTestCase(asynctest.TestCase):
 
         expected_timestamp_list = [
             "20120101000000",
-            "20130102000000",
-            "20140103000000",
-            "20150104000000",
-            "20160105000000",
-            "20170106000000",
-            "20180107000000",
-            "20190108000000",
-            "20200109000000",
-            "20210110000000",
+            "20130101000000",
+            "20140101000000",
+            "20150101000000",
+            "20160101000000",
+            "20170101000000",
+            "20180101000000",
+            "20190101000000",
+            "20200101000000",
+            "20210101000000",
         ]
 
         """Does get_snapshot_timestamps return correct, formatted timestamps?"""
         self.assertEqual(result, expected_timestamp_list)
 
         """Does get_snapshot_timestamps call session.get with correct parameters?"""
-        expected_CDX_url = "http://web.archive.org/cdx/search/cdx?url=https://www.someurl.com&matchType=domain&filter=statuscode:200&fl=timestamp&output=JSON&collapse=timestamp:4&limit=10&from=20120101000000&to=20210102000000"
+        expected_CDX_url = "http://web.archive.org/cdx/search/cdx?url=someurl.com&matchType=domain&filter=statuscode:200&filter=mimetype:(application/xhtml%5C%2Bxml|text/html|unk)&fl=timestamp,length,mimetype&output=JSON&collapse=timestamp:6&limit=120&from=20120101000000&to=20210102000000"
         mock_get.assert_called_with(expected_CDX_url, headers=DEFAULT_HEADERS)
 
     @patch("aiohttp.ClientSession.get")
-    @patch("wayback_google_analytics.async_utils.get_UA_code")
-    @patch("wayback_google_analytics.async_utils.get_GA_code")
-    @patch("wayback_google_analytics.async_utils.get_GTM_code")
-    async def test_get_codes_from_single_timestamp(
-        self, mock_GTM, mock_GA, mock_UA, mock_get
-    ):
-        """Does get_codes_from_single_timestamp return correct codes from a single archive.org snapshot?"""
+    async def test_get_snapshot_rows(self, mock_get):
+        """Does get_snapshot_rows skip non-html and oversized captures and pick the smallest per bucket?"""
 
-        # Mock the response from the server
         mock_response = MagicMock()
 
         async def mock_text_method():
-            return "<html> ... fake data ... </html>"
+            return json.dumps(
+                [
+                    ["timestamp", "length", "mimetype"],
+                    ["20120101000000", "9000", "text/html"],
+                    ["20120201000000", "3000", "text/html"],
+                    ["20120301000000", "100", "image/png"],
+                    ["20130101000000", "-", "text/html"],
+                    ["20140101000000", "500000", "text/html"],
+                    ["20140201000000", "4000", "application/xhtml+xml"],
+                    ["20150101000000", "4000", "text/html"],
+                ]
+            )
 
         mock_response.text = mock_text_method
         mock_get.return_value.__aenter__.return_value = mock_response
 
-        # Mock get_code functions
-        mock_UA.return_value = ["UA-12345678-1"]
-        mock_GA.return_value = ["G-12345678"]
-        mock_GTM.return_value = ["GTM-12345678"]
+        async with aiohttp.ClientSession() as session:
+            rows = await get_snapshot_rows(
+                session=session,
+                url="someurl.com",
+                start_date=None,
+                end_date=None,
+                frequency="4",
+                limit=3,
+                max_size=100000,
+            )
+
+        self.assertEqual(
+            rows,
+            [
+                ("20120201000000", 3000),
+                ("20130101000000", None),
+                ("20140201000000", 4000),
+            ],
+        )
+
+        """With a frequency, the CDX api gets a limit covering every month of 3 years"""
+        self.assertIn("&collapse=timestamp:6&limit=36", mock_get.call_args[0][0])
+
+        """Without a frequency, the limit is sent to the CDX api and nothing is collapsed"""
+        async with aiohttp.ClientSession() as session:
+            rows = await get_snapshot_rows(
+                session=session,
+                url="someurl.com",
+                start_date=None,
+                end_date=None,
+                frequency=None,
+                limit=-100,
+            )
+
+        self.assertEqual(len(rows), 6)
+        self.assertIn("&limit=-100", mock_get.call_args[0][0])
+        self.assertNotIn("collapse", mock_get.call_args[0][0])
+
+        """Is the query built from the domain, whichever url on it is given?"""
+        requested = []
+        async with aiohttp.ClientSession() as session:
+            for url in ["https://www.someurl.com/about", "someurl.com"]:
+                await get_snapshot_rows(
+                    session=session,
+                    url=url,
+                    start_date=None,
+                    end_date=None,
+                    frequency=None,
+                    limit=None,
+                )
+                requested.append(mock_get.call_args[0][0])
+
+        self.assertEqual(requested[0], requested[1])
+        self.assertIn("?url=someurl.com&", requested[0])
+
+    @patch("aiohttp.ClientSession.get")
+    async def test_get_snapshot_rows_unknown_length_ties(self, mock_get):
+        """Are captures in the same second sorted even if one has an unknown length?"""
+
+        mock_response = MagicMock()
+
+        async def mock_text_method():
+            return json.dumps(
+                [
+                    ["timestamp", "length", "mimetype"],
+                    ["20120101000000", "-", "text/html"],
+                    ["20120101000000", "3000", "text/html"],
+                    ["20110101000000", "5000", "text/html"],
+                ]
+            )
 
-        results = {
-            "UA_codes": {},
-            "GA_codes": {},
-            "GTM_codes": {},
+        mock_response.text = mock_text_method
+        mock_get.return_value.__aenter__.return_value = mock_response
+
+        async with aiohttp.ClientSession() as session:
+            rows = await get_snapshot_rows(
+                session=session,
+                url="someurl.com",
+                start_date=None,
+                end_date=None,
+                frequency="4",
+                limit=None,
+            )
+
+        self.assertEqual(rows, [("20110101000000", 5000), ("20120101000000", 3000)])
+
+    @patch("wayback_google_analytics.async_utils.update_cdx_store")
+    async def test_get_snapshot_timestamps_cdx_store(self, mock_update):
+        """Are timestamps from a cdx_store selected with the same size limit?"""
+
+        store = MagicMock()
+        store.select_timestamps.return_value = ["20190101000000"]
+
+        result = await get_snapshot_timestamps(
+            session=None,
+            url="someurl.com",
+            start_date=None,
+            end_date=None,
+            frequency="4",
+            limit=3,
+            cdx_store=store,
+            max_size=100000,
+        )
+
+        self.assertEqual(result, ["20190101000000"])
+        mock_update.assert_called_once()
+        self.assertEqual(store.select_timestamps.call_args[1]["max_size"], 100000)
+
+    @patch("aiohttp.ClientSession.get")
+    async def test_cdx_error_page(self, mock_get):
+        """Are error pages from the CDX api treated as no captures?"""
+
+        mock_response = MagicMock()
+
+        async def mock_text_method():
+            return "<html><body>429 Too Many Requests</body></html>"
+
+        mock_response.text = mock_text_method
+        mock_get.return_value.__aenter__.return_value = mock_response
+
+        async with aiohttp.ClientSession() as session:
+            rows = await get_snapshot_rows(
+                session=session,
+                url="someurl.com",
+                start_date=None,
+                end_date=None,
+                frequency="4",
+                limit=3,
+            )
+            index = await get_capture_index(session, "someurl.com/js/app.js")
+
+        self.assertEqual(rows, [])
+        self.assertEqual(index, [])
+
+    def test_pick_smallest_per_bucket(self):
+        """Does pick_smallest_per_bucket keep the smallest capture, preferring known sizes and earlier ties?"""
+
+        rows = [
+            ("20120101000000", 500),
+            ("20120601000000", 500),
+            ("20130101000000", None),
+            ("20130601000000", 800),
+            ("20140101000000", None),
+        ]
+
+        self.assertEqual(
+            pick_smallest_per_bucket(rows, 4),
+            [
+                ("20120101000000", 500),
+                ("20130601000000", 800),
+                ("20140101000000", None),
+            ],
+        )
+
+    @patch("aiohttp.ClientSession.get")
+    @patch("wayback_google_analytics.async_utils.get_codes_from_bytes")
+    async def test_get_codes_from_single_timestamp(self, mock_get_codes, mock_get):
+        """Does get_codes_from_single_timestamp return correct codes from a single archive.org snapshot?"""
+
+        # Mock the response from the server
+        mock_response = MagicMock()
+
+        async def mock_read_method():
+            return b"<html> ... fake data ... </html>"
+
+        mock_response.read = mock_read_method
+        mock_get.return_value.__aenter__.return_value = mock_response
+
+        # Mock code extraction
+        mock_get_codes.return_value = {
+            "UA": ["UA-12345678-1"],
+            "GA": ["G-12345678"],
+            "GTM": ["GTM-12345678"],
         }
 
         async with aiohttp.ClientSession() as session:
-            await get_codes_from_single_timestamp(
+            record = await get_codes_from_single_timestamp(
                 session=session,
                 timestamp="20120101000000",
                 base_url="https://web.archive.org/web/{timestamp}/https://www.someurl.com",
-                results=results,
             )
 
-        """Does it update results accordingly?"""
-        self.assertIn("UA-12345678-1", results["UA_codes"])
-        self.assertIn("G-12345678", results["GA_codes"])
-        self.assertIn("GTM-12345678", results["GTM_codes"])
+        """Does it return a record of the codes found in the snapshot?"""
+        self.assertEqual(
+            record,
+            (
+                20120101000000,
+                {
+                    "UA": ["UA-12345678-1"],
+                    "GA": ["G-12345678"],
+                    "GTM": ["GTM-12345678"],
+                },
+            ),
+        )
+
+        """Is the body scanned without decoding it?"""
+        mock_get_codes.assert_called_with(b"<html> ... fake data ... </html>")
 
         """Does it call get with correct parameters?"""
         expected_url = (
@@ -106,11 +296,51 @@ class AsyncUtilsTestCase(asynctest.TestCase):
         )
         mock_get.assert_called_with(expected_url, headers=DEFAULT_HEADERS)
 
+    @asynctest.patch("aiohttp.ClientSession.get")
+    async def test_get_codes_from_single_timestamp_scripts(self, mock_get):
+        """Does get_codes_from_single_timestamp add the codes of scripts the snapshot loads?"""
+
+        mock_response = MagicMock()
+
+        async def mock_read_method():
+            return b'<script src="/js/app.js"></script><script>ga("create", "UA-11111111-1");</script>'
+
+        mock_response.read = mock_read_method
+        mock_get.return_value.__aenter__.return_value = mock_response
+
+        script_cache = MagicMock()
+
+        async def mock_script_codes(session, page_url, timestamp, srcs, semaphore):
+            return {"UA": ["UA-11111111-1", "UA-22222222-1"], "GA": [], "GTM": []}
+
+        script_cache.get_codes = MagicMock(side_effect=mock_script_codes)
+
+        async with aiohttp.ClientSession() as session:
+            record = await get_codes_from_single_timestamp(
+                session=session,
+                timestamp="20120101000000",
+                base_url="https://web.archive.org/web/{timestamp}/https://www.someurl.com",
+                script_cache=script_cache,
+            )
+
+        self.assertEqual(
+            record,
+            (20120101000000, {"UA": ["UA-11111111-1", "UA-22222222-1"], "GA": [], "GTM": []}),
+        )
+        self.assertEqual(
+            script_cache.get_codes.call_args[0][1:4],
+            (
+                "https://web.archive.org/web/20120101000000/https://www.someurl.com",
+                "20120101000000",
+                ["/js/app.js"],
+            ),
+        )
+
     async def test_get_codes_from_snapshots(self):
         """Does get_codes_from_snapshots run once for each timestamp provided?"""
 
         # Mock get_codes_from_single_timestamp
-        mock_get_codes_from_single_timestamp = asynctest.CoroutineMock()
+        mock_get_codes_from_single_timestamp = asynctest.CoroutineMock(return_value=None)
 
         """Does it call get_codes_from_single_timestamp for each timestamp?"""
         with asynctest.mock.patch(
@@ -138,7 +368,7 @@ class AsyncUtilsTestCase(asynctest.TestCase):
             )
 
         # Resets call_count NOTE: There may be a better way to do this.
-        mock_get_codes_from_single_timestamp = asynctest.CoroutineMock()
+        mock_get_codes_from_single_timestamp = asynctest.CoroutineMock(return_value=None)
 
         with asynctest.mock.patch(
             "wayback_google_analytics.async_utils.get_codes_from_single_timestamp",
@@ -154,7 +384,7 @@ class AsyncUtilsTestCase(asynctest.TestCase):
             )
 
         # Resets call_count
-        mock_get_codes_from_single_timestamp = asynctest.CoroutineMock()
+        mock_get_codes_from_single_timestamp = asynctest.CoroutineMock(return_value=None)
 
         with asynctest.mock.patch(
             "wayback_google_analytics.async_utils.get_codes_from_single_timestamp",
@@ -168,3 +398,46 @@ class AsyncUtilsTestCase(asynctest.TestCase):
             self.assertEqual(
                 mock_get_codes_from_single_timestamp.call_count, len(timestamps)
             )
+
+    async def test_get_records_from_snapshots_deadline(self):
+        """Does get_records_from_snapshots cancel fetches at the deadline and keep the rest?"""
+
+        semaphore = asyncio.Semaphore(2)
+
+        async def mock_get_codes(session, base_url, timestamp, semaphore, script_cache=None):
+            async with semaphore:
+                if timestamp == "20150101000000":
+                    return None
+                if timestamp > "20150101000000":
+                    await asyncio.sleep(10)
+                return (int(timestamp), {"UA": [], "GA": [], "GTM": []})
+
+        timestamps = ["20120101000000", "20150101000000", "20180101000000", "20190101000000"]
+
+        with patch(
+            "wayback_google_analytics.async_utils.get_codes_from_single_timestamp",
+            mock_get_codes,
+        ):
+            records = await get_records_from_snapshots(
+                session=None,
+                url="someurl.com",
+                timestamps=timestamps,
+                semaphore=semaphore,
+                deadline=get_deadline(0.05),
+            )
+
+        """Failed snapshots are None, cancelled ones are left out"""
+        self.assertEqual(records, [(20120101000000, {"UA": [], "GA": [], "GTM": []}), None])
+
+        """Cancelled fetches release the semaphore"""
+        self.assertFalse(semaphore.locked())
+
+    async def test_get_deadline(self):
+        """Does get_deadline keep the earlier of a timeout and an existing deadline?"""
+
+        now = asyncio.get_running_loop().time()
+
+        self.assertIsNone(get_deadline())
+        self.assertEqual(get_deadline(deadline=now + 5), now + 5)
+        self.assertLessEqual(get_deadline(10, now + 5), now + 5)
+        self.assertLessEqual(get_deadline(1, now + 5), now + 2)
@@ -0,0 +1,312 @@
+import asyncio
+import os
+from shutil import rmtree
+import aiohttp
+import asynctest
+from asynctest.mock import MagicMock
+
+from wayback_google_analytics.cdx_store import (
+    CdxStore,
+    parse_cdx_page,
+    update_cdx_store,
+)
+
+
+class CdxStoreTestCase(asynctest.TestCase):
+    """Tests for cdx_store.py"""
+
+    def setUp(self):
+        """Create test store directory"""
+        self.test_path = "./test_cdx_store"
+        if not os.path.exists(self.test_path):
+            os.makedirs(self.test_path)
+
+        # Rows are sorted by url key, like CDX output
+        self.rows = [
+            ("com,someurl)/", "20190101000000", "A" * 32, "1000", "text/html"),
+            ("com,someurl)/", "20190601000000", "A" * 32, "1000", "text/html"),
+            ("com,someurl)/", "20200101000000", "B" * 32, "-", "text/html"),
+            ("com,someurl)/about", "20120101000000", "C" * 32, "2000", "text/html"),
+            ("com,someurl)/about", "20190301000000", "D" * 32, "3000", "text/html"),
+        ]
+
+    def tearDown(self):
+        """Removes any created directories after each test"""
+        if os.path.exists(self.test_path):
+            rmtree(self.test_path)
+
+    def test_append_and_reopen(self):
+        """Are appended rows kept on disk and readable by a new store?"""
+
+        store = CdxStore(self.test_path, "someurl.com")
+        self.assertEqual(store.append(self.rows[:3]), 3)
+        self.assertEqual(store.append(self.rows[3:]), 2)
+
+        store = CdxStore(self.test_path, "someurl.com")
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.meta["max_timestamp"], "20200101000000")
+        self.assertEqual(list(store.get_timestamps())[3], 20120101000000)
+        self.assertEqual(store.get_urlkey(0), "com,someurl)/")
+        self.assertEqual(store.get_urlkey(4), "com,someurl)/about")
+
+    def test_interrupted_append(self):
+        """Are rows written without updating meta.json dropped on the next append?"""
+
+        store = CdxStore(self.test_path, "someurl.com")
+        store.append(self.rows[:2])
+
+        with open(os.path.join(store.path, "timestamps.i64"), "ab") as f:
+            f.write(b"\1" * 12)
+
+        store = CdxStore(self.test_path, "someurl.com")
+        self.assertEqual(len(store.get_timestamps()), 2)
+
+        store.append(self.rows[2:])
+        self.assertEqual(
+            list(store.get_timestamps()),
+            [int(row[1]) for row in self.rows],
+        )
+        self.assertEqual(store.get_urlkey(4), "com,someurl)/about")
+
+    def test_select_timestamps(self):
+        """Does select_timestamps sort, dedupe, collapse and limit like the CDX api?"""
+
+        store = CdxStore(self.test_path, "someurl.com")
+        store.append(self.rows)
+
+        """Identical content (same digest) is only dropped when deduping"""
+        self.assertEqual(
+            store.select_timestamps(dedupe=True),
+            ["20120101000000", "20190101000000", "20190301000000", "20200101000000"],
+        )
+        self.assertEqual(len(store.select_timestamps()), 5)
+
+        self.assertEqual(
+            store.select_timestamps(start_date="20190201000000", end_date="20200101000000"),
+            ["20190301000000", "20190601000000", "20200101000000"],
+        )
+        self.assertEqual(
+            store.select_timestamps(frequency="4"),
+            ["20120101000000", "20190101000000", "20200101000000"],
+        )
+        self.assertEqual(store.select_timestamps(limit=-2), ["20190601000000", "20200101000000"])
+        self.assertEqual(store.select_timestamps(limit="1"), ["20120101000000"])
+
+        """An empty store selects nothing"""
+        self.assertEqual(CdxStore(self.test_path, "otherurl.org").select_timestamps(), [])
+
+    def test_select_timestamps_html_and_size(self):
+        """Does select_timestamps skip non-html and oversized captures, like get_snapshot_rows?"""
+
+        store = CdxStore(self.test_path, "someurl.com")
+        store.append(
+            self.rows
+            + [
+                ("com,someurl)/logo.png", "20150101000000", "E" * 32, "100", "image/png"),
+                ("com,someurl)/report.pdf", "20160101000000", "F" * 32, "-", "application/pdf"),
+            ]
+        )
+
+        self.assertEqual(len(store.select_timestamps()), 5)
+
+        """Captures of unknown size are kept"""
+        self.assertEqual(
+            store.select_timestamps(max_size=1500),
+            ["20190101000000", "20190601000000", "20200101000000"],
+        )
+        self.assertEqual(
+            store.select_timestamps(frequency="4", max_size=1500),
+            ["20190101000000", "20200101000000"],
+        )
+
+    def test_older_version(self):
+        """Are stores written by an older version filled again?"""
+
+        store = CdxStore(self.test_path, "someurl.com")
+        store.append(self.rows)
+        store.meta.pop("version")
+        store._write_meta()
+
+        store = CdxStore(self.test_path, "someurl.com")
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.meta["max_timestamp"], None)
+
+        store.append(self.rows[:2])
+        self.assertEqual(os.path.getsize(os.path.join(store.path, "timestamps.i64")), 16)
+        self.assertEqual(store.select_timestamps(), ["20190101000000", "20190601000000"])
+
+    def test_parse_cdx_page(self):
+        """Does parse_cdx_page return rows and the resume key?"""
+
+        text = "com,someurl)/ 20190101000000 AAAA 1000 text/html\ncom,someurl)/ 20200101000000 BBBB - warc/revisit\n\ncom%2Csomeurl%29%2F+20200101000000\n"
+        rows, resume_key = parse_cdx_page(text)
+
+        self.assertEqual(
+            rows,
+            [
+                ("com,someurl)/", "20190101000000", "AAAA", "1000", "text/html"),
+                ("com,someurl)/", "20200101000000", "BBBB", "-", "warc/revisit"),
+            ],
+        )
+        self.assertEqual(resume_key, "com%2Csomeurl%29%2F+20200101000000")
+
+        self.assertEqual(
+            parse_cdx_page("com,someurl)/ 20190101000000 AAAA 1000 text/html\n")[1], None
+        )
+
+    async def test_update_cdx_store(self):
+        """Does update_cdx_store follow resume keys and only add new captures on later runs?"""
+
+        pages = [
+            "com,someurl)/ 20190101000000 AAAA 1000 text/html\n\nkey1\n",
+            "com,someurl)/ 20200101000000 BBBB 1000 text/html\n",
+            "com,someurl)/ 20200101000000 BBBB 1000 text/html\ncom,someurl)/ 20210101000000 CCCC 1000 text/html\n",
+        ]
+        requested = []
+
+        def mock_get(url, headers):
+            requested.append(url)
+            response = MagicMock()
+
+            async def mock_text():
+                return pages[len(requested) - 1]
+
+            response.text = mock_text
+            context = MagicMock()
+            context.__aenter__ = asynctest.CoroutineMock(return_value=response)
+            context.__aexit__ = asynctest.CoroutineMock(return_value=False)
+            return context
+
+        session = MagicMock()
+        session.get = mock_get
+        semaphore = asynctest.MagicMock()
+        semaphore.__aenter__ = asynctest.CoroutineMock()
+        semaphore.__aexit__ = asynctest.CoroutineMock(return_value=False)
+
+        store = CdxStore(self.test_path, "someurl.com")
+        self.assertEqual(await update_cdx_store(session, "someurl.com", store, semaphore), 2)
+        self.assertIn("&resumeKey=key1", requested[1])
+
+        """A later run starts from the latest stored capture and skips it"""
+        self.assertEqual(await update_cdx_store(session, "someurl.com", store, semaphore), 1)
+        self.assertIn("&from=20200101000000", requested[2])
+        self.assertEqual(len(store), 3)
+
+    async def test_update_cdx_store_concurrent(self):
+        """Do concurrent updates of the same store (e.g. in stream mode) append captures once?"""
+
+        async def mock_text():
+            await asyncio.sleep(0.01)
+            return "com,someurl)/ 20190101000000 AAAA 1000 text/html\ncom,someurl)/about 20200101000000 BBBB 1000 text/html\n"
+
+        def mock_get(url, headers):
+            response = MagicMock()
+            response.text = mock_text
+            context = MagicMock()
+            context.__aenter__ = asynctest.CoroutineMock(return_value=response)
+            context.__aexit__ = asynctest.CoroutineMock(return_value=False)
+            return context
+
+        session = MagicMock()
+        session.get = mock_get
+        semaphore = asyncio.Semaphore(10)
+
+        # Each url opens its own store for the domain, as process_url() does
+        appended = await asyncio.gather(
+            update_cdx_store(session, "someurl.com", CdxStore(self.test_path, "someurl.com"), semaphore),
+            update_cdx_store(session, "www.someurl.com/about", CdxStore(self.test_path, "someurl.com"), semaphore),
+        )
+
+        self.assertEqual(sorted(appended), [0, 2])
+        self.assertEqual(len(CdxStore(self.test_path, "someurl.com")), 2)
+
+    def get_mock_session(self, pages, requested):
+        """Returns a session whose responses are pages in turn. Exceptions in pages are raised."""
+
+        def mock_get(url, headers):
+            requested.append(url)
+            page = pages[len(requested) - 1]
+            response = MagicMock()
+            if isinstance(page, Exception):
+                response.raise_for_status.side_effect = page
+
+            async def mock_text():
+                return page
+
+            response.text = mock_text
+            context = MagicMock()
+            context.__aenter__ = asynctest.CoroutineMock(return_value=response)
+            context.__aexit__ = asynctest.CoroutineMock(return_value=False)
+            return context
+
+        session = MagicMock()
+        session.get = mock_get
+        return session
+
+    async def test_update_cdx_store_interrupted(self):
+        """Is an interrupted fill resumed from its resume key, so no url key is skipped?"""
+
+        pages = [
+            "com,someurl)/ 20200101000000 AAAA 1000 text/html\n\nkey1\n",
+            aiohttp.ClientError("429 Too Many Requests"),
+            "com,someurl)/about 20120101000000 BBBB 1000 text/html\n",
+        ]
+        requested = []
+        session = self.get_mock_session(pages, requested)
+        store = CdxStore(self.test_path, "someurl.com")
+
+        with self.assertRaises(aiohttp.ClientError):
+            await update_cdx_store(session, "someurl.com", store, asyncio.Semaphore(10))
+
+        store = CdxStore(self.test_path, "someurl.com")
+        self.assertEqual(len(store), 1)
+        self.assertFalse(store.meta["complete"])
+        self.assertEqual(store.meta["resume_key"], "key1")
+
+        """The next run resumes the first fill instead of starting from the latest capture"""
+        self.assertEqual(
+            await update_cdx_store(session, "someurl.com", store, asyncio.Semaphore(10)), 1
+        )
+        self.assertIn("&resumeKey=key1", requested[2])
+        self.assertNotIn("&from=", requested[2])
+        self.assertTrue(store.meta["complete"])
+        self.assertEqual(store.select_timestamps(), ["20120101000000", "20200101000000"])
+
+    async def test_update_cdx_store_restarts_incomplete(self):
+        """Is a fill interrupted before a resume key was saved started again?"""
+
+        store = CdxStore(self.test_path, "someurl.com")
+        store.append(self.rows[:2])
+        self.assertFalse(store.meta["complete"])
+
+        requested = []
+        session = self.get_mock_session(
+            ["\n".join(" ".join(row) for row in self.rows) + "\n"], requested
+        )
+
+        self.assertEqual(
+            await update_cdx_store(session, "someurl.com", store, asyncio.Semaphore(10)), 5
+        )
+        self.assertNotIn("&from=", requested[0])
+        self.assertEqual(len(store), 5)
+
+    async def test_update_cdx_store_same_second(self):
+        """Are captures of other urls in the same second as the latest stored one kept?"""
+
+        store = CdxStore(self.test_path, "someurl.com")
+        store.append(self.rows, complete=True)
+
+        requested = []
+        session = self.get_mock_session(
+            [
+                "com,someurl)/ 20200101000000 BBBB - text/html\n"
+                "com,someurl)/contact 20200101000000 EEEE 1000 text/html\n"
+            ],
+            requested,
+        )
+
+        self.assertEqual(
+            await update_cdx_store(session, "someurl.com", store, asyncio.Semaphore(10)), 1
+        )
+        self.assertIn("&from=20200101000000", requested[0])
+        self.assertEqual(store.get_urlkey(5), "com,someurl)/contact")
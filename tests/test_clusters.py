@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+from wayback_google_analytics.clusters import (
+    get_account_id,
+    cluster_sightings,
+    UnionFind,
+)
+
+
+class ClustersTestCase(TestCase):
+    """Tests for clusters.py"""
+
+    def test_get_account_id(self):
+        """Does get_account_id return the account for UA codes and the code otherwise?"""
+
+        self.assertEqual(get_account_id("UA-12345678-2"), "UA-12345678")
+        self.assertEqual(get_account_id("ua-12345678-10"), "UA-12345678")
+        self.assertEqual(get_account_id("GTM-ABC1234"), "GTM-ABC1234")
+        self.assertEqual(get_account_id("G-1234567890"), "G-1234567890")
+
+    def test_union_find(self):
+        """Does UnionFind merge sets and track their sizes?"""
+
+        sets = UnionFind()
+        for item in ["a", "b", "c", "d"]:
+            sets.add(item)
+
+        sets.union("a", "b")
+        root = sets.union("c", "b")
+
+        self.assertEqual(sets.find("a"), sets.find("c"))
+        self.assertNotEqual(sets.find("a"), sets.find("d"))
+        self.assertEqual(sets.size[root], 3)
+
+        """Union of items already in the same set changes nothing"""
+        self.assertEqual(sets.union("a", "c"), root)
+        self.assertEqual(sets.size[root], 3)
+
+    def test_cluster_sightings(self):
+        """Are sites linked through UA accounts and GTM containers into one cluster?"""
+
+        sightings = [
+            ("someurl.com", "UA-12345678-1"),
+            ("otherurl.org", "UA-12345678-2"),
+            ("otherurl.org", "GTM-ABC1234"),
+            ("thirdurl.net", "GTM-ABC1234"),
+            ("unrelated.com", "UA-87654321-1"),
+            ("alsounrelated.com", "G-1234567890"),
+            ("alsounrelated.com", "G-0987654321"),
+        ]
+
+        clusters = cluster_sightings(sightings)
+
+        self.assertEqual(
+            clusters[0],
+            {
+                "id": 0,
+                "size": 3,
+                "urls": ["otherurl.org", "someurl.com", "thirdurl.net"],
+                "accounts": ["GTM-ABC1234", "UA-12345678"],
+            },
+        )
+        self.assertEqual([cluster["size"] for cluster in clusters], [3, 1, 1])
+        self.assertEqual([cluster["id"] for cluster in clusters], [0, 1, 2])
+        self.assertEqual(
+            clusters[1]["accounts"], ["G-0987654321", "G-1234567890"]
+        )
+
+        """min_size drops sites that don't share an account"""
+        self.assertEqual(len(cluster_sightings(sightings, min_size=2)), 1)
@@ -1,6 +1,12 @@
 from unittest import TestCase
 
-from wayback_google_analytics.codes import get_UA_code, get_GA_code, get_GTM_code
+from wayback_google_analytics.codes import (
+    get_UA_code,
+    get_GA_code,
+    get_GTM_code,
+    get_codes_from_bytes,
+    get_script_srcs,
+)
 
 
 class CodesTestCase(TestCase):
@@ -147,4 +153,56 @@ class CodesTestCase(TestCase):
         self.assertIsInstance(get_GTM_code(self.test_html_no_UA_code), list)
         self.assertEqual(len(get_GTM_code(self.test_html_no_UA_code)), 0)
 
-
+    def test_get_codes_from_bytes(self):
+        """Does get_codes_from_bytes find the same codes as the BeautifulSoup path?"""
+
+        for html in [self.test_html_1, self.test_html_2, self.test_html_no_UA_code]:
+            found = get_codes_from_bytes(html.encode())
+            self.assertEqual(sorted(found["UA"]), sorted(get_UA_code(html)))
+            self.assertEqual(sorted(found["GA"]), sorted(get_GA_code(html)))
+            self.assertEqual(sorted(found["GTM"]), sorted(get_GTM_code(html)))
+
+        """Scripts inside comments are skipped, comments inside scripts aren't"""
+        found = get_codes_from_bytes(
+            b"<!-- <script>gtag('config', 'UA-11111111-1');</script> -->"
+            b"<SCRIPT type='text/javascript'><!--\n gtag('config', 'UA-22222222-1'); //--></SCRIPT>"
+        )
+        self.assertEqual(found["UA"], ["UA-22222222-1"])
+
+        """UTF-16 pages are decoded first, with or without a byte order mark"""
+        for encoding in ["utf-16", "utf-16-le", "utf-16-be"]:
+            found = get_codes_from_bytes(self.test_html_1.encode(encoding))
+            self.assertEqual(found["UA"], ["UA-12345678-1"])
+            self.assertEqual(found["GTM"], ["GTM-23451"])
+
+        """Pages in other encodings are scanned as they are"""
+        found = get_codes_from_bytes(
+            "<script>// café\ngtag('config', 'G-1234567890');</script>".encode("latin-1")
+        )
+        self.assertEqual(found["GA"], ["G-1234567890"])
+
+    def test_get_codes_from_script_src(self):
+        """Are codes in script src attributes found by both paths?"""
+
+        html = (
+            '<script async src="https://www.googletagmanager.com/gtag/js?id=G-1234567890"></script>'
+            "<script src='https://www.googletagmanager.com/gtm.js?id=GTM-ABC1234'></script>"
+        )
+
+        found = get_codes_from_bytes(html.encode())
+        self.assertEqual(found["GA"], ["G-1234567890"])
+        self.assertEqual(found["GTM"], ["GTM-ABC1234"])
+        self.assertEqual(get_GA_code(html), ["G-1234567890"])
+        self.assertEqual(get_GTM_code(html), ["GTM-ABC1234"])
+
+    def test_get_script_srcs(self):
+        """Does get_script_srcs return each external script once, in page order?"""
+
+        html = (
+            b'<script src="/js/app.js"></script><script>var a = 1;</script>'
+            b"<script type=text/javascript src=/js/ga.js></script>"
+            b"<!-- <script src='/js/old.js'></script> -->"
+            b"<script src='/js/app.js'></script>"
+        )
+
+        self.assertEqual(get_script_srcs(html), ["/js/app.js", "/js/ga.js"])
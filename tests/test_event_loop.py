@@ -0,0 +1,53 @@
+import asyncio
+import time
+import asynctest
+from unittest.mock import patch
+
+from wayback_google_analytics.event_loop import LoopLagMonitor, install_uvloop
+
+
+def parse_html_slowly():
+    """Stands in for synchronous parsing that blocks the event loop."""
+    time.sleep(0.3)
+
+
+class EventLoopTestCase(asynctest.TestCase):
+    """Tests for event_loop.py"""
+
+    async def test_loop_lag_monitor_reports_blocking(self):
+        """Does LoopLagMonitor detect blocking code and record where it happened?"""
+
+        monitor = LoopLagMonitor(threshold=0.1, interval=0.02, verbose=False).start()
+        await asyncio.sleep(0.1)
+        parse_html_slowly()
+        await asyncio.sleep(0.1)
+        monitor.stop()
+
+        report = monitor.get_report()
+        self.assertGreater(report["samples"], 0)
+        self.assertEqual(report["blocked"], 1)
+        self.assertGreaterEqual(report["max_lag"], 0.2)
+
+        location, count = report["locations"][0]
+        self.assertEqual(count, 1)
+        self.assertIn("parse_html_slowly", location)
+
+    async def test_loop_lag_monitor_no_blocking(self):
+        """Does LoopLagMonitor report no blocking for well-behaved code?"""
+
+        monitor = LoopLagMonitor(threshold=0.1, interval=0.01, verbose=False).start()
+        await asyncio.sleep(0.2)
+        monitor.stop()
+
+        report = monitor.get_report()
+        self.assertGreater(report["samples"], 5)
+        self.assertEqual(report["blocked"], 0)
+        self.assertEqual(report["locations"], [])
+
+    def test_install_uvloop_missing(self):
+        """Does install_uvloop fall back to the default loop if uvloop isn't installed?"""
+
+        with patch.dict("sys.modules", {"uvloop": None}):
+            with patch("asyncio.set_event_loop_policy") as mock_set_policy:
+                self.assertFalse(install_uvloop())
+                mock_set_policy.assert_not_called()
@@ -0,0 +1,179 @@
+import asyncio
+import asynctest
+from asynctest.mock import patch, MagicMock
+import aiohttp
+
+from wayback_google_analytics.gtm import (
+    ContainerCache,
+    get_container_index,
+    get_closest_capture,
+    get_container_codes,
+    expand_gtm_records,
+)
+from wayback_google_analytics.scraper import wait_until
+
+
+class GtmTestCase(asynctest.TestCase):
+    """Tests for gtm.py"""
+
+    @patch("aiohttp.ClientSession.get")
+    async def test_get_container_index(self, mock_get):
+        """Does get_container_index return sorted captures of a container's gtm.js?"""
+
+        mock_response = MagicMock()
+
+        async def mock_text_method():
+            return '[["timestamp","digest"],\n["20190101000000","BBB"],\n["20180101000000","AAA"]]'
+
+        mock_response.text = mock_text_method
+        mock_get.return_value.__aenter__.return_value = mock_response
+
+        async with aiohttp.ClientSession() as session:
+            index = await get_container_index(
+                session, "GTM-ABC1234", asyncio.Semaphore(10)
+            )
+
+        self.assertEqual(index, [("20180101000000", "AAA"), ("20190101000000", "BBB")])
+
+        """Is the gtm.js url encoded, so its query string isn't read as CDX params?"""
+        self.assertIn(
+            "url=www.googletagmanager.com%2Fgtm.js%3Fid%3DGTM-ABC1234&",
+            mock_get.call_args[0][0],
+        )
+
+    def test_get_closest_capture(self):
+        """Does get_closest_capture pick the capture closest in time?"""
+
+        index = [
+            ("20180101000000", "AAA"),
+            ("20181201000000", "BBB"),
+            ("20190201000000", "CCC"),
+        ]
+
+        self.assertEqual(get_closest_capture(index, 20170101000000), ("20180101000000", "AAA"))
+        self.assertEqual(get_closest_capture(index, "20190110000000"), ("20190201000000", "CCC"))
+        self.assertEqual(get_closest_capture(index, "20181215000000"), ("20181201000000", "BBB"))
+        self.assertEqual(get_closest_capture(index, "20200101000000"), ("20190201000000", "CCC"))
+        self.assertIsNone(get_closest_capture([], "20200101000000"))
+
+    @patch("aiohttp.ClientSession.get")
+    async def test_get_container_codes(self, mock_get):
+        """Does get_container_codes return the UA/GA ids a container configures?"""
+
+        mock_response = MagicMock()
+
+        async def mock_read_method():
+            return b'{"vtp_trackingId":"UA-12345678-1","vtp_measurementId":"G-1234567890","x":"UA-12345678-1"}'
+
+        mock_response.read = mock_read_method
+        mock_get.return_value.__aenter__.return_value = mock_response
+
+        async with aiohttp.ClientSession() as session:
+            codes = await get_container_codes(
+                session, "GTM-ABC1234", "20190101000000", asyncio.Semaphore(10)
+            )
+
+        self.assertEqual(codes, {"UA": ["UA-12345678-1"], "GA": ["G-1234567890"]})
+        mock_get.assert_called_once()
+        self.assertEqual(
+            mock_get.call_args[0][0],
+            "https://web.archive.org/web/20190101000000id_/https://www.googletagmanager.com/gtm.js?id=GTM-ABC1234",
+        )
+
+    @patch("wayback_google_analytics.gtm.get_container_codes")
+    @patch("wayback_google_analytics.gtm.get_container_index")
+    async def test_expand_gtm_records(self, mock_index, mock_codes):
+        """Does expand_gtm_records fetch each container version once and add its codes to each snapshot?"""
+
+        mock_index.return_value = [
+            ("20180101000000", "AAA"),
+            ("20190101000000", "AAA"),
+            ("20200101000000", "BBB"),
+        ]
+
+        async def get_codes(session, container, timestamp, semaphore):
+            if timestamp < "20200101000000":
+                return {"UA": ["UA-12345678-1"], "GA": []}
+            return {"UA": [], "GA": ["G-1234567890"]}
+
+        mock_codes.side_effect = get_codes
+
+        records = [
+            (20180201000000, {"UA": [], "GA": [], "GTM": ["GTM-ABC1234"]}),
+            (20190201000000, {"UA": [], "GA": [], "GTM": ["GTM-ABC1234"]}),
+            None,
+            (20190601000000, {"UA": ["UA-11111111-1"], "GA": [], "GTM": []}),
+            (20200201000000, {"UA": [], "GA": [], "GTM": ["GTM-ABC1234"]}),
+        ]
+        cache = ContainerCache()
+
+        expanded = await expand_gtm_records(None, records, asyncio.Semaphore(10), cache)
+
+        self.assertEqual(
+            expanded,
+            [
+                (20180201000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+                (20190201000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+                (20200201000000, {"UA": [], "GA": ["G-1234567890"], "GTM": []}),
+            ],
+        )
+
+        """One index query per container, one fetch per container version"""
+        self.assertEqual(mock_index.call_count, 1)
+        self.assertEqual(mock_codes.call_count, 2)
+
+        """The cache is shared with later urls"""
+        await expand_gtm_records(None, records, asyncio.Semaphore(10), cache)
+        self.assertEqual(mock_index.call_count, 1)
+        self.assertEqual(mock_codes.call_count, 2)
+
+    @patch("wayback_google_analytics.gtm.get_container_codes")
+    @patch("wayback_google_analytics.gtm.get_container_index")
+    async def test_expand_gtm_records_errors(self, mock_index, mock_codes):
+        """Does expand_gtm_records skip containers that can't be retrieved?"""
+
+        mock_index.side_effect = aiohttp.ClientError("CDX unavailable")
+
+        records = [(20180201000000, {"UA": [], "GA": [], "GTM": ["GTM-ABC1234"]})]
+
+        self.assertEqual(
+            await expand_gtm_records(None, records, asyncio.Semaphore(10)), []
+        )
+        mock_codes.assert_not_called()
+
+    @patch("wayback_google_analytics.gtm.get_container_codes")
+    @patch("wayback_google_analytics.gtm.get_container_index")
+    async def test_expand_gtm_records_shared_timeout(self, mock_index, mock_codes):
+        """Does one url timing out leave container lookups it shares with other urls running?"""
+
+        async def get_index(session, container, semaphore):
+            await asyncio.sleep(0.05)
+            return [("20190101000000", "AAA")]
+
+        async def get_codes(session, container, timestamp, semaphore):
+            await asyncio.sleep(0.05)
+            return {"UA": ["UA-12345678-1"], "GA": []}
+
+        mock_index.side_effect = get_index
+        mock_codes.side_effect = get_codes
+
+        records = [(20190201000000, {"UA": [], "GA": [], "GTM": ["GTM-ABC1234"]})]
+        cache = ContainerCache()
+        semaphore = asyncio.Semaphore(10)
+        now = asyncio.get_running_loop().time()
+
+        (_, first_timed_out), (expanded, second_timed_out) = await asyncio.gather(
+            wait_until(
+                expand_gtm_records(None, records, semaphore, cache), now + 0.02, []
+            ),
+            wait_until(
+                expand_gtm_records(None, records, semaphore, cache), now + 5, []
+            ),
+        )
+
+        self.assertTrue(first_timed_out)
+        self.assertFalse(second_timed_out)
+        self.assertEqual(
+            expanded, [(20190201000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []})]
+        )
+        self.assertEqual(mock_index.call_count, 1)
@@ -0,0 +1,67 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+# Slow imports that must only be loaded by the code paths that use them
+HEAVY_MODULES = ["pandas", "numpy", "bs4"]
+
+
+def get_loaded_modules(code):
+    """Runs code in a fresh interpreter and returns which HEAVY_MODULES it loaded."""
+
+    check = f"""
+import sys
+{code}
+print("LOADED:" + ",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+    output = subprocess.run(
+        [sys.executable, "-c", check], capture_output=True, text=True, check=True
+    ).stdout
+    loaded = output.split("LOADED:")[-1].strip()
+    return [m for m in loaded.split(",") if m]
+
+
+class ImportsTestCase(TestCase):
+    """Import-time regression tests, to keep CLI startup fast"""
+
+    def test_main_import_is_lightweight(self):
+        """Does importing the CLI avoid loading pandas, numpy and bs4?"""
+
+        self.assertEqual(get_loaded_modules("import wayback_google_analytics.main"), [])
+
+    def test_help_is_lightweight(self):
+        """Does --help avoid loading pandas, numpy and bs4?"""
+
+        code = """
+from wayback_google_analytics.main import setup_args
+sys.argv = ["wayback-google-analytics", "-h"]
+try:
+    setup_args()
+except SystemExit:
+    pass
+"""
+        self.assertEqual(get_loaded_modules(code), [])
+
+    def test_output_is_lightweight(self):
+        """Does writing json, csv and xlsx output avoid loading pandas?"""
+
+        for output_type in ["json", "csv", "xlsx"]:
+            with self.subTest(output_type=output_type):
+                code = f"""
+import os, tempfile
+from wayback_google_analytics.output import write_output
+path = os.path.join(tempfile.mkdtemp(), "results.{output_type}")
+write_output(path, "{output_type}", [{{"someurl.com": {{"current_UA_code": ["UA-1"]}}}}])
+"""
+                self.assertEqual(get_loaded_modules(code), [])
+
+    def test_heavy_modules_load_when_needed(self):
+        """Are pandas and bs4 still loaded by the code paths that need them?"""
+
+        code = """
+from wayback_google_analytics.codes import get_UA_code
+from wayback_google_analytics.output import get_urls_df
+get_UA_code("<script>UA-12345678-1</script>")
+get_urls_df([])
+"""
+        self.assertEqual(set(get_loaded_modules(code)), {"pandas", "numpy", "bs4"})
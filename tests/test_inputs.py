@@ -0,0 +1,102 @@
+import os
+from shutil import rmtree
+from unittest import TestCase
+
+from wayback_google_analytics.inputs import get_input_format, iter_urls
+
+
+class InputsTestCase(TestCase):
+    """Tests for inputs.py"""
+
+    def setUp(self):
+        """Create test input directory"""
+        self.test_path = "./test_inputs"
+        if not os.path.exists(self.test_path):
+            os.makedirs(self.test_path)
+
+    def tearDown(self):
+        """Removes any created directories after each test"""
+        if os.path.exists(self.test_path):
+            rmtree(self.test_path)
+
+    def write_file(self, name, contents):
+        path = os.path.join(self.test_path, name)
+        with open(path, "w") as f:
+            f.write(contents)
+        return path
+
+    def test_get_input_format(self):
+        """Does get_input_format guess format from file extension?"""
+
+        self.assertEqual(get_input_format("urls.csv"), "csv")
+        self.assertEqual(get_input_format("urls.jsonl"), "jsonl")
+        self.assertEqual(get_input_format("urls.ndjson"), "jsonl")
+        self.assertEqual(get_input_format("urls.txt"), "txt")
+        self.assertEqual(get_input_format("urls.md"), "txt")
+        self.assertEqual(get_input_format("-"), "txt")
+
+        """Does an explicit format take precedence?"""
+        self.assertEqual(get_input_format("urls.txt", "csv"), "csv")
+
+        """Raises ValueError with invalid format"""
+        with self.assertRaises(ValueError):
+            get_input_format("urls.txt", "xml")
+
+    def test_iter_urls_txt(self):
+        """Does iter_urls yield one url per line, skipping blanks and comments?"""
+
+        path = self.write_file(
+            "urls.txt", "https://someurl.com\n\n# comment\n  https://otherurl.org  \n"
+        )
+
+        self.assertEqual(
+            list(iter_urls(path)), ["https://someurl.com", "https://otherurl.org"]
+        )
+
+    def test_iter_urls_csv(self):
+        """Does iter_urls read urls from the right csv column?"""
+
+        path = self.write_file(
+            "urls.csv", "name,URL\nsome,https://someurl.com\nother,https://otherurl.org\n"
+        )
+
+        """Uses url column from header by default"""
+        self.assertEqual(
+            list(iter_urls(path)), ["https://someurl.com", "https://otherurl.org"]
+        )
+
+        """Uses column by name or index"""
+        self.assertEqual(list(iter_urls(path, column="name")), ["some", "other"])
+        self.assertEqual(
+            list(iter_urls(path, column="1")),
+            ["URL", "https://someurl.com", "https://otherurl.org"],
+        )
+
+        """Raises ValueError if column is missing"""
+        with self.assertRaises(ValueError):
+            list(iter_urls(path, column="site"))
+
+        """Uses first column when there is no header"""
+        path = self.write_file("no_header.csv", "https://someurl.com,1\nhttps://otherurl.org,2\n")
+        self.assertEqual(
+            list(iter_urls(path)), ["https://someurl.com", "https://otherurl.org"]
+        )
+
+    def test_iter_urls_jsonl(self):
+        """Does iter_urls read urls from json lines?"""
+
+        path = self.write_file(
+            "urls.jsonl",
+            '{"url": "https://someurl.com"}\n\n"https://otherurl.org"\n{"site": "x"}\n',
+        )
+
+        self.assertEqual(
+            list(iter_urls(path)), ["https://someurl.com", "https://otherurl.org"]
+        )
+        self.assertEqual(list(iter_urls(path, column="site")), ["https://otherurl.org", "x"])
+
+    def test_iter_urls_file_not_found(self):
+        """Does iter_urls raise FileNotFoundError before iterating?"""
+
+        with self.assertRaises(FileNotFoundError):
+            iter_urls(os.path.join(self.test_path, "missing.txt"))
@@ -0,0 +1,185 @@
+import os
+from shutil import rmtree
+import asynctest
+
+from wayback_google_analytics.job_queue import JobQueue, run_queue_worker
+
+
+class JobQueueTestCase(asynctest.TestCase):
+    """Tests for job_queue.py"""
+
+    def setUp(self):
+        """Create test job database"""
+        self.test_path = "./test_job_queue"
+        if not os.path.exists(self.test_path):
+            os.makedirs(self.test_path)
+        self.db_path = os.path.join(self.test_path, "job.db")
+        self.queue = JobQueue(self.db_path)
+
+    def tearDown(self):
+        """Removes any created directories after each test"""
+        self.queue.close()
+        if os.path.exists(self.test_path):
+            rmtree(self.test_path)
+
+    def test_set_options(self):
+        """Does set_options keep the options a job was created with?"""
+
+        self.queue.set_options(limit=10, skip_current=True)
+        options = self.queue.set_options(limit=50, skip_current=False)
+
+        self.assertEqual(options["limit"], 10)
+        self.assertEqual(options["skip_current"], True)
+        self.assertIsNone(options["frequency"])
+
+    def test_add_urls(self):
+        """Does add_urls ignore urls that are already queued?"""
+
+        self.assertEqual(self.queue.add_urls(["someurl.com", "otherurl.org"]), 2)
+        self.assertEqual(self.queue.add_urls(["someurl.com", "thirdurl.net"]), 1)
+        self.assertEqual(self.queue.get_counts(), {"pending": 3})
+
+    def test_lease_and_complete(self):
+        """Do completed url items queue snapshot pages, and do pages merge into results?"""
+
+        self.queue.add_urls(["someurl.com"])
+
+        item = self.queue.lease("worker-1")
+        self.assertEqual(item["kind"], "url")
+
+        """Nothing else to lease while the url item is leased"""
+        self.assertIsNone(self.queue.lease("worker-2"))
+
+        timestamps = ["20120101000000", "20130101000000", "20140101000000"]
+        current = {"current_UA_code": ["UA-12345678-1"]}
+        self.assertTrue(
+            self.queue.complete_url(item, "worker-1", current, timestamps, page_size=2)
+        )
+        self.assertEqual(self.queue.get_counts(), {"done": 1, "pending": 2})
+
+        page_1 = self.queue.lease("worker-1")
+        page_2 = self.queue.lease("worker-2")
+        self.assertEqual(page_1["payload"], timestamps[:2])
+        self.assertEqual(page_2["payload"], timestamps[2:])
+
+        self.queue.complete_snapshots(
+            page_1,
+            "worker-1",
+            {
+                "UA_codes": {
+                    "UA-12345678-1": {
+                        "first_seen": "01/01/2012:00:00",
+                        "last_seen": "01/01/2013:00:00",
+                    }
+                },
+                "GA_codes": {},
+                "GTM_codes": {},
+            },
+        )
+        self.queue.complete_snapshots(
+            page_2,
+            "worker-2",
+            {
+                "UA_codes": {
+                    "UA-12345678-1": {
+                        "first_seen": "01/01/2014:00:00",
+                        "last_seen": "01/01/2014:00:00",
+                    }
+                },
+                "GA_codes": {},
+                "GTM_codes": {"GTM-12345": {
+                    "first_seen": "01/01/2014:00:00",
+                    "last_seen": "01/01/2014:00:00",
+                }},
+            },
+        )
+
+        self.assertTrue(self.queue.is_finished())
+        self.assertEqual(
+            self.queue.get_results(),
+            [
+                {
+                    "someurl.com": {
+                        "current_UA_code": ["UA-12345678-1"],
+                        "archived_UA_codes": {
+                            "UA-12345678-1": {
+                                "first_seen": "01/01/2012:00:00",
+                                "last_seen": "01/01/2014:00:00",
+                            }
+                        },
+                        "archived_GA_codes": {},
+                        "archived_GTM_codes": {
+                            "GTM-12345": {
+                                "first_seen": "01/01/2014:00:00",
+                                "last_seen": "01/01/2014:00:00",
+                            }
+                        },
+                    }
+                }
+            ],
+        )
+
+    def test_expired_lease(self):
+        """Are expired leases retried, and are results from a lost lease discarded?"""
+
+        self.queue.add_urls(["someurl.com"])
+
+        item = self.queue.lease("worker-1", lease_seconds=-1)
+        retried = self.queue.lease("worker-2")
+        self.assertEqual(retried["id"], item["id"])
+
+        """worker-1 lost its lease, so its heartbeat and results are rejected"""
+        self.assertFalse(self.queue.heartbeat(item, "worker-1"))
+        self.assertFalse(self.queue.complete_url(item, "worker-1", None, ["20120101000000"]))
+        self.assertTrue(self.queue.heartbeat(retried, "worker-2"))
+        self.assertTrue(self.queue.complete_url(retried, "worker-2", None, []))
+        self.assertEqual(self.queue.get_counts(), {"done": 1})
+
+    def test_fail(self):
+        """Are failed items retried until max_attempts?"""
+
+        self.queue.add_urls(["someurl.com"])
+
+        for _ in range(3):
+            item = self.queue.lease("worker-1")
+            self.queue.fail(item, "worker-1", ValueError("error"))
+
+        self.assertIsNone(self.queue.lease("worker-1"))
+        self.assertEqual(self.queue.get_counts(), {"failed": 1})
+        self.assertTrue(self.queue.is_finished())
+
+    @asynctest.patch("wayback_google_analytics.job_queue.get_codes_from_snapshots")
+    @asynctest.patch("wayback_google_analytics.job_queue.get_snapshot_timestamps")
+    @asynctest.patch("wayback_google_analytics.job_queue.get_current_codes")
+    async def test_run_queue_worker(self, mock_current, mock_timestamps, mock_codes):
+        """Does run_queue_worker work through url and snapshot items until the job is done?"""
+
+        mock_current.return_value = {"current_GA_code": ["G-1234567890"]}
+        mock_timestamps.return_value = [f"201{i}0101000000" for i in range(5)]
+        mock_codes.return_value = {
+            "UA_codes": {},
+            "GA_codes": {
+                "G-1234567890": {
+                    "first_seen": "01/01/2010:00:00",
+                    "last_seen": "01/01/2010:00:00",
+                }
+            },
+            "GTM_codes": {},
+        }
+
+        self.queue.set_options(limit=5, skip_current=False)
+        self.queue.add_urls(["someurl.com", "otherurl.org"])
+
+        counts = await run_queue_worker(
+            self.db_path, concurrency=3, page_size=2, poll_interval=0.1
+        )
+
+        self.assertEqual(counts, {"done": 8})
+        self.assertEqual(mock_current.call_count, 2)
+        self.assertEqual(mock_codes.call_count, 6)
+        self.assertEqual(mock_timestamps.call_args[1]["limit"], 5)
+
+        results = self.queue.get_results()
+        self.assertEqual([next(iter(entry)) for entry in results], ["someurl.com", "otherurl.org"])
+        self.assertEqual(results[0]["someurl.com"]["current_GA_code"], ["G-1234567890"])
+        self.assertIn("G-1234567890", results[1]["otherurl.org"]["archived_GA_codes"])
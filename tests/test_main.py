@@ -1,5 +1,13 @@
-from wayback_google_analytics.main import main, setup_args
+from wayback_google_analytics.main import (
+    main,
+    setup_args,
+    setup_worker_args,
+    setup_lookup_args,
+    setup_watch_args,
+)
+import asyncio
 import unittest
+from unittest.mock import patch
 import sys
 from io import StringIO
 
@@ -137,3 +145,143 @@ class TestMain(unittest.TestCase):
         self.assertEqual(args.frequency, "daily")
         self.assertEqual(args.limit, "10")
         self.assertEqual(args.skip_current, True)
+
+    def test_setup_args_stream(self):
+        """Does setup_args parse stream mode options?"""
+
+        sys.argv = [
+            "main.py",
+            "-i",
+            "-",
+            "--stream",
+            "--input_format",
+            "csv",
+            "--input_column",
+            "domain",
+            "--pool_size",
+            "8",
+        ]
+        args = setup_args()
+
+        self.assertEqual(args.input_file, "-")
+        self.assertEqual(args.stream, True)
+        self.assertEqual(args.input_format, "csv")
+        self.assertEqual(args.input_column, "domain")
+        self.assertEqual(args.pool_size, 8)
+
+        """Stream mode is off by default"""
+        sys.argv = ["main.py", "-u", "https://www.google.com"]
+        args = setup_args()
+        self.assertEqual(args.stream, False)
+        self.assertEqual(args.pool_size, 5)
+
+    def test_setup_args_plan(self):
+        """Does setup_args parse --plan and --budget?"""
+
+        sys.argv = ["main.py", "-u", "https://www.google.com", "--plan", "--budget", "500"]
+        args = setup_args()
+        self.assertEqual(args.plan, True)
+        self.assertEqual(args.budget, 500)
+
+        """Planning is off by default"""
+        sys.argv = ["main.py", "-u", "https://www.google.com"]
+        args = setup_args()
+        self.assertEqual(args.plan, False)
+        self.assertEqual(args.budget, None)
+
+    @patch("wayback_google_analytics.main.print_plan")
+    @patch("wayback_google_analytics.main.plan_requests")
+    @patch("wayback_google_analytics.main.init_output")
+    def test_main_plan_skips_output(self, mock_init_output, mock_plan, mock_print_plan):
+        """Does --plan print the plan without creating an output file?"""
+
+        sys.argv = ["main.py", "-u", "https://www.google.com", "--plan", "-o", "json"]
+        asyncio.run(main(setup_args()))
+
+        mock_print_plan.assert_called_once_with(mock_plan.return_value)
+        mock_init_output.assert_not_called()
+
+    @patch("wayback_google_analytics.main.init_output")
+    def test_main_budget_rejects_extra_lookups(self, mock_init_output):
+        """Are --plan and --budget rejected with lookups the plan doesn't count?"""
+
+        for flag in ["--expand_gtm", "--fetch_scripts"]:
+            sys.argv = ["main.py", "-u", "https://www.google.com", "--budget", "100", flag]
+            with self.assertRaises(ValueError):
+                asyncio.run(main(setup_args()))
+
+    def test_setup_args_timeouts(self):
+        """Does setup_args parse --url_timeout and --job_timeout?"""
+
+        sys.argv = ["main.py", "-u", "https://www.google.com", "--url_timeout", "300", "--job_timeout", "3600"]
+        args = setup_args()
+        self.assertEqual(args.url_timeout, 300)
+        self.assertEqual(args.job_timeout, 3600)
+
+    def test_setup_args_max_snapshot_kb(self):
+        """Does setup_args parse --max_snapshot_kb?"""
+
+        sys.argv = ["main.py", "-u", "https://www.google.com", "--max_snapshot_kb", "512"]
+        args = setup_args()
+        self.assertEqual(args.max_snapshot_kb, 512)
+
+    def test_setup_args_cdx_dedupe(self):
+        """Is --cdx_dedupe off unless given?"""
+
+        sys.argv = ["main.py", "-u", "https://www.google.com", "--cdx_store", "cdx"]
+        self.assertFalse(setup_args().cdx_dedupe)
+
+        sys.argv += ["--cdx_dedupe"]
+        self.assertTrue(setup_args().cdx_dedupe)
+
+    def test_setup_args_fetch_scripts(self):
+        """Does setup_args parse --fetch_scripts?"""
+
+        sys.argv = ["main.py", "-u", "https://www.google.com", "--fetch_scripts"]
+        args = setup_args()
+        self.assertTrue(args.fetch_scripts)
+
+    def test_setup_worker_args(self):
+        """Does setup_worker_args parse the worker command?"""
+
+        args = setup_worker_args(["job.db", "--pool_size", "3", "-r", "2.5"])
+
+        self.assertEqual(args.job_db, "job.db")
+        self.assertEqual(args.pool_size, 3)
+        self.assertEqual(args.rate_limit, 2.5)
+        self.assertEqual(args.lease_seconds, 60)
+
+        """Requires a job database"""
+        with self.assertRaises(SystemExit):
+            setup_worker_args([])
+
+    def test_setup_lookup_args(self):
+        """Does setup_lookup_args parse the lookup command?"""
+
+        args = setup_lookup_args(["UA-12345678-1", "G-1234567890", "--store", "results.db"])
+
+        self.assertEqual(args.codes, ["UA-12345678-1", "G-1234567890"])
+        self.assertEqual(args.store, "results.db")
+        self.assertEqual(args.json, False)
+
+        """Requires a store"""
+        with self.assertRaises(SystemExit):
+            setup_lookup_args(["UA-12345678-1"])
+
+    def test_setup_watch_args(self):
+        """Does setup_watch_args parse the watch command?"""
+
+        args = setup_watch_args(
+            ["sites.txt", "--store", "watch.db", "--interval", "12", "--changes", "changes.jsonl"]
+        )
+
+        self.assertEqual(args.watchlist, "sites.txt")
+        self.assertEqual(args.store, "watch.db")
+        self.assertEqual(args.interval, 12)
+        self.assertEqual(args.limit, -100)
+        self.assertEqual(args.cycles, None)
+        self.assertEqual(args.changes, "changes.jsonl")
+
+        """Requires a store"""
+        with self.assertRaises(SystemExit):
+            setup_watch_args(["sites.txt"])
@@ -0,0 +1,146 @@
+from unittest import TestCase
+
+from wayback_google_analytics.models import (
+    CodeSighting,
+    UrlResult,
+    format_timestamp,
+    reduce_code_records,
+)
+from wayback_google_analytics.utils import get_date_from_timestamp
+
+
+class ModelsTestCase(TestCase):
+    """Tests for models.py"""
+
+    def test_format_timestamp(self):
+        """Does format_timestamp match get_date_from_timestamp?"""
+
+        for timestamp in ["20121001000000", "20191231235959", "20200229123000"]:
+            with self.subTest(timestamp=timestamp):
+                self.assertEqual(
+                    format_timestamp(int(timestamp)),
+                    get_date_from_timestamp(timestamp),
+                )
+
+    def test_code_sighting(self):
+        """Does CodeSighting keep the first and last timestamps as ints?"""
+
+        sighting = CodeSighting("20190101000000")
+        sighting.add("20150101000000")
+        sighting.add(20200101000000)
+        sighting.add("20170101000000")
+
+        self.assertEqual(sighting.first_seen, 20150101000000)
+        self.assertEqual(sighting.last_seen, 20200101000000)
+        self.assertEqual(
+            sighting.to_dict(),
+            {"first_seen": "01/01/2015:00:00", "last_seen": "01/01/2020:00:00"},
+        )
+
+        """Slots keep instances small"""
+        with self.assertRaises(AttributeError):
+            sighting.extra = True
+
+    def test_url_result_to_dict(self):
+        """Does UrlResult.to_dict return the same format as before?"""
+
+        result = UrlResult("someurl.com")
+        result.current_codes = {
+            "current_UA_code": ["UA-12345678-1"],
+            "current_GA_code": [],
+            "current_GTM_code": [],
+        }
+        result.add_codes("UA", ["UA-12345678-1"], "20190101000000")
+        result.add_codes("UA", ["UA-12345678-1"], "20200101000000")
+        result.add_codes("GTM", ["GTM-12345678"], "20190101000000")
+
+        self.assertEqual(
+            result.to_dict(),
+            {
+                "someurl.com": {
+                    "current_UA_code": ["UA-12345678-1"],
+                    "current_GA_code": [],
+                    "current_GTM_code": [],
+                    "archived_UA_codes": {
+                        "UA-12345678-1": {
+                            "first_seen": "01/01/2019:00:00",
+                            "last_seen": "01/01/2020:00:00",
+                        }
+                    },
+                    "archived_GA_codes": {},
+                    "archived_GTM_codes": {
+                        "GTM-12345678": {
+                            "first_seen": "01/01/2019:00:00",
+                            "last_seen": "01/01/2019:00:00",
+                        }
+                    },
+                }
+            },
+        )
+
+        """Skipped current codes are left out"""
+        self.assertEqual(
+            list(UrlResult("someurl.com").to_dict()["someurl.com"]),
+            ["archived_UA_codes", "archived_GA_codes", "archived_GTM_codes"],
+        )
+
+    def test_reduce_code_records(self):
+        """Does reduce_code_records find the first and last snapshot of each code?"""
+
+        records = [
+            (20190101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+            None,
+            (20150101000000, {"UA": ["UA-12345678-1"], "GA": ["G-1234567890"], "GTM": []}),
+            (20200101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+        ]
+
+        results = reduce_code_records(records)
+
+        self.assertEqual(
+            {
+                code_type: {code: sighting.to_dict() for code, sighting in codes.items()}
+                for code_type, codes in results.items()
+            },
+            {
+                "UA_codes": {
+                    "UA-12345678-1": {
+                        "first_seen": "01/01/2015:00:00",
+                        "last_seen": "01/01/2020:00:00",
+                    }
+                },
+                "GA_codes": {
+                    "G-1234567890": {
+                        "first_seen": "01/01/2015:00:00",
+                        "last_seen": "01/01/2015:00:00",
+                    }
+                },
+                "GTM_codes": {},
+            },
+        )
+
+    def test_reduce_code_records_many_snapshots(self):
+        """Does reduce_code_records keep the earliest and latest sighting, in any record order?"""
+
+        records = [
+            (
+                20120101000000 + day * 1000000,
+                {
+                    "UA": [f"UA-12345678-{day % 3}"],
+                    "GA": [f"G-{day % 7}"] if day % 2 else [],
+                    "GTM": ["GTM-12345678"],
+                },
+            )
+            for day in range(28)
+        ]
+        records.reverse()
+        records.insert(5, None)
+
+        results = reduce_code_records(records)
+
+        self.assertEqual(len(results["UA_codes"]), 3)
+        self.assertEqual(len(results["GA_codes"]), 7)
+        sighting = results["UA_codes"]["UA-12345678-0"]
+        self.assertEqual((sighting.first_seen, sighting.last_seen), (20120101000000, 20120128000000))
+        sighting = results["GTM_codes"]["GTM-12345678"]
+        self.assertEqual((sighting.first_seen, sighting.last_seen), (20120101000000, 20120128000000))
+        self.assertIsInstance(sighting.first_seen, int)
@@ -1,19 +1,26 @@
 from datetime import datetime
+import csv
+import importlib.util
 import json
 import os
 import pandas as pd
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 from unittest.mock import patch, Mock
 from shutil import rmtree
 
 from wayback_google_analytics.output import (
     init_output,
     write_output,
+    OutputWriter,
+    add_to_codes_index,
+    get_codes_rows,
+    get_sighting_rows,
     get_codes_df,
     get_urls_df,
     format_archived_codes,
     format_active,
 )
+from wayback_google_analytics.models import CodeSighting, get_archived_dict
 
 
 class OutputTestCase(TestCase):
@@ -153,61 +160,351 @@ class OutputTestCase(TestCase):
         os.remove(test_file)
         self.assertEqual(test_data, test_results)
 
-    @patch("wayback_google_analytics.output.get_urls_df", autospec=True)
-    @patch("wayback_google_analytics.output.get_codes_df", autospec=True)
-    def test_write_output_csv(self, mock_urls, mock_codes):
+    def test_output_writer_json(self):
+        """Does OutputWriter write the same json as write_output, one entry at a time?"""
+
+        test_file = "./test_output/test_file.json"
+        expected_file = "./test_output/expected_file.json"
+        test_results = [
+            {"someurl.com": {"current_UA_code": ["UA-12345678-1"]}},
+            {"otherurl.org": {"archived_UA_codes": {}}},
+        ]
+
+        with OutputWriter(test_file, "json") as writer:
+            for entry in test_results:
+                writer.write(entry)
+
+        write_output(expected_file, "json", test_results)
+
+        with open(test_file, "r") as f, open(expected_file, "r") as expected:
+            self.assertEqual(f.read(), expected.read())
+
+        """Writes an empty list if there are no entries"""
+        with OutputWriter(test_file, "json"):
+            pass
+
+        with open(test_file, "r") as f:
+            self.assertEqual(json.load(f), [])
+
+    def get_test_results(self):
+        """Returns results for two urls sharing a code."""
+
+        return [
+            {
+                "someurl.com": {
+                    "current_UA_code": ["UA-12345678-1"],
+                    "archived_UA_codes": {
+                        "UA-12345678-1": {
+                            "first_seen": "01/01/2019",
+                            "last_seen": "01/01/2020",
+                        },
+                    },
+                    "archived_GA_codes": {},
+                    "archived_GTM_codes": {},
+                }
+            },
+            {
+                "otherurl.org": {
+                    "archived_UA_codes": {
+                        "UA-12345678-1": {
+                            "first_seen": "01/01/2018",
+                            "last_seen": "01/01/2019",
+                        },
+                    },
+                    "archived_GA_codes": {},
+                    "archived_GTM_codes": {
+                        "GTM-12345678": {
+                            "first_seen": "01/01/2018",
+                            "last_seen": "01/01/2018",
+                        },
+                    },
+                }
+            },
+        ]
+
+    def test_write_output_csv(self):
         """Does write_output write results to correct csv files?"""
 
         test_file = "./test_output/test_file.csv"
         test_file_urls = "./test_output/test_file_urls.csv"
         test_file_codes = "./test_output/test_file_codes.csv"
-        test_results = {"test": "test"}
-        mock_urls.return_value = pd.DataFrame([test_results])
-        mock_codes.return_value = pd.DataFrame([test_results])
-
-        with open(test_file_urls, "w") as f:
-            pass
-
-        with open(test_file_codes, "w") as f:
-            pass
+        test_results = self.get_test_results()
 
         write_output(test_file, "csv", test_results)
 
-        test_data_urls = pd.read_csv(test_file_urls).to_dict(orient="records")[0]
-        test_data_codes = pd.read_csv(test_file_codes).to_dict(orient="records")[0]
+        with open(test_file_urls, newline="") as f:
+            test_data_urls = list(csv.DictReader(f))
+        with open(test_file_codes, newline="") as f:
+            test_data_codes = list(csv.DictReader(f))
 
-        os.remove(test_file_urls)
-        os.remove(test_file_codes)
-
-        self.assertEqual(test_data_urls, test_results)
-        self.assertEqual(test_data_codes, test_results)
+        self.assertEqual(
+            test_data_urls, get_urls_df(test_results).to_dict(orient="records")
+        )
+        self.assertEqual(test_data_urls[0]["UA_Code"], "UA-12345678-1")
+        self.assertEqual(
+            test_data_codes, get_codes_df(test_results).to_dict(orient="records")
+        )
+        self.assertEqual(
+            test_data_codes[1]["websites"], "someurl.com, someurl.com, otherurl.org"
+        )
 
-    @patch("wayback_google_analytics.output.get_urls_df", autospec=True)
-    @patch("wayback_google_analytics.output.get_codes_df", autospec=True)
-    def test_write_output_xlsx(self, mock_urls, mock_codes):
+    def test_write_output_xlsx(self):
         """Does write_output write results to correct xlsx file?"""
 
         test_file = "./test_output/test_file.xlsx"
-        test_results = {"test": "test"}
-        mock_urls.return_value = pd.DataFrame([test_results])
-        mock_codes.return_value = pd.DataFrame([test_results])
-
-        with open(test_file, "w") as f:
-            pass
+        test_results = self.get_test_results()
 
         write_output(test_file, "xlsx", test_results)
 
         with pd.ExcelFile(test_file, engine="openpyxl") as xls:
             sheet_names = xls.sheet_names
 
-            df_urls = xls.parse("URLs")
+            df_urls = xls.parse("URLs").fillna("")
             df_codes = xls.parse("Codes")
 
-        os.remove(test_file)
-
         self.assertEqual(sheet_names, ["URLs", "Codes"])
-        self.assertEqual(df_urls.to_dict(orient="records")[0], test_results)
-        self.assertEqual(df_codes.to_dict(orient="records")[0], test_results)
+        self.assertEqual(
+            df_urls.to_dict(orient="records"),
+            get_urls_df(test_results).to_dict(orient="records"),
+        )
+        self.assertEqual(
+            df_codes.to_dict(orient="records"),
+            get_codes_df(test_results).to_dict(orient="records"),
+        )
+
+    def test_write_output_csv_xlsx_timeline(self):
+        """Are timeline results written to csv and xlsx like plain results?"""
+
+        test_results = self.get_test_results()
+        for entry in test_results:
+            for info in entry.values():
+                info["timeline_UA_codes"] = {
+                    code: [sighting]
+                    for code, sighting in info["archived_UA_codes"].items()
+                }
+                info["timeline_GA_codes"] = {}
+                info["timeline_GTM_codes"] = {}
+        expected_codes = get_codes_df(self.get_test_results()).to_dict(orient="records")
+
+        write_output("./test_output/test_file.csv", "csv", test_results)
+        with open("./test_output/test_file_codes.csv", newline="") as f:
+            self.assertEqual(list(csv.DictReader(f)), expected_codes)
+
+        write_output("./test_output/test_file.xlsx", "xlsx", test_results)
+        with pd.ExcelFile("./test_output/test_file.xlsx", engine="openpyxl") as xls:
+            df_codes = xls.parse("Codes")
+        self.assertEqual(df_codes.to_dict(orient="records"), expected_codes)
+
+    def test_write_output_csv_truncated(self):
+        """Are truncated results (with coverage) written to csv like plain results?"""
+
+        test_results = self.get_test_results()
+        for entry in test_results:
+            for info in entry.values():
+                info["truncated"] = True
+                info["coverage"] = {"snapshots": 3, "fetched": 2, "failed": 1}
+
+        write_output("./test_output/test_file.csv", "csv", test_results)
+
+        with open("./test_output/test_file_urls.csv", newline="") as f:
+            test_data_urls = list(csv.DictReader(f))
+        with open("./test_output/test_file_codes.csv", newline="") as f:
+            test_data_codes = list(csv.DictReader(f))
+
+        self.assertEqual(
+            test_data_urls,
+            get_urls_df(self.get_test_results()).to_dict(orient="records"),
+        )
+        self.assertEqual(
+            test_data_codes,
+            get_codes_df(self.get_test_results()).to_dict(orient="records"),
+        )
+
+    def test_output_writer_csv_incremental(self):
+        """Does OutputWriter write url rows to csv as entries arrive?"""
+
+        test_file = "./test_output/test_file.csv"
+        test_results = self.get_test_results()
+
+        with OutputWriter(test_file, "csv") as writer:
+            writer.write(test_results[0])
+            writer._file.flush()
+
+            with open("./test_output/test_file_urls.csv", newline="") as f:
+                rows = list(csv.DictReader(f))
+
+            self.assertEqual([row["url"] for row in rows], ["someurl.com"])
+
+            writer.write(test_results[1])
+
+        with open("./test_output/test_file_codes.csv", newline="") as f:
+            self.assertEqual(len(list(csv.DictReader(f))), 2)
+
+    def test_get_sighting_rows(self):
+        """Does get_sighting_rows return one row per code with real dates?"""
+
+        rows = get_sighting_rows(
+            "someurl.com",
+            {
+                "current_UA_code": ["UA-12345678-1"],
+                "current_GA_code": ["G-1234567890"],
+                "archived_UA_codes": {
+                    "UA-12345678-1": {
+                        "first_seen": "01/01/2019:12:30",
+                        "last_seen": "01/01/2020:00:00",
+                    },
+                    "UA-12345678-2": {
+                        "first_seen": "01/01/2015:00:00",
+                        "last_seen": "01/01/2016:00:00",
+                    },
+                },
+            },
+        )
+
+        self.assertEqual(
+            rows,
+            [
+                {
+                    "url": "someurl.com",
+                    "code": "UA-12345678-1",
+                    "code_type": "UA",
+                    "first_seen": datetime(2019, 1, 1, 12, 30),
+                    "last_seen": datetime(2020, 1, 1),
+                    "is_current": True,
+                },
+                {
+                    "url": "someurl.com",
+                    "code": "UA-12345678-2",
+                    "code_type": "UA",
+                    "first_seen": datetime(2015, 1, 1),
+                    "last_seen": datetime(2016, 1, 1),
+                    "is_current": False,
+                },
+                {
+                    "url": "someurl.com",
+                    "code": "G-1234567890",
+                    "code_type": "GA",
+                    "first_seen": None,
+                    "last_seen": None,
+                    "is_current": True,
+                },
+            ],
+        )
+
+    def test_get_sighting_rows_seconds(self):
+        """Do dates from the scraper keep their seconds, which the formatted dates drop?"""
+
+        sighting = CodeSighting(20190101123456)
+        sighting.add(20200101000059)
+
+        rows = get_sighting_rows(
+            "someurl.com",
+            {"archived_UA_codes": get_archived_dict({"UA-12345678-1": sighting})},
+        )
+
+        self.assertEqual(rows[0]["first_seen"], datetime(2019, 1, 1, 12, 34, 56))
+        self.assertEqual(rows[0]["last_seen"], datetime(2020, 1, 1, 0, 0, 59))
+
+        """Json output is unchanged"""
+        self.assertEqual(
+            json.loads(json.dumps(sighting.to_dict())),
+            {"first_seen": "01/01/2019:12:34", "last_seen": "01/01/2020:00:00"},
+        )
+
+    @skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_write_output_columnar(self):
+        """Does write_output write parquet and arrow files in row groups?"""
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        test_results = self.get_test_results() * 3
+
+        with patch("wayback_google_analytics.output.ROW_GROUP_SIZE", 3):
+            write_output("./test_output/test_file.parquet", "parquet", test_results)
+            write_output("./test_output/test_file.arrow", "arrow", test_results)
+
+        parquet_file = pq.ParquetFile("./test_output/test_file.parquet")
+        parquet_table = parquet_file.read()
+        with pa.memory_map("./test_output/test_file.arrow") as source:
+            arrow_table = pa.ipc.open_file(source).read_all()
+
+        """Is each entry's batch of rows written as it arrives?"""
+        self.assertGreater(parquet_file.num_row_groups, 1)
+
+        for table in [parquet_table, arrow_table]:
+            self.assertEqual(
+                table.column_names,
+                ["url", "code", "code_type", "first_seen", "last_seen", "is_current"],
+            )
+            self.assertTrue(pa.types.is_timestamp(table.schema.field("first_seen").type))
+            self.assertEqual(table.num_rows, 9)
+            self.assertEqual(
+                table.slice(0, 1).to_pylist()[0],
+                {
+                    "url": "someurl.com",
+                    "code": "UA-12345678-1",
+                    "code_type": "UA",
+                    "first_seen": datetime(2019, 1, 1),
+                    "last_seen": datetime(2020, 1, 1),
+                    "is_current": True,
+                },
+            )
+
+    @patch("wayback_google_analytics.output.importlib.util.find_spec", return_value=None)
+    def test_init_output_columnar_without_pyarrow(self, mock_find_spec):
+        """Does init_output raise ValueError for parquet/arrow if pyarrow isn't installed?"""
+
+        for type in ["parquet", "arrow"]:
+            with self.subTest(type=type):
+                with self.assertRaises(ValueError):
+                    init_output(type, output_dir=self.test_path)
+
+    def test_write_output_xlsx_no_codes(self):
+        """Does write_output write a message to the codes sheet if no codes were found?"""
+
+        test_file = "./test_output/test_file.xlsx"
+
+        write_output(test_file, "xlsx", [{"someurl.com": {}}])
+
+        with pd.ExcelFile(test_file, engine="openpyxl") as xls:
+            df_codes = xls.parse("Codes")
+
+        self.assertEqual(
+            df_codes.to_dict(orient="records"), [{"Message": "No codes found."}]
+        )
+
+    def test_add_to_codes_index(self):
+        """Does add_to_codes_index index codes by every website they were seen on?"""
+
+        codes_index = {}
+        for entry in self.get_test_results():
+            for url, info in entry.items():
+                add_to_codes_index(codes_index, url, info)
+
+        self.assertEqual(
+            codes_index,
+            {
+                "UA-12345678-1": {
+                    "websites": ["someurl.com", "someurl.com", "otherurl.org"],
+                    "active": [
+                        "Current (at someurl.com)",
+                        "01/01/2019 - 01/01/2020(at someurl.com)",
+                        "01/01/2018 - 01/01/2019(at otherurl.org)",
+                    ],
+                },
+                "GTM-12345678": {
+                    "websites": ["otherurl.org"],
+                    "active": ["01/01/2018 - 01/01/2018(at otherurl.org)"],
+                },
+            },
+        )
+
+        """Are rows sorted by code?"""
+        self.assertEqual(
+            [row["code"] for row in get_codes_rows(codes_index)],
+            ["GTM-12345678", "UA-12345678-1"],
+        )
 
     def test_get_urls_df(self):
         """Does get_urls_df create appropriate df from dict?"""
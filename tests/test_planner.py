@@ -0,0 +1,110 @@
+import asyncio
+import asynctest
+from asynctest.mock import patch
+
+from wayback_google_analytics.planner import (
+    stratified_sample,
+    allocate_budget,
+    plan_requests,
+    get_cdx_cache,
+    format_duration,
+)
+
+
+class PlannerTestCase(asynctest.TestCase):
+    """Tests for planner.py"""
+
+    def test_stratified_sample(self):
+        """Does stratified_sample spread picks over time rather than by count?"""
+
+        # A burst of captures in 2012, then one a year
+        timestamps = [f"201201{day:02d}000000" for day in range(1, 29)]
+        timestamps += [f"20{year}0101000000" for year in range(13, 20)]
+
+        sample = stratified_sample(timestamps, 8)
+
+        self.assertEqual(len(sample), 8)
+        self.assertEqual(sample, sorted(sample))
+        self.assertEqual(sample[0], "20120101000000")
+        self.assertEqual(
+            sum(timestamp.startswith("2012") for timestamp in sample), 1
+        )
+
+        """Are slots left by empty strata filled?"""
+        sample = stratified_sample(timestamps, 20)
+        self.assertEqual(len(sample), 20)
+        self.assertEqual(len(set(sample)), 20)
+
+        """Are all timestamps kept if the sample is large enough?"""
+        self.assertEqual(stratified_sample(timestamps, 100), timestamps)
+        self.assertEqual(stratified_sample(timestamps, 0), [])
+
+    def test_allocate_budget(self):
+        """Does allocate_budget give small domains all their snapshots and split the rest?"""
+
+        sizes = allocate_budget(
+            {"small.com": 5, "big.com": 1000, "bigger.com": 5000},
+            {"small.com": 1, "big.com": 1, "bigger.com": 2},
+            305,
+        )
+
+        self.assertEqual(sizes, {"small.com": 5, "big.com": 100, "bigger.com": 100})
+
+        self.assertEqual(allocate_budget({"small.com": 5}, {"small.com": 1}, 0), {"small.com": 0})
+
+    @patch("wayback_google_analytics.planner.get_snapshot_rows")
+    async def test_plan_requests(self, mock_index):
+        """Does plan_requests count one CDX query per domain and sample to fit the budget?"""
+
+        async def mock_get_index(session, url, **kwargs):
+            if "example.com" in url:
+                return [(f"20{year}0101000000", 1000) for year in range(10, 20)]
+            return [("20150101000000", 500), ("20160101000000", None)]
+
+        mock_index.side_effect = mock_get_index
+        urls = ["example.com", "https://www.example.com/", "example.com/about", "otherurl.org"]
+        kwargs = {
+            "session": None,
+            "urls": urls,
+            "start_date": None,
+            "end_date": None,
+            "frequency": None,
+            "limit": None,
+            "semaphore": asyncio.Semaphore(10),
+            "rate_limit": 2,
+        }
+
+        plan = await plan_requests(**kwargs)
+
+        """Equivalent urls are planned once and each domain is queried once"""
+        self.assertEqual(mock_index.call_count, 2)
+        self.assertEqual([entry["url"] for entry in plan["urls"]], ["example.com", "example.com/about", "otherurl.org"])
+        self.assertEqual([entry["requests"] for entry in plan["urls"]], [12, 11, 4])
+        self.assertEqual(plan["requests"], 27)
+
+        """Captures of unknown size count as 0 bytes"""
+        self.assertEqual(plan["bytes"], 20500)
+        self.assertEqual(plan["seconds"], 13.5)
+
+        """With a budget, snapshots are sampled to fit"""
+        mock_index.reset_mock()
+        plan = await plan_requests(budget=16, **kwargs)
+
+        self.assertEqual(plan["requests"], 15)
+        self.assertEqual(len(plan["timestamps"]["example.com"]), 4)
+        self.assertEqual(plan["timestamps"]["otherurl.org"], ["20150101000000", "20160101000000"])
+
+        """Budgets too small for the CDX queries and live pages are refused"""
+        with self.assertRaises(ValueError):
+            await plan_requests(budget=4, **kwargs)
+
+        """The run reuses the planned timestamps"""
+        cdx_cache = get_cdx_cache(plan)
+        self.assertEqual(await cdx_cache["otherurl.org"], ["20150101000000", "20160101000000"])
+
+    def test_format_duration(self):
+        """Does format_duration shorten durations?"""
+
+        self.assertEqual(format_duration(42.4), "42s")
+        self.assertEqual(format_duration(725), "12m 5s")
+        self.assertEqual(format_duration(12000), "3h 20m")
@@ -0,0 +1,64 @@
+import asyncio
+import multiprocessing
+import time
+import asynctest
+
+from wayback_google_analytics.rate_limit import RateLimiter, RateLimitedSemaphore
+
+
+def reserve_slots(limiter, count):
+    """Reserves slots from a separate process."""
+    for _ in range(count):
+        limiter.reserve()
+
+
+class RateLimitTestCase(asynctest.TestCase):
+    """Tests for rate_limit.py"""
+
+    def test_rate_limiter_reserve(self):
+        """Does RateLimiter space reserved slots by 1 / rate seconds?"""
+
+        limiter = RateLimiter(10)
+        delays = [limiter.reserve() for _ in range(3)]
+
+        self.assertAlmostEqual(delays[0], 0, delta=0.01)
+        self.assertAlmostEqual(delays[1], 0.1, delta=0.01)
+        self.assertAlmostEqual(delays[2], 0.2, delta=0.01)
+        self.assertAlmostEqual(limiter.backlog(), 0.3, delta=0.01)
+
+    def test_rate_limiter_invalid_rate(self):
+        """Does RateLimiter raise ValueError for a rate <= 0?"""
+
+        with self.assertRaises(ValueError):
+            RateLimiter(0)
+
+    def test_rate_limiter_shared_between_processes(self):
+        """Do slots reserved in another process count against the same budget?"""
+
+        limiter = RateLimiter(10)
+        process = multiprocessing.Process(target=reserve_slots, args=(limiter, 5))
+        process.start()
+        process.join()
+
+        self.assertAlmostEqual(limiter.reserve(), 0.5, delta=0.05)
+
+    async def test_rate_limited_semaphore(self):
+        """Does RateLimitedSemaphore limit concurrency and request rate?"""
+
+        semaphore = RateLimitedSemaphore(2, RateLimiter(50))
+        in_progress = 0
+        max_in_progress = 0
+
+        async def request():
+            nonlocal in_progress, max_in_progress
+            async with semaphore:
+                in_progress += 1
+                max_in_progress = max(max_in_progress, in_progress)
+                await asyncio.sleep(0.01)
+                in_progress -= 1
+
+        start = time.time()
+        await asyncio.gather(*[request() for _ in range(10)])
+
+        self.assertLessEqual(max_in_progress, 2)
+        self.assertGreaterEqual(time.time() - start, 9 / 50)
@@ -0,0 +1,315 @@
+import asyncio
+import asynctest
+
+from wayback_google_analytics.models import CodeSighting
+from wayback_google_analytics.scraper import (
+    process_url,
+    get_analytics_codes,
+    stream_analytics_codes,
+)
+
+
+class ScraperTestCase(asynctest.TestCase):
+    """Tests for scraper.py"""
+
+    @asynctest.patch("wayback_google_analytics.scraper.asyncio.sleep")
+    @asynctest.patch("wayback_google_analytics.scraper.get_sightings_from_snapshots")
+    @asynctest.patch("wayback_google_analytics.scraper.get_snapshot_timestamps")
+    async def test_get_analytics_codes_dedupes_urls(
+        self, mock_timestamps, mock_codes, mock_sleep
+    ):
+        """Does get_analytics_codes query each domain and canonical url only once?"""
+
+        mock_timestamps.return_value = ["20120101000000"]
+        mock_codes.return_value = {
+            "UA_codes": {"UA-12345678-1": CodeSighting("20120101000000")},
+            "GA_codes": {},
+            "GTM_codes": {},
+        }
+
+        urls = [
+            "example.com",
+            "otherurl.org",
+            "https://www.example.com/",
+            "example.com/about",
+        ]
+
+        results = await get_analytics_codes(
+            session=None, urls=urls, semaphore=asyncio.Semaphore(10), skip_current=True
+        )
+
+        """One CDX query per domain, one snapshot extraction per canonical url"""
+        self.assertEqual(mock_timestamps.call_count, 2)
+        self.assertEqual(mock_codes.call_count, 3)
+
+        """Every url gets a result, in input order"""
+        self.assertEqual([next(iter(entry)) for entry in results], urls)
+        self.assertEqual(
+            results[0]["example.com"], results[2]["https://www.example.com/"]
+        )
+        self.assertIsNot(
+            results[0]["example.com"], results[2]["https://www.example.com/"]
+        )
+        self.assertEqual(
+            results[0]["example.com"]["archived_UA_codes"],
+            {
+                "UA-12345678-1": {
+                    "first_seen": "01/01/2012:00:00",
+                    "last_seen": "01/01/2012:00:00",
+                }
+            },
+        )
+
+    @asynctest.patch("wayback_google_analytics.scraper.get_records_from_snapshots")
+    @asynctest.patch("wayback_google_analytics.scraper.get_snapshot_timestamps")
+    async def test_process_url_timeline(self, mock_timestamps, mock_records):
+        """Does process_url add timelines with gaps in timeline mode?"""
+
+        mock_timestamps.return_value = ["20120101000000", "20150101000000", "20190101000000"]
+        mock_records.return_value = [
+            (20120101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+            (20150101000000, {"UA": [], "GA": [], "GTM": []}),
+            (20190101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+        ]
+
+        result = await process_url(
+            session=None,
+            url="someurl.com",
+            start_date=None,
+            end_date=None,
+            frequency=None,
+            limit=None,
+            semaphore=asyncio.Semaphore(10),
+            skip_current=True,
+            timeline=True,
+        )
+
+        self.assertEqual(
+            result["someurl.com"]["archived_UA_codes"]["UA-12345678-1"],
+            {"first_seen": "01/01/2012:00:00", "last_seen": "01/01/2019:00:00"},
+        )
+        self.assertEqual(
+            result["someurl.com"]["timeline_UA_codes"]["UA-12345678-1"],
+            [
+                {"first_seen": "01/01/2012:00:00", "last_seen": "01/01/2012:00:00"},
+                {"first_seen": "01/01/2019:00:00", "last_seen": "01/01/2019:00:00"},
+            ],
+        )
+        self.assertEqual(result["someurl.com"]["timeline_GA_codes"], {})
+
+    @asynctest.patch("wayback_google_analytics.scraper.get_records_from_snapshots")
+    @asynctest.patch("wayback_google_analytics.scraper.get_snapshot_timestamps")
+    async def test_process_url_progressive(self, mock_timestamps, mock_records):
+        """Does process_url fetch snapshots coarse to fine in progressive mode?"""
+
+        mock_timestamps.return_value = ["20120101000000", "20120102000000", "20130101000000"]
+        mock_records.return_value = [
+            (20120101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+            (20130101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+            (20120102000000, {"UA": [], "GA": [], "GTM": []}),
+        ]
+
+        result = await process_url(
+            session=None,
+            url="someurl.com",
+            start_date=None,
+            end_date=None,
+            frequency=None,
+            limit=None,
+            semaphore=asyncio.Semaphore(10),
+            skip_current=True,
+            timeline=True,
+            progressive=True,
+        )
+
+        self.assertEqual(
+            mock_records.call_args[1]["timestamps"],
+            ["20120101000000", "20130101000000", "20120102000000"],
+        )
+
+        """Results don't depend on the order snapshots were fetched in"""
+        self.assertEqual(
+            result["someurl.com"]["timeline_UA_codes"]["UA-12345678-1"],
+            [
+                {"first_seen": "01/01/2012:00:00", "last_seen": "01/01/2012:00:00"},
+                {"first_seen": "01/01/2013:00:00", "last_seen": "01/01/2013:00:00"},
+            ],
+        )
+
+    @asynctest.patch("wayback_google_analytics.scraper.expand_gtm_records")
+    @asynctest.patch("wayback_google_analytics.scraper.get_records_from_snapshots")
+    @asynctest.patch("wayback_google_analytics.scraper.get_snapshot_timestamps")
+    async def test_process_url_expand_gtm(self, mock_timestamps, mock_records, mock_expand):
+        """Does process_url add the codes configured by GTM containers separately?"""
+
+        mock_timestamps.return_value = ["20120101000000", "20130101000000"]
+        mock_records.return_value = [
+            (20120101000000, {"UA": [], "GA": [], "GTM": ["GTM-ABC1234"]}),
+            (20130101000000, {"UA": [], "GA": [], "GTM": ["GTM-ABC1234"]}),
+        ]
+        mock_expand.return_value = [
+            (20120101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+            (20130101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+        ]
+
+        result = await process_url(
+            session=None,
+            url="someurl.com",
+            start_date=None,
+            end_date=None,
+            frequency=None,
+            limit=None,
+            semaphore=asyncio.Semaphore(10),
+            skip_current=True,
+            expand_gtm=True,
+        )
+
+        self.assertEqual(result["someurl.com"]["archived_UA_codes"], {})
+        self.assertEqual(
+            result["someurl.com"]["gtm_UA_codes"],
+            {
+                "UA-12345678-1": {
+                    "first_seen": "01/01/2012:00:00",
+                    "last_seen": "01/01/2013:00:00",
+                }
+            },
+        )
+        self.assertEqual(result["someurl.com"]["gtm_GA_codes"], {})
+
+    @asynctest.patch("wayback_google_analytics.async_utils.get_codes_from_single_timestamp")
+    @asynctest.patch("wayback_google_analytics.scraper.get_snapshot_timestamps")
+    async def test_process_url_timeout(self, mock_timestamps, mock_get_codes):
+        """Does process_url keep the codes found before its timeout and mark them as truncated?"""
+
+        mock_timestamps.return_value = ["20120101000000", "20150101000000", "20190101000000"]
+
+        async def get_codes(session, base_url, timestamp, semaphore, script_cache=None):
+            if timestamp == "20190101000000":
+                await asyncio.sleep(10)
+            return (int(timestamp), {"UA": ["UA-12345678-1"], "GA": [], "GTM": []})
+
+        mock_get_codes.side_effect = get_codes
+
+        result = await process_url(
+            session=None,
+            url="someurl.com",
+            start_date=None,
+            end_date=None,
+            frequency=None,
+            limit=None,
+            semaphore=asyncio.Semaphore(10),
+            skip_current=True,
+            timeout=0.05,
+        )
+
+        self.assertEqual(result["someurl.com"]["truncated"], True)
+        self.assertEqual(
+            result["someurl.com"]["coverage"],
+            {"snapshots": 3, "fetched": 2, "failed": 0},
+        )
+        self.assertEqual(
+            result["someurl.com"]["archived_UA_codes"]["UA-12345678-1"],
+            {"first_seen": "01/01/2012:00:00", "last_seen": "01/01/2015:00:00"},
+        )
+
+        """A CDX query that outlasts the deadline truncates the url without snapshots"""
+
+        async def slow_timestamps(**kwargs):
+            await asyncio.sleep(10)
+
+        mock_timestamps.side_effect = slow_timestamps
+
+        result = await process_url(
+            session=None,
+            url="someurl.com",
+            start_date=None,
+            end_date=None,
+            frequency=None,
+            limit=None,
+            semaphore=asyncio.Semaphore(10),
+            skip_current=True,
+            deadline=asyncio.get_running_loop().time() + 0.05,
+        )
+
+        self.assertEqual(result["someurl.com"]["truncated"], True)
+        self.assertEqual(result["someurl.com"]["archived_UA_codes"], {})
+
+    async def test_stream_analytics_codes(self):
+        """Does stream_analytics_codes yield a result for every url?"""
+
+        async def mock_process_url(session, url, **kwargs):
+            await asyncio.sleep(0)
+            return {url: {}}
+
+        urls = (f"https://someurl{i}.com" for i in range(20))
+
+        with asynctest.mock.patch(
+            "wayback_google_analytics.scraper.process_url", mock_process_url
+        ):
+            results = [
+                entry
+                async for entry in stream_analytics_codes(
+                    session=None, urls=urls, pool_size=3
+                )
+            ]
+
+        self.assertEqual(
+            sorted(url for entry in results for url in entry),
+            sorted(f"https://someurl{i}.com" for i in range(20)),
+        )
+
+    async def test_stream_analytics_codes_bounded(self):
+        """Does stream_analytics_codes keep at most pool_size urls in progress and read input lazily?"""
+
+        in_progress = 0
+        max_in_progress = 0
+        consumed = []
+
+        async def mock_process_url(session, url, **kwargs):
+            nonlocal in_progress, max_in_progress
+            in_progress += 1
+            max_in_progress = max(max_in_progress, in_progress)
+            await asyncio.sleep(0.01)
+            in_progress -= 1
+            return {url: {}}
+
+        def urls():
+            for i in range(1000):
+                consumed.append(i)
+                yield f"https://someurl{i}.com"
+
+        with asynctest.mock.patch(
+            "wayback_google_analytics.scraper.process_url", mock_process_url
+        ):
+            stream = stream_analytics_codes(session=None, urls=urls(), pool_size=4)
+            first = await stream.__anext__()
+            await stream.aclose()
+
+        self.assertIn(next(iter(first)), [f"https://someurl{i}.com" for i in range(12)])
+        self.assertLessEqual(max_in_progress, 4)
+
+        """Only a bounded number of urls should be read from input"""
+        self.assertLess(len(consumed), 20)
+
+    async def test_stream_analytics_codes_errors(self):
+        """Does stream_analytics_codes keep going when a single url fails, and report it?"""
+
+        async def mock_process_url(session, url, **kwargs):
+            if url == "bad":
+                raise ValueError("bad url")
+            return {url: {}}
+
+        with asynctest.mock.patch(
+            "wayback_google_analytics.scraper.process_url", mock_process_url
+        ):
+            results = [
+                entry
+                async for entry in stream_analytics_codes(
+                    session=None, urls=iter(["good", "bad", "also good"]), pool_size=2
+                )
+            ]
+
+        self.assertEqual(
+            sorted(url for entry in results for url in entry), ["also good", "bad", "good"]
+        )
+        self.assertIn({"bad": {"error": "bad url"}}, results)
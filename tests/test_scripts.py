@@ -0,0 +1,202 @@
+import asyncio
+import asynctest
+from asynctest.mock import patch, MagicMock
+import aiohttp
+
+from wayback_google_analytics.scripts import (
+    ScriptCache,
+    resolve_script_url,
+    get_same_site_scripts,
+    get_archived_script_codes,
+    MAX_SCRIPTS_PER_PAGE,
+)
+
+SNAPSHOT_URL = "https://web.archive.org/web/20190101000000/someurl.com"
+
+
+class ScriptsTestCase(asynctest.TestCase):
+    """Tests for scripts.py"""
+
+    def test_resolve_script_url(self):
+        """Does resolve_script_url undo the Wayback Machine's rewriting?"""
+
+        self.assertEqual(
+            resolve_script_url(SNAPSHOT_URL, "/js/app.js"), "http://someurl.com/js/app.js"
+        )
+        self.assertEqual(
+            resolve_script_url(
+                SNAPSHOT_URL, "/web/20190101000000js_/https://cdn.someurl.com/app.js"
+            ),
+            "https://cdn.someurl.com/app.js",
+        )
+        self.assertEqual(
+            resolve_script_url(
+                SNAPSHOT_URL,
+                "https://web.archive.org/web/20190101000000js_/http://www.someurl.com/app.js#v1",
+            ),
+            "http://www.someurl.com/app.js",
+        )
+        self.assertEqual(
+            resolve_script_url("https://someurl.com/blog/", "js/app.js?v=2"),
+            "https://someurl.com/blog/js/app.js?v=2",
+        )
+
+        """Non-http srcs are ignored"""
+        self.assertIsNone(resolve_script_url(SNAPSHOT_URL, "javascript:void(0)"))
+        self.assertIsNone(resolve_script_url(SNAPSHOT_URL, "data:text/javascript,1"))
+
+    def test_get_same_site_scripts(self):
+        """Does get_same_site_scripts keep only scripts from the page's domain and subdomains?"""
+
+        srcs = [
+            "/js/app.js",
+            "/web/20190101000000js_/https://cdn.someurl.com/app.js",
+            "//www.googletagmanager.com/gtag/js?id=G-1234567890",
+            "http://notsomeurl.com/app.js",
+            "/web/20190101000000js_/http://someurl.com/js/app.js",
+        ]
+
+        self.assertEqual(
+            get_same_site_scripts(SNAPSHOT_URL, srcs),
+            ["http://someurl.com/js/app.js", "https://cdn.someurl.com/app.js"],
+        )
+
+        """Pages with many scripts are capped"""
+        srcs = [f"/js/{index}.js" for index in range(MAX_SCRIPTS_PER_PAGE + 5)]
+        self.assertEqual(
+            len(get_same_site_scripts(SNAPSHOT_URL, srcs)), MAX_SCRIPTS_PER_PAGE
+        )
+
+    @patch("aiohttp.ClientSession.get")
+    async def test_get_archived_script_codes(self, mock_get):
+        """Does get_archived_script_codes scan the script as archived?"""
+
+        mock_response = MagicMock()
+
+        async def mock_read_method():
+            return b"ga('create', 'UA-12345678-1', 'auto'); document.write('</script>'); gtag('config', 'G-1234567890');"
+
+        mock_response.read = mock_read_method
+        mock_get.return_value.__aenter__.return_value = mock_response
+
+        async with aiohttp.ClientSession() as session:
+            codes = await get_archived_script_codes(
+                session,
+                "http://someurl.com/js/app.js",
+                "20190101000000",
+                asyncio.Semaphore(10),
+            )
+
+        self.assertEqual(
+            codes, {"UA": ["UA-12345678-1"], "GA": ["G-1234567890"], "GTM": []}
+        )
+        self.assertEqual(
+            mock_get.call_args[0][0],
+            "https://web.archive.org/web/20190101000000id_/http://someurl.com/js/app.js",
+        )
+
+    @patch("wayback_google_analytics.scripts.get_archived_script_codes")
+    @patch("wayback_google_analytics.scripts.get_capture_index")
+    async def test_script_cache_get_codes(self, mock_index, mock_codes):
+        """Does ScriptCache fetch each script version once, keyed by digest?"""
+
+        async def get_index(session, url, semaphore):
+            if "v2" in url:
+                return [("20190101000000", "BBB")]
+            return [("20180101000000", "AAA"), ("20190101000000", "BBB")]
+
+        async def get_codes(session, url, timestamp, semaphore):
+            if timestamp < "20190101000000":
+                return {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}
+            return {"UA": [], "GA": ["G-1234567890"], "GTM": []}
+
+        mock_index.side_effect = get_index
+        mock_codes.side_effect = get_codes
+        cache = ScriptCache()
+        semaphore = asyncio.Semaphore(10)
+
+        codes = await cache.get_codes(
+            None, SNAPSHOT_URL, "20180201000000", ["/js/app.js", "/js/app.js?v2"], semaphore
+        )
+        self.assertEqual(
+            codes, {"UA": ["UA-12345678-1"], "GA": ["G-1234567890"], "GTM": []}
+        )
+
+        """Both urls served version BBB, so it was fetched once"""
+        self.assertEqual(mock_index.call_count, 2)
+        self.assertEqual(mock_codes.call_count, 2)
+
+        """Later snapshots reuse the cached indexes and versions"""
+        codes = await cache.get_codes(
+            None, SNAPSHOT_URL, "20190601000000", ["/js/app.js"], semaphore
+        )
+        self.assertEqual(codes, {"UA": [], "GA": ["G-1234567890"], "GTM": []})
+        self.assertEqual(mock_index.call_count, 2)
+        self.assertEqual(mock_codes.call_count, 2)
+
+    @patch("wayback_google_analytics.scripts.get_archived_script_codes")
+    @patch("wayback_google_analytics.scripts.get_capture_index")
+    async def test_script_cache_bounded(self, mock_index, mock_codes):
+        """Does ScriptCache drop the least recently used entries past max_size?"""
+
+        async def get_index(session, url, semaphore):
+            return [("20190101000000", url)]
+
+        mock_index.side_effect = get_index
+        mock_codes.return_value = {"UA": [], "GA": [], "GTM": []}
+        cache = ScriptCache(max_size=2)
+        semaphore = asyncio.Semaphore(10)
+
+        for src in ["/a.js", "/b.js", "/a.js", "/c.js"]:
+            await cache.get_codes(None, SNAPSHOT_URL, "20190101000000", [src], semaphore)
+
+        self.assertEqual(
+            list(cache.indexes), ["http://someurl.com/a.js", "http://someurl.com/c.js"]
+        )
+        self.assertEqual(len(cache.versions), 2)
+        self.assertEqual(mock_index.call_count, 3)
+
+    @patch("wayback_google_analytics.scripts.get_capture_index")
+    async def test_script_cache_errors(self, mock_index):
+        """Are scripts that can't be retrieved skipped?"""
+
+        mock_index.side_effect = aiohttp.ClientError("CDX unavailable")
+
+        codes = await ScriptCache().get_codes(
+            None, SNAPSHOT_URL, "20190101000000", ["/js/app.js"], asyncio.Semaphore(10)
+        )
+
+        self.assertEqual(codes, {"UA": [], "GA": [], "GTM": []})
+
+    @patch("wayback_google_analytics.scripts.get_archived_script_codes")
+    @patch("wayback_google_analytics.scripts.get_capture_index")
+    async def test_script_cache_cancelled_caller(self, mock_index, mock_codes):
+        """Does cancelling one snapshot leave script lookups it shares with others running?"""
+
+        async def get_index(session, url, semaphore):
+            await asyncio.sleep(0.02)
+            return [("20190101000000", "AAA")]
+
+        async def get_codes(session, url, timestamp, semaphore):
+            await asyncio.sleep(0.02)
+            return {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}
+
+        mock_index.side_effect = get_index
+        mock_codes.side_effect = get_codes
+        cache = ScriptCache()
+        semaphore = asyncio.Semaphore(10)
+
+        first, second = [
+            asyncio.ensure_future(
+                cache.get_codes(None, SNAPSHOT_URL, timestamp, ["/js/app.js"], semaphore)
+            )
+            for timestamp in ["20190101000000", "20190102000000"]
+        ]
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        self.assertEqual(
+            await second, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}
+        )
+        self.assertTrue(first.cancelled())
+        self.assertEqual(mock_index.call_count, 1)
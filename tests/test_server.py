@@ -0,0 +1,146 @@
+import asyncio
+import asynctest
+from asynctest.mock import patch
+from aiohttp.test_utils import TestClient, TestServer
+
+from wayback_google_analytics.server import (
+    AnalyticsService,
+    create_app,
+    get_job_options,
+)
+
+
+async def mock_stream_analytics_codes(session, urls, **kwargs):
+    """Yields an empty result for each url, one event loop turn apart."""
+    for url in urls:
+        await asyncio.sleep(0.01)
+        yield {url: {"current_UA_code": ["UA-12345678-1"]}}
+
+
+class ServerTestCase(asynctest.TestCase):
+    """Tests for server.py"""
+
+    async def setUp(self):
+        """Start a test server"""
+        self.service = AnalyticsService(rate_limit=1, max_backlog=5)
+        self.client = TestClient(TestServer(create_app(self.service)))
+        await self.client.start_server()
+
+    async def tearDown(self):
+        """Stop the test server"""
+        await self.client.close()
+
+    def test_get_job_options(self):
+        """Does get_job_options convert options like the command line?"""
+
+        urls, options = get_job_options(
+            {
+                "urls": ["someurl.com"],
+                "start_date": "01/01/2015",
+                "end_date": "01/01/2020",
+                "frequency": "yearly",
+            }
+        )
+
+        self.assertEqual(urls, ["someurl.com"])
+        self.assertEqual(options["start_date"], "20150101000000")
+        self.assertEqual(options["frequency"], "4")
+        self.assertEqual(options["limit"], 7)
+
+        with self.assertRaises(ValueError):
+            get_job_options({"urls": []})
+
+        with self.assertRaises(ValueError):
+            get_job_options({"urls": ["someurl.com"], "frequency": "weekly"})
+
+        """Timeouts must be positive numbers of seconds"""
+        _, options = get_job_options({"urls": ["someurl.com"], "url_timeout": 60})
+        self.assertEqual(options["url_timeout"], 60)
+        self.assertEqual(options["job_timeout"], None)
+
+        with self.assertRaises(ValueError):
+            get_job_options({"urls": ["someurl.com"], "url_timeout": "soon"})
+
+        """Limits must be integers, since they are part of the CDX query"""
+        _, options = get_job_options({"urls": ["someurl.com"], "limit": -20})
+        self.assertEqual(options["limit"], -20)
+
+        with self.assertRaises(ValueError):
+            get_job_options({"urls": ["someurl.com"], "limit": "5&matchType=prefix"})
+
+    @asynctest.patch(
+        "wayback_google_analytics.server.stream_analytics_codes",
+        mock_stream_analytics_codes,
+    )
+    async def test_submit_and_stream_results(self):
+        """Can a client submit a job, stream its results and check its status?"""
+
+        response = await self.client.post(
+            "/jobs", json={"urls": ["someurl.com", "otherurl.org"]}
+        )
+        self.assertEqual(response.status, 202)
+        job = await response.json()
+        self.assertIn(job["status"], ["queued", "running"])
+
+        response = await self.client.get(f"/jobs/{job['id']}/results")
+        lines = (await response.text()).splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("someurl.com", lines[0])
+
+        response = await self.client.get(f"/jobs/{job['id']}")
+        status = await response.json()
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["completed"], 2)
+        self.assertEqual(status["failed"], 0)
+
+        """Unknown jobs are 404s"""
+        response = await self.client.get("/jobs/unknown")
+        self.assertEqual(response.status, 404)
+
+    async def test_invalid_job(self):
+        """Are invalid requests rejected with 400?"""
+
+        response = await self.client.post("/jobs", json={"urls": "someurl.com"})
+        self.assertEqual(response.status, 400)
+
+        """Bodies and options of the wrong type are 400s too, not server errors"""
+        for body in [
+            ["someurl.com"],
+            {"urls": [1]},
+            {"urls": ["someurl.com"], "start_date": 2015},
+            {"urls": ["someurl.com"], "end_date": "tomorrow"},
+            {"urls": ["someurl.com"], "limit": "5&matchType=prefix"},
+            {"urls": ["someurl.com"], "limit": 1.5},
+        ]:
+            response = await self.client.post("/jobs", json=body)
+            self.assertEqual(response.status, 400, body)
+
+    async def test_admission_control(self):
+        """Are new jobs refused with Retry-After once the request budget is used up?"""
+
+        for _ in range(10):
+            self.service.limiter.reserve()
+
+        response = await self.client.post("/jobs", json={"urls": ["someurl.com"]})
+        self.assertEqual(response.status, 503)
+        self.assertGreater(int(response.headers["Retry-After"]), 0)
+
+    async def test_shared_cdx_cache(self):
+        """Do jobs with the same options share a CDX cache?"""
+
+        _, options = get_job_options({"urls": ["someurl.com"]})
+        _, other_options = get_job_options(
+            {"urls": ["someurl.com"], "start_date": "01/01/2015"}
+        )
+
+        cache = self.service.get_cdx_cache(options)
+        self.assertIs(self.service.get_cdx_cache(dict(options)), cache)
+        self.assertIsNot(self.service.get_cdx_cache(other_options), cache)
+
+        """Past CDX_CACHE_MAX_DOMAINS, the oldest domains are dropped first"""
+        cache.update({"a.com": 1, "b.com": 2})
+        self.service.get_cdx_cache(other_options).update({"c.com": 3})
+        with patch("wayback_google_analytics.server.CDX_CACHE_MAX_DOMAINS", 2):
+            self.assertIs(self.service.get_cdx_cache(options), cache)
+        self.assertEqual(cache, {"b.com": 2})
+        self.assertEqual(self.service.get_cdx_cache(other_options), {"c.com": 3})
@@ -0,0 +1,147 @@
+import asyncio
+import asynctest
+from asynctest.mock import MagicMock
+
+from wayback_google_analytics.single_flight import SingleFlight, SingleFlightSession
+
+
+class SingleFlightTestCase(asynctest.TestCase):
+    """Tests for single_flight.py"""
+
+    async def test_do_shares_calls(self):
+        """Do concurrent callers for the same key share one call?"""
+
+        calls = []
+
+        async def fetch(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return f"result for {key}"
+
+        flights = SingleFlight(ttl=0)
+        results = await asyncio.gather(
+            *[flights.do(key, lambda key=key: fetch(key)) for key in ["a", "a", "b", "a"]]
+        )
+
+        self.assertEqual(
+            results, ["result for a", "result for a", "result for b", "result for a"]
+        )
+        self.assertEqual(calls, ["a", "b"])
+        self.assertEqual((flights.calls, flights.shared), (2, 2))
+
+        """Without a ttl, finished calls are forgotten"""
+        self.assertEqual(flights.flights, {})
+
+    async def test_do_keeps_results_for_ttl(self):
+        """Are results kept for late joiners until ttl expires, and errors not kept?"""
+
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            return "result"
+
+        flights = SingleFlight(ttl=0.05)
+        await flights.do("a", fetch)
+        await flights.do("a", fetch)
+        self.assertEqual(len(calls), 1)
+
+        await asyncio.sleep(0.1)
+        await flights.do("a", fetch)
+        self.assertEqual(len(calls), 2)
+
+        async def fail():
+            calls.append(1)
+            raise ValueError("failed")
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                await flights.do("b", fail)
+        self.assertEqual(len(calls), 4)
+
+    async def test_do_bounds_kept_results(self):
+        """Are the least recently used results forgotten once kept results exceed max_size?"""
+
+        calls = []
+
+        async def fetch(key):
+            calls.append(key)
+            return key * 10
+
+        flights = SingleFlight(ttl=60, max_size=25, get_size=len)
+        for key in ["a", "b", "a", "c"]:
+            await flights.do(key, lambda key=key: fetch(key))
+
+        """The least recently used result (b) made room for c"""
+        self.assertEqual(list(flights.kept), ["a", "c"])
+        self.assertEqual(flights.kept_size, 20)
+        self.assertEqual(calls, ["a", "b", "c"])
+
+        await flights.do("b", lambda: fetch("b"))
+        self.assertEqual(calls, ["a", "b", "c", "b"])
+
+    async def test_cancelled_caller(self):
+        """Does cancelling one caller leave the shared call running for the others?"""
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "result"
+
+        flights = SingleFlight(ttl=0)
+        first = asyncio.ensure_future(flights.do("a", fetch))
+        second = asyncio.ensure_future(flights.do("a", fetch))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        self.assertEqual(await second, "result")
+
+    async def test_session_coalesces_gets(self):
+        """Does SingleFlightSession send one request for concurrent gets of the same url?"""
+
+        requested = []
+
+        def mock_get(url, **kwargs):
+            requested.append(url)
+            response = MagicMock()
+
+            async def mock_read():
+                await asyncio.sleep(0.01)
+                return f"<html>{url}</html>".encode()
+
+            response.read = mock_read
+            response.charset = "utf-8"
+            response.status = 200
+            response.headers = {"Content-Type": "text/html"}
+            context = MagicMock()
+            context.__aenter__ = asynctest.CoroutineMock(return_value=response)
+            context.__aexit__ = asynctest.CoroutineMock(return_value=False)
+            return context
+
+        session = MagicMock()
+        session.get = mock_get
+        shared_session = SingleFlightSession(session)
+
+        async def get_text(url):
+            async with shared_session.get(url, headers={}) as response:
+                return await response.text()
+
+        texts = await asyncio.gather(
+            get_text("https://someurl.com"),
+            get_text("https://someurl.com"),
+            get_text("https://otherurl.org"),
+        )
+
+        self.assertEqual(texts[0], texts[1])
+        self.assertEqual(texts[0], "<html>https://someurl.com</html>")
+        self.assertEqual(requested, ["https://someurl.com", "https://otherurl.org"])
+
+        """Bodies can also be read without decoding them"""
+        async with shared_session.get("https://someurl.com") as response:
+            self.assertEqual(await response.read(), b"<html>https://someurl.com</html>")
+
+            """Status and headers are passed through"""
+            self.assertEqual(response.status, 200)
+            self.assertEqual(response.headers["Content-Type"], "text/html")
+
+        """Other attributes come from the wrapped session"""
+        self.assertIs(shared_session.closed, session.closed)
@@ -0,0 +1,278 @@
+import os
+from shutil import rmtree
+from unittest import TestCase
+
+from wayback_google_analytics.store import ResultStore, get_overlaps
+
+
+class ResultStoreTestCase(TestCase):
+    """Tests for store.py"""
+
+    def setUp(self):
+        """Create test store"""
+        self.test_path = "./test_store"
+        if not os.path.exists(self.test_path):
+            os.makedirs(self.test_path)
+        self.db_path = os.path.join(self.test_path, "store.db")
+        self.store = ResultStore(self.db_path)
+
+        self.results = [
+            {
+                "https://www.someurl.com": {
+                    "current_UA_code": ["UA-12345678-1"],
+                    "current_GA_code": [],
+                    "current_GTM_code": [],
+                    "archived_UA_codes": {
+                        "UA-12345678-1": {
+                            "first_seen": "01/01/2019:00:00",
+                            "last_seen": "01/01/2020:00:00",
+                        },
+                        "UA-12345678-2": {
+                            "first_seen": "01/01/2015:00:00",
+                            "last_seen": "01/01/2016:00:00",
+                        },
+                    },
+                    "archived_GA_codes": {},
+                    "archived_GTM_codes": {},
+                }
+            },
+            {
+                "otherurl.org": {
+                    "current_UA_code": [],
+                    "current_GA_code": ["G-1234567890"],
+                    "current_GTM_code": [],
+                    "archived_UA_codes": {
+                        "UA-12345678-1": {
+                            "first_seen": "01/06/2016:00:00",
+                            "last_seen": "01/06/2017:00:00",
+                        },
+                    },
+                    "archived_GA_codes": {},
+                    "archived_GTM_codes": {},
+                }
+            },
+        ]
+
+    def tearDown(self):
+        """Removes any created directories after each test"""
+        self.store.close()
+        if os.path.exists(self.test_path):
+            rmtree(self.test_path)
+
+    def test_add_results(self):
+        """Does add_results index sightings by code?"""
+
+        self.assertEqual(self.store.add_results(self.results), 4)
+        self.assertEqual(
+            self.store.get_counts(), {"urls": 2, "codes": 3, "sightings": 4}
+        )
+
+        self.assertEqual(
+            self.store.get_sites("UA-12345678-1"),
+            [
+                {
+                    "url": "otherurl.org",
+                    "code": "UA-12345678-1",
+                    "code_type": "UA",
+                    "first_seen": "20160601000000",
+                    "last_seen": "20170601000000",
+                    "is_current": False,
+                },
+                {
+                    "url": "someurl.com",
+                    "code": "UA-12345678-1",
+                    "code_type": "UA",
+                    "first_seen": "20190101000000",
+                    "last_seen": "20200101000000",
+                    "is_current": True,
+                },
+            ],
+        )
+
+        self.assertIn(("someurl.com", "UA-12345678-2"), list(self.store.iter_sightings()))
+
+        """Codes only found on the live page have no dates"""
+        sites = self.store.get_sites("G-1234567890")
+        self.assertEqual(len(sites), 1)
+        self.assertIsNone(sites[0]["first_seen"])
+        self.assertTrue(sites[0]["is_current"])
+
+    def test_add_results_upsert(self):
+        """Do repeat runs widen dates and update current codes, for any form of a url?"""
+
+        self.store.add_results(self.results)
+        self.store.add_results(
+            {
+                "someurl.com/": {
+                    "current_UA_code": [],
+                    "current_GA_code": [],
+                    "current_GTM_code": [],
+                    "archived_UA_codes": {
+                        "UA-12345678-1": {
+                            "first_seen": "01/01/2018:00:00",
+                            "last_seen": "01/06/2019:00:00",
+                        },
+                    },
+                    "archived_GA_codes": {},
+                    "archived_GTM_codes": {},
+                }
+            }
+        )
+
+        self.assertEqual(self.store.get_counts()["urls"], 2)
+
+        sighting = self.store.get_codes("someurl.com")[-1]
+        self.assertEqual(sighting["code"], "UA-12345678-1")
+        self.assertEqual(sighting["first_seen"], "20180101000000")
+        self.assertEqual(sighting["last_seen"], "20200101000000")
+        self.assertFalse(sighting["is_current"])
+
+        """Urls that failed leave their stored sightings and last update alone"""
+        last_updated = self.store.get_last_updated("someurl.com")
+        self.assertEqual(self.store.add_results({"someurl.com": {"error": "timed out"}}), 0)
+        self.assertEqual(self.store.get_last_updated("someurl.com"), last_updated)
+        self.assertEqual(len(self.store.get_codes("someurl.com")), 2)
+
+    def test_get_codes_date_range(self):
+        """Does get_codes only return codes seen in a date range?"""
+
+        self.store.add_results(self.results)
+
+        codes = self.store.get_codes(
+            "https://someurl.com", "20160101000000", "20161231235959"
+        )
+        self.assertEqual([sighting["code"] for sighting in codes], ["UA-12345678-2"])
+
+        codes = self.store.get_codes("someurl.com")
+        self.assertEqual(
+            [sighting["code"] for sighting in codes], ["UA-12345678-2", "UA-12345678-1"]
+        )
+
+    def test_lookup(self):
+        """Does lookup find sites sharing codes and when they overlapped?"""
+
+        self.store.add_results(self.results)
+        self.store.add_results(
+            {
+                "thirdurl.net": {
+                    "archived_UA_codes": {
+                        "UA-12345678-1": {
+                            "first_seen": "01/01/2017:00:00",
+                            "last_seen": "01/01/2019:06:00",
+                        },
+                    },
+                    "archived_GA_codes": {
+                        "G-1234567890": {
+                            "first_seen": "01/01/2017:00:00",
+                            "last_seen": "01/01/2018:00:00",
+                        },
+                    },
+                }
+            }
+        )
+
+        lookup = self.store.lookup(["ua-12345678-1", "G-1234567890"])
+
+        self.assertEqual(
+            [site["url"] for site in lookup["codes"]["UA-12345678-1"]["sites"]],
+            ["otherurl.org", "someurl.com", "thirdurl.net"],
+        )
+        self.assertEqual(
+            lookup["codes"]["UA-12345678-1"]["overlaps"],
+            [
+                {
+                    "urls": ["otherurl.org", "thirdurl.net"],
+                    "first_seen": "20170101000000",
+                    "last_seen": "20170601000000",
+                },
+                {
+                    "urls": ["thirdurl.net", "someurl.com"],
+                    "first_seen": "20190101000000",
+                    "last_seen": "20190101060000",
+                },
+            ],
+        )
+        self.assertEqual(
+            lookup["shared_sites"],
+            {
+                "otherurl.org": ["UA-12345678-1", "G-1234567890"],
+                "thirdurl.net": ["UA-12345678-1", "G-1234567890"],
+            },
+        )
+
+    def test_get_overlaps(self):
+        """Does get_overlaps skip ranges that don't overlap and sightings without dates?"""
+
+        sightings = [
+            {"url": "a.com", "first_seen": "20150101000000", "last_seen": "20160101000000"},
+            {"url": "b.com", "first_seen": "20170101000000", "last_seen": "20180101000000"},
+            {"url": "c.com", "first_seen": None, "last_seen": None},
+        ]
+
+        self.assertEqual(get_overlaps(sightings), [])
+
+    def test_get_overlaps_periods(self):
+        """Does get_overlaps merge overlapping ranges into periods instead of listing every pair?"""
+
+        """Many sites using a code over the same years make one period"""
+        sightings = [
+            {
+                "url": f"site{index}.com",
+                "first_seen": f"20{10 + index % 5}0101000000",
+                "last_seen": "20200101000000",
+            }
+            for index in range(100)
+        ]
+        overlaps = get_overlaps(sightings)
+        self.assertEqual(len(overlaps), 1)
+        self.assertEqual(len(overlaps[0]["urls"]), 100)
+        self.assertEqual(overlaps[0]["first_seen"], "20100101000000")
+        self.assertEqual(overlaps[0]["last_seen"], "20200101000000")
+
+        """A long range is listed in every period it spans"""
+        sightings = [
+            {"url": "a.com", "first_seen": "20100101000000", "last_seen": "20200101000000"},
+            {"url": "b.com", "first_seen": "20110101000000", "last_seen": "20120101000000"},
+            {"url": "c.com", "first_seen": "20110601000000", "last_seen": "20130101000000"},
+            {"url": "d.com", "first_seen": "20150101000000", "last_seen": "20160101000000"},
+            {"url": "e.com", "first_seen": "20190101000000", "last_seen": "20210101000000"},
+        ]
+        self.assertEqual(
+            get_overlaps(sightings),
+            [
+                {
+                    "urls": ["a.com", "b.com", "c.com"],
+                    "first_seen": "20110101000000",
+                    "last_seen": "20130101000000",
+                },
+                {
+                    "urls": ["a.com", "d.com"],
+                    "first_seen": "20150101000000",
+                    "last_seen": "20160101000000",
+                },
+                {
+                    "urls": ["a.com", "e.com"],
+                    "first_seen": "20190101000000",
+                    "last_seen": "20200101000000",
+                },
+            ],
+        )
+
+    def test_indexes(self):
+        """Do lookups by code, url and (code_type, first_seen) use an index?"""
+
+        queries = [
+            ("SELECT * FROM sightings WHERE code = ?", ("UA-12345678-1",)),
+            ("SELECT * FROM sightings WHERE url = ?", ("someurl.com",)),
+            (
+                "SELECT * FROM sightings WHERE code_type = ? AND first_seen >= ?",
+                ("UA", "20160101000000"),
+            ),
+        ]
+
+        for query, params in queries:
+            with self.subTest(query=query):
+                plan = self.store.conn.execute(
+                    "EXPLAIN QUERY PLAN " + query, params
+                ).fetchall()
+                self.assertIn("USING INDEX", " ".join(row[-1] for row in plan))
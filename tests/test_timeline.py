@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from wayback_google_analytics.timeline import build_timelines
+
+
+class TimelineTestCase(TestCase):
+    """Tests for timeline.py"""
+
+    def setUp(self):
+        """Snapshots where UA-12345678-1 is removed in 2015 and restored in 2019"""
+        self.records = [
+            (20190101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+            (20120101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+            (20140101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+            (20160101000000, {"UA": [], "GA": ["G-1234567890"], "GTM": []}),
+            None,
+            (20200101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}),
+        ]
+
+    def test_build_timelines(self):
+        """Does build_timelines encode runs of consecutive snapshots?"""
+
+        timelines = build_timelines(self.records)
+        timeline = timelines["UA_codes"]["UA-12345678-1"]
+
+        self.assertEqual(list(timeline.starts), [20120101000000, 20190101000000])
+        self.assertEqual(list(timeline.ends), [20140101000000, 20200101000000])
+        self.assertEqual(
+            timeline.to_list(),
+            [
+                {"first_seen": "01/01/2012:00:00", "last_seen": "01/01/2014:00:00"},
+                {"first_seen": "01/01/2019:00:00", "last_seen": "01/01/2020:00:00"},
+            ],
+        )
+        self.assertEqual(
+            timelines["GA_codes"]["G-1234567890"].to_list(),
+            [{"first_seen": "01/01/2016:00:00", "last_seen": "01/01/2016:00:00"}],
+        )
+
+    def test_is_active_and_gaps(self):
+        """Does a timeline answer "active at time T" and list its gaps?"""
+
+        timeline = build_timelines(self.records)["UA_codes"]["UA-12345678-1"]
+
+        self.assertTrue(timeline.is_active(20130601000000))
+        self.assertTrue(timeline.is_active("20190101000000"))
+        self.assertFalse(timeline.is_active(20170101000000))
+        self.assertFalse(timeline.is_active(20110101000000))
+        self.assertFalse(timeline.is_active(20210101000000))
+
+        self.assertEqual(timeline.get_gaps(), [(20140101000000, 20190101000000)])
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from wayback_google_analytics.urls import normalize_url, get_domain, group_urls
+
+
+class UrlsTestCase(TestCase):
+    """Tests for urls.py"""
+
+    def test_normalize_url(self):
+        """Does normalize_url return the same canonical url for equivalent inputs?"""
+
+        for url in [
+            "example.com",
+            "Example.com/",
+            "https://www.example.com/",
+            "http://example.com:80",
+            "https://www.example.com:443/#top",
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual(normalize_url(url), "example.com")
+
+        """Keeps path, query and non-default ports"""
+        self.assertEqual(normalize_url("https://www.example.com/about/"), "example.com/about")
+        self.assertEqual(normalize_url("example.com/?page=2"), "example.com?page=2")
+        self.assertEqual(normalize_url("http://example.com:8080/a"), "example.com:8080/a")
+
+    def test_get_domain(self):
+        """Does get_domain return the host searched by the CDX api?"""
+
+        self.assertEqual(get_domain("https://www.example.com/about"), "example.com")
+        self.assertEqual(get_domain("example.com?page=2"), "example.com")
+        self.assertEqual(get_domain("blog.example.com"), "blog.example.com")
+
+    def test_group_urls(self):
+        """Does group_urls group equivalent urls in input order?"""
+
+        urls = [
+            "example.com",
+            "otherurl.org",
+            "https://www.example.com/",
+            "example.com/about",
+        ]
+
+        self.assertEqual(
+            group_urls(urls),
+            {
+                "example.com": ["example.com", "https://www.example.com/"],
+                "otherurl.org": ["otherurl.org"],
+                "example.com/about": ["example.com/about"],
+            },
+        )
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from wayback_google_analytics.utils import get_limit_from_frequency, validate_dates, get_14_digit_timestamp, get_date_from_timestamp, COLLAPSE_OPTIONS
+from wayback_google_analytics.utils import get_limit_from_frequency, validate_dates, get_14_digit_timestamp, get_date_from_timestamp, order_progressive, COLLAPSE_OPTIONS
 
 class UtilsTestCase(TestCase):
     """Tests for utils.py"""
@@ -101,3 +101,32 @@ class UtilsTestCase(TestCase):
         self.assertEqual(COLLAPSE_OPTIONS["daily"], "8")
         self.assertEqual(COLLAPSE_OPTIONS["hourly"], "10")
 
+    def test_order_progressive(self):
+        """Does order_progressive order timestamps by year, then month, day and hour?"""
+
+        timestamps = [
+            "20190101000000",
+            "20190101000500",
+            "20190101010000",
+            "20190102000000",
+            "20190201000000",
+            "20200101000000",
+            "20200301000000",
+        ]
+
+        self.assertEqual(
+            order_progressive(timestamps),
+            [
+                "20190101000000",
+                "20200101000000",
+                "20190201000000",
+                "20200301000000",
+                "20190102000000",
+                "20190101010000",
+                "20190101000500",
+            ],
+        )
+
+        """Keeps every timestamp"""
+        self.assertEqual(sorted(order_progressive(timestamps)), timestamps)
+        self.assertEqual(order_progressive([]), [])
@@ -0,0 +1,135 @@
+import os
+from shutil import rmtree
+import asynctest
+
+from wayback_google_analytics.store import ResultStore
+from wayback_google_analytics.watch import get_changes, check_url, watch
+
+
+class WatchTestCase(asynctest.TestCase):
+    """Tests for watch.py"""
+
+    def setUp(self):
+        """Create test store"""
+        self.test_path = "./test_watch"
+        if not os.path.exists(self.test_path):
+            os.makedirs(self.test_path)
+        self.store = ResultStore(os.path.join(self.test_path, "watch.db"))
+
+    def tearDown(self):
+        """Removes any created directories after each test"""
+        self.store.close()
+        if os.path.exists(self.test_path):
+            rmtree(self.test_path)
+
+    def test_get_changes(self):
+        """Does get_changes report new, disappeared and changed current codes?"""
+
+        previous = [
+            {"code": "UA-12345678-1", "code_type": "UA", "is_current": True},
+            {"code": "GTM-ABC1234", "code_type": "GTM", "is_current": True},
+        ]
+        entry = {
+            "someurl.com": {
+                "current_UA_code": [],
+                "current_GA_code": ["G-1234567890"],
+                "current_GTM_code": ["GTM-ABC1234"],
+                "archived_UA_codes": {
+                    "UA-12345678-1": {
+                        "first_seen": "01/01/2019:00:00",
+                        "last_seen": "01/01/2019:00:00",
+                    }
+                },
+                "archived_GA_codes": {},
+                "archived_GTM_codes": {},
+            }
+        }
+
+        self.assertEqual(
+            get_changes("someurl.com", previous, entry),
+            [
+                {
+                    "url": "someurl.com",
+                    "change": "new_code",
+                    "code": "G-1234567890",
+                    "code_type": "GA",
+                },
+                {
+                    "url": "someurl.com",
+                    "change": "disappeared_code",
+                    "code": "UA-12345678-1",
+                    "code_type": "UA",
+                },
+                {
+                    "url": "someurl.com",
+                    "change": "current_changed",
+                    "code_type": "UA",
+                    "before": ["UA-12345678-1"],
+                    "after": [],
+                },
+                {
+                    "url": "someurl.com",
+                    "change": "current_changed",
+                    "code_type": "GA",
+                    "before": [],
+                    "after": ["G-1234567890"],
+                },
+            ],
+        )
+
+        """Current codes aren't compared if the live page couldn't be retrieved"""
+        del entry["someurl.com"]["current_UA_code"]
+        del entry["someurl.com"]["current_GA_code"]
+        del entry["someurl.com"]["current_GTM_code"]
+        self.assertEqual(get_changes("someurl.com", previous, entry), [])
+
+    @asynctest.patch("wayback_google_analytics.watch.get_codes_from_snapshots")
+    @asynctest.patch("wayback_google_analytics.watch.get_snapshot_timestamps")
+    @asynctest.patch("wayback_google_analytics.watch.get_current_codes")
+    async def test_check_url(self, mock_current, mock_timestamps, mock_codes):
+        """Does check_url record a baseline first, then query incrementally and report changes?"""
+
+        mock_current.return_value = {"current_UA_code": ["UA-12345678-1"]}
+        mock_timestamps.return_value = []
+        mock_codes.return_value = {"UA_codes": {}, "GA_codes": {}, "GTM_codes": {}}
+
+        self.assertEqual(await check_url(None, "someurl.com", self.store, None), [])
+        self.assertIsNone(mock_timestamps.call_args[1]["start_date"])
+
+        mock_current.return_value = {"current_UA_code": ["UA-12345678-2"]}
+        changes = await check_url(None, "someurl.com", self.store, None)
+
+        self.assertEqual(
+            [change["change"] for change in changes],
+            ["new_code", "disappeared_code", "current_changed"],
+        )
+        self.assertIsNotNone(mock_timestamps.call_args[1]["start_date"])
+
+    @asynctest.patch("wayback_google_analytics.watch.check_url")
+    async def test_watch_spreads_checks(self, mock_check_url):
+        """Does watch start checks evenly across the interval and report changes?"""
+
+        watchlist = os.path.join(self.test_path, "watchlist.txt")
+        with open(watchlist, "w") as f:
+            f.write("someurl.com\notherurl.org\nthirdurl.net\n")
+
+        started = []
+
+        async def mock_check(session, url, store, semaphore, limit):
+            started.append(self.loop.time())
+            return [{"url": url, "change": "new_code"}]
+
+        mock_check_url.side_effect = mock_check
+        changes = []
+
+        await watch(
+            watchlist,
+            self.store,
+            interval=0.3,
+            semaphore=None,
+            cycles=1,
+            on_change=changes.append,
+        )
+
+        self.assertEqual(len(changes), 3)
+        self.assertGreaterEqual(started[2] - started[0], 0.19)
@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+import asynctest
+
+from wayback_google_analytics.workers import shard_urls, run_sharded
+
+
+def mock_run_shard(urls, kwargs):
+    """Returns one entry per url, tagged with the shard's kwargs."""
+    return [{url: {"limit": kwargs["limit"], "shard": urls}} for url in urls]
+
+
+class WorkersTestCase(asynctest.TestCase):
+    """Tests for workers.py"""
+
+    def test_shard_urls(self):
+        """Does shard_urls keep urls on the same domain in the same shard?"""
+
+        urls = [
+            "example.com",
+            "otherurl.org",
+            "https://www.example.com/about",
+            "thirdurl.net",
+        ]
+
+        shards = shard_urls(urls, 3)
+
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(
+            sorted(index for shard in shards for index, _ in shard), [0, 1, 2, 3]
+        )
+
+        shard_of = {url: i for i, shard in enumerate(shards) for _, url in shard}
+        self.assertEqual(
+            shard_of["example.com"], shard_of["https://www.example.com/about"]
+        )
+
+        """Is sharding stable between calls?"""
+        self.assertEqual(shard_urls(urls, 3), shards)
+
+    @asynctest.patch("wayback_google_analytics.workers._run_shard", mock_run_shard)
+    @asynctest.patch(
+        "wayback_google_analytics.workers.ProcessPoolExecutor", ThreadPoolExecutor
+    )
+    async def test_run_sharded(self):
+        """Does run_sharded merge shard results back into input order?"""
+
+        urls = [f"https://someurl{i}.com" for i in range(10)]
+
+        results = await run_sharded(urls, workers=4, limit=10)
+
+        self.assertEqual([next(iter(entry)) for entry in results], urls)
+        self.assertTrue(all(entry[url]["limit"] == 10 for url, entry in zip(urls, results)))
+
+        """Were urls actually split across more than one shard?"""
+        self.assertGreater(
+            len({tuple(entry[url]["shard"]) for url, entry in zip(urls, results)}), 1
+        )
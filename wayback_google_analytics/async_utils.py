@@ -1,8 +1,29 @@
 import asyncio
+import json
 import re
-from wayback_google_analytics.codes import get_UA_code, get_GA_code, get_GTM_code
-from wayback_google_analytics.utils import get_date_from_timestamp, DEFAULT_HEADERS
-
+from bisect import bisect_left
+from datetime import datetime
+from urllib.parse import quote
+from wayback_google_analytics.cdx_store import HTML_MIMETYPES, update_cdx_store
+from wayback_google_analytics.codes import get_codes_from_bytes, get_script_srcs
+from wayback_google_analytics.models import (
+    CODE_TYPES,
+    get_archived_dict,
+    reduce_code_records,
+)
+from wayback_google_analytics.urls import get_domain
+from wayback_google_analytics.utils import DEFAULT_HEADERS
+
+
+# Finer buckets per bucket, by digits of the bucket (e.g. 12 months per year), used to
+# keep a CDX limit when collapsing one granularity finer than the frequency
+FINER_BUCKETS = {4: 12, 6: 31, 8: 24, 10: 60}
+
+# CDX filter keeping html captures only, so limits count captures that can be picked
+HTML_MIMETYPE_FILTER = quote(
+    "mimetype:(" + "|".join(re.escape(mimetype) for mimetype in sorted(HTML_MIMETYPES)) + ")",
+    safe=":/|()",
+)
 
 async def get_snapshot_timestamps(
     session,
@@ -12,6 +33,9 @@ async def get_snapshot_timestamps(
     frequency,
     limit,
     semaphore=asyncio.Semaphore(10),
+    cdx_store=None,
+    max_size=None,
+    dedupe=False,
 ):
     """Takes a url and returns an array of snapshot timestamps for a given time range.
 
@@ -23,20 +47,90 @@ async def get_snapshot_timestamps(
         frequency (str, optional): Can limit snapshots to remove duplicates (1 per hr, day, week, etc).
         limit (int, optional): Limit number of snapshots returned.
         semaphore: asyncio.Semaphore()
+        cdx_store (CdxStore, optional): Store of the domain's CDX index. If given, only new
+            captures are fetched and timestamps are selected from the store. Defaults to None.
+        max_size (int, optional): Skip captures larger than this many bytes. Defaults to None.
+        dedupe (bool): With a cdx_store, skip captures whose content is identical to an
+            earlier one (see CdxStore.select_timestamps()). Defaults to False.
 
     Returns:
         Array of timestamps:
             ["20190101000000", "20190102000000", ...]
     """
 
-    # Default params get snapshots from url domain w/ 200 status codes only.
-    cdx_url = f"http://web.archive.org/cdx/search/cdx?url={url}&matchType=domain&filter=statuscode:200&fl=timestamp&output=JSON"
+    if cdx_store is not None:
+        await update_cdx_store(session, url, cdx_store, semaphore)
+        return cdx_store.select_timestamps(
+            start_date=start_date,
+            end_date=end_date,
+            frequency=frequency,
+            limit=limit,
+            dedupe=dedupe,
+            max_size=max_size,
+        )
+
+    rows = await get_snapshot_rows(
+        session=session,
+        url=url,
+        start_date=start_date,
+        end_date=end_date,
+        frequency=frequency,
+        limit=limit,
+        semaphore=semaphore,
+        max_size=max_size,
+    )
+    timestamps = [timestamp for timestamp, _ in rows]
 
-    # Add correct params to cdx_url
-    if frequency:
-        cdx_url += f"&collapse=timestamp:{frequency}"
+    print("Timestamps from CDX api: ", timestamps)
+
+    return timestamps
+
+
+async def get_snapshot_rows(
+    session,
+    url,
+    start_date,
+    end_date,
+    frequency,
+    limit,
+    semaphore=asyncio.Semaphore(10),
+    max_size=None,
+):
+    """Returns the snapshots to fetch for a url, with their archived sizes from the CDX api.
+
+    Only html captures are requested, so a limit counts captures that can be picked. With a
+    frequency, the CDX api collapses captures one granularity finer (e.g. monthly for
+    yearly) and the smallest capture in each bucket is picked, so one representative
+    snapshot per bucket costs as little bandwidth as possible.
+
+    Args:
+        session (aiohttp.ClientSession)
+        url (str)
+        start_date (str, optional): 14-digit timestamp for starting point.
+        end_date (str, optional): 14-digit timestamp for end of range.
+        frequency (str, optional): Collapse option (see COLLAPSE_OPTIONS).
+        limit (int, optional): Limit number of snapshots returned.
+        semaphore: asyncio.Semaphore()
+        max_size (int, optional): Skip captures larger than this many bytes. Defaults to None.
 
-    if limit:
+    Returns:
+        Sorted list of (timestamp, length) tuples, with None for unknown lengths:
+            [("20190101000000", 10234), ("20190102000000", None), ...]
+    """
+
+    # Default params get html snapshots from url domain w/ 200 status codes only. The query
+    # is built from the domain, so every url on it (www. or not) gets the same snapshots.
+    cdx_url = f"http://web.archive.org/cdx/search/cdx?url={get_domain(url)}&matchType=domain&filter=statuscode:200&filter={HTML_MIMETYPE_FILTER}&fl=timestamp,length,mimetype&output=JSON"
+
+    # Buckets are picked from here, so the limit applies after picking. The CDX api still
+    # gets a limit that covers every finer capture of the first (or last) limit buckets.
+    if frequency:
+        digits = int(frequency) + 2
+        if digits < 14:
+            cdx_url += f"&collapse=timestamp:{digits}"
+            if limit:
+                cdx_url += f"&limit={int(limit) * FINER_BUCKETS[int(frequency)]}"
+    elif limit:
         cdx_url += f"&limit={limit}"
 
     if start_date:
@@ -47,18 +141,125 @@ async def get_snapshot_timestamps(
 
     print("CDX url: ", cdx_url)
 
-    # Regex pattern to find 14-digit timestamps
-    pattern = re.compile(r"\d{14}")
-
     # Use session to get timestamps
     async with semaphore:
         async with session.get(cdx_url, headers=DEFAULT_HEADERS) as response:
-            timestamps = pattern.findall(await response.text())
+            text = await response.text()
 
-    print("Timestamps from CDX api: ", timestamps)
+    rows = []
+    for timestamp, length, mimetype in parse_cdx_json(text):
+        length = int(length) if length.isdigit() else None
+        if mimetype not in HTML_MIMETYPES:
+            continue
+        if max_size and length is not None and length > max_size:
+            continue
+        rows.append((timestamp, length))
+
+    # Lengths can be unknown (None), so captures in the same second aren't compared by length
+    rows.sort(key=lambda row: row[0])
+
+    if frequency:
+        rows = pick_smallest_per_bucket(rows, int(frequency))
+        if limit:
+            limit = int(limit)
+            rows = rows[:limit] if limit > 0 else rows[limit:]
+
+    return rows
 
-    # Return sorted timestamps
-    return sorted(timestamps)
+
+def pick_smallest_per_bucket(rows, digits):
+    """Picks the smallest capture for each timestamp prefix of a given length.
+
+    Args:
+        rows (list): Sorted (timestamp, length) tuples.
+        digits (int): Digits of the timestamp that identify a bucket (e.g. 4 for yearly).
+
+    Returns:
+        Sorted (timestamp, length) tuples, one per bucket. Ties go to the earliest capture,
+        and captures of unknown length are only picked if nothing else is in the bucket.
+    """
+
+    picked = {}
+    for timestamp, length in rows:
+        bucket = timestamp[:digits]
+        key = (length is None, length or 0)
+        if bucket not in picked or key < picked[bucket][0]:
+            picked[bucket] = (key, (timestamp, length))
+
+    return [row for _, row in picked.values()]
+
+
+async def get_capture_index(session, url, semaphore=asyncio.Semaphore(10)):
+    """Returns every archived capture of a single url (e.g. a script), with its content digest.
+
+    Args:
+        session (aiohttp.ClientSession)
+        url (str): Exact url to look up.
+        semaphore: asyncio.Semaphore()
+
+    Returns:
+        Sorted list of (timestamp, digest) tuples:
+            [("20190101000000", "3I42H3S6NNFQ2MSVX7XZKYAYSCX5QBYJ"), ...]
+    """
+
+    cdx_url = f"http://web.archive.org/cdx/search/cdx?url={quote(url, safe='')}&filter=statuscode:200&fl=timestamp,digest&output=JSON"
+
+    print("CDX url: ", cdx_url)
+
+    async with semaphore:
+        async with session.get(cdx_url, headers=DEFAULT_HEADERS) as response:
+            text = await response.text()
+
+    return sorted((timestamp, digest) for timestamp, digest in parse_cdx_json(text))
+
+
+def parse_cdx_json(text):
+    """Returns the rows of a CDX api response requested with output=JSON.
+
+    Bodies that aren't JSON (e.g. an error page when rate limited) are treated as having
+    no rows, like an empty response.
+
+    Args:
+        text (str): Response body.
+
+    Returns:
+        List of rows, without the first row (which holds the field names).
+    """
+
+    try:
+        rows = json.loads(text) if text.strip() else []
+    except ValueError:
+        print("Invalid response from CDX api: ", text[:100])
+        return []
+
+    return rows[1:] if isinstance(rows, list) else []
+
+
+def get_closest_capture(index, timestamp):
+    """Returns the capture in index closest in time to timestamp, or None if index is empty.
+
+    Args:
+        index (list): Sorted (timestamp, digest) tuples from get_capture_index().
+        timestamp (int or str): 14-digit timestamp.
+
+    Returns:
+        (timestamp, digest) or None
+    """
+
+    if not index:
+        return None
+
+    timestamp = str(timestamp)
+    position = bisect_left(index, (timestamp,))
+    candidates = index[max(position - 1, 0) : position + 1]
+
+    target = datetime.strptime(timestamp, "%Y%m%d%H%M%S")
+    return min(
+        candidates,
+        key=lambda capture: abs(
+            datetime.strptime(capture[0], "%Y%m%d%H%M%S") - target
+        ),
+    )
 
 
 async def get_codes_from_snapshots(session, url, timestamps, semaphore=asyncio.Semaphore(10)):
@@ -74,65 +275,159 @@ async def get_codes_from_snapshots(session, url, timestamps, semaphore=asyncio.S
         {
             "UA_codes": {
                 "UA-12345678-1": {
-                    "first_seen": "20190101000000",
-                    "last_seen": "20190101000000"
+                    "first_seen": "01/01/2019:00:00",
+                    "last_seen": "01/01/2019:00:00"
                 },
             "GA_codes": {
                 "G-1234567890": {
-                    "first_seen": "20190101000000",
-                    "last_seen": "20190101000000"
+                    "first_seen": "01/01/2019:00:00",
+                    "last_seen": "01/01/2019:00:00"
                     },
                 },
             "GTM_codes": {
                 "GTM-1234567890": {
-                    "first_seen": "20190101000000",
-                    "last_seen": "20190101000000"
+                    "first_seen": "01/01/2019:00:00",
+                    "last_seen": "01/01/2019:00:00"
                     },
                 },
         }
     """
 
-    # Build base url template for wayback machine
-    base_url = "https://web.archive.org/web/{timestamp}/" + url
+    sightings = await get_sightings_from_snapshots(session, url, timestamps, semaphore)
 
-    # Initialize results
-    results = {
-        "UA_codes": {},
-        "GA_codes": {},
-        "GTM_codes": {},
+    # Dates are only formatted once, when results are serialized
+    return {
+        f"{code_type}_codes": get_archived_dict(sightings[f"{code_type}_codes"])
+        for code_type in CODE_TYPES
     }
 
-    # Get codes from each timestamp with asyncio.gather().
+
+async def get_sightings_from_snapshots(
+    session, url, timestamps, semaphore=asyncio.Semaphore(10), script_cache=None
+):
+    """Returns the first and last snapshot each UA/GA/GTM code was seen in, as CodeSighting
+    objects with integer timestamps.
+
+    Args:
+        session (aiohttp.ClientSession)
+        url (str)
+        timestamps (list): List of timestamps to get codes from.
+        semaphore: asyncio.Semaphore()
+        script_cache (ScriptCache, optional): Also scan the page's archived same-site scripts
+            (see get_codes_from_single_timestamp()). Defaults to None.
+
+    Returns:
+        {
+            "UA_codes": {"UA-12345678-1": CodeSighting(20190101000000)},
+            "GA_codes": {},
+            "GTM_codes": {},
+        }
+    """
+
+    records = await get_records_from_snapshots(
+        session, url, timestamps, semaphore, script_cache=script_cache
+    )
+
+    return reduce_code_records(records)
+
+
+async def get_records_from_snapshots(
+    session,
+    url,
+    timestamps,
+    semaphore=asyncio.Semaphore(10),
+    deadline=None,
+    script_cache=None,
+):
+    """Returns the codes found in each snapshot, as records from get_codes_from_single_timestamp().
+
+    Args:
+        session (aiohttp.ClientSession)
+        url (str)
+        timestamps (list): List of timestamps to get codes from.
+        semaphore: asyncio.Semaphore()
+        deadline (float, optional): Event loop time (see get_deadline()) at which snapshots
+            still being fetched are cancelled. Defaults to None (no deadline).
+        script_cache (ScriptCache, optional): Also scan the page's archived same-site scripts
+            (see get_codes_from_single_timestamp()). Defaults to None.
+
+    Returns:
+        List of (timestamp, {"UA": [...], "GA": [...], "GTM": [...]}) records, in the order of
+        timestamps, with None for snapshots that couldn't be retrieved. Snapshots cancelled
+        at the deadline are left out, so fewer records than timestamps means the result was
+        truncated.
+    """
+
+    # Build base url template for wayback machine
+    base_url = "https://web.archive.org/web/{timestamp}/" + url
+
+    # Get codes from each timestamp with asyncio.gather(). Each task returns its own
+    # record, so no state is shared between tasks until they are reduced.
     tasks = [
-        get_codes_from_single_timestamp(session, base_url, timestamp, results, semaphore)
+        get_codes_from_single_timestamp(
+            session, base_url, timestamp, semaphore, script_cache=script_cache
+        )
         for timestamp in timestamps
     ]
-    await asyncio.gather(*tasks)
 
-    for code_type in results:
-        for code in results[code_type]:
-            results[code_type][code]["first_seen"] = get_date_from_timestamp(
-                results[code_type][code]["first_seen"]
-            )
-            results[code_type][code]["last_seen"] = get_date_from_timestamp(
-                results[code_type][code]["last_seen"]
-            )
+    if deadline is None:
+        return await asyncio.gather(*tasks)
+
+    tasks = [asyncio.ensure_future(task) for task in tasks]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=get_remaining(deadline))
+        for task in pending:
+            task.cancel()
+        # Wait for cancelled fetches to release the semaphore before returning
+        await asyncio.gather(*pending, return_exceptions=True)
 
-    return results
+    return [task.result() for task in tasks if not task.cancelled()]
 
 
-async def get_codes_from_single_timestamp(session, base_url, timestamp, results, semaphore=asyncio.Semaphore(10)):
-    """Returns UA/GA codes from a single archive.org snapshot and adds it to the results dictionary.
+def get_deadline(timeout=None, deadline=None):
+    """Returns the event loop time at which work started now with a timeout must stop.
+
+    Args:
+        timeout (float, optional): Seconds from now. Defaults to None.
+        deadline (float, optional): An earlier deadline that still applies (e.g. the job's). Defaults to None.
+
+    Returns:
+        float: Event loop time, or None if there is neither a timeout nor a deadline.
+    """
+
+    if timeout is not None:
+        timeout_deadline = asyncio.get_running_loop().time() + timeout
+        deadline = timeout_deadline if deadline is None else min(deadline, timeout_deadline)
+
+    return deadline
+
+
+def get_remaining(deadline):
+    """Returns seconds left until deadline (event loop time), or None without a deadline."""
+
+    if deadline is None:
+        return None
+
+    return max(0, deadline - asyncio.get_running_loop().time())
+
+
+async def get_codes_from_single_timestamp(
+    session, base_url, timestamp, semaphore=asyncio.Semaphore(10), script_cache=None
+):
+    """Returns UA/GA codes from a single archive.org snapshot.
 
     Args:
         session (aiohttp.ClientSession)
         base_url (str): Base url for archive.org snapshot.
         timestamp (str): 14-digit timestamp.
-        results (dict): Dictionary to add codes to (inherited from get_codes_from_snapshots()).
         semaphore: asyncio.Semaphore()
+        script_cache (ScriptCache, optional): Also add the codes in the archived versions of
+            the same-site scripts the snapshot loads (see ScriptCache.get_codes()). Defaults to None.
 
     Returns:
-        None
+        Record of the codes found, for reduce_code_records():
+            (20190101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []})
+        or None if the snapshot couldn't be retrieved.
     """
 
     # Use semaphore to limit number of concurrent requests
@@ -141,55 +436,19 @@ async def get_codes_from_single_timestamp(session, base_url, timestamp, results,
             base_url.format(timestamp=timestamp), headers=DEFAULT_HEADERS
         ) as response:
             try:
-                html = await response.text()
+                # Codes are ASCII, so the body is scanned without decoding it
+                body = await response.read()
 
                 print(
                     "Retrieving codes from url: ", base_url.format(timestamp=timestamp)
                 )
 
-                if html:
-                    # Get UA/GA codes from html
-                    UA_codes = get_UA_code(html)
-                    GA_codes = get_GA_code(html)
-                    GTM_codes = get_GTM_code(html)
-
-                    # above functions return lists, so iterate thru codes and update
-                    # results dict
-                    for code in UA_codes:
-                        if code not in results["UA_codes"]:
-                            results["UA_codes"][code] = {}
-                            results["UA_codes"][code]["first_seen"] = timestamp
-                            results["UA_codes"][code]["last_seen"] = timestamp
-
-                        if code in results["UA_codes"]:
-                            if timestamp < results["UA_codes"][code]["first_seen"]:
-                                results["UA_codes"][code]["first_seen"] = timestamp
-                            if timestamp > results["UA_codes"][code]["last_seen"]:
-                                results["UA_codes"][code]["last_seen"] = timestamp
-
-                    for code in GA_codes:
-                        if code not in results["GA_codes"]:
-                            results["GA_codes"][code] = {}
-                            results["GA_codes"][code]["first_seen"] = timestamp
-                            results["GA_codes"][code]["last_seen"] = timestamp
-
-                        if code in results["GA_codes"]:
-                            if timestamp < results["GA_codes"][code]["first_seen"]:
-                                results["GA_codes"][code]["first_seen"] = timestamp
-                            if timestamp > results["GA_codes"][code]["last_seen"]:
-                                results["GA_codes"][code]["last_seen"] = timestamp
-
-                    for code in GTM_codes:
-                        if code not in results["GTM_codes"]:
-                            results["GTM_codes"][code] = {}
-                            results["GTM_codes"][code]["first_seen"] = timestamp
-                            results["GTM_codes"][code]["last_seen"] = timestamp
-
-                        if code in results["GTM_codes"]:
-                            if timestamp < results["GTM_codes"][code]["first_seen"]:
-                                results["GTM_codes"][code]["first_seen"] = timestamp
-                            if timestamp > results["GTM_codes"][code]["last_seen"]:
-                                results["GTM_codes"][code]["last_seen"] = timestamp
+                if not body:
+                    return None
+
+                # Get UA/GA codes from html
+                found = get_codes_from_bytes(body)
+                srcs = get_script_srcs(body) if script_cache is not None else []
 
             except Exception as e:
                 print(
@@ -199,3 +458,41 @@ async def get_codes_from_single_timestamp(session, base_url, timestamp, results,
                 return None
 
         print("Finish gathering codes for: ", base_url.format(timestamp=timestamp))
+
+    # Scripts are fetched after releasing the semaphore, since they need it too
+    if srcs:
+        script_codes = await script_cache.get_codes(
+            session, base_url.format(timestamp=timestamp), timestamp, srcs, semaphore
+        )
+        for code_type, codes in script_codes.items():
+            found[code_type] += [code for code in codes if code not in found[code_type]]
+
+    return (int(timestamp), found)
+
+
+def get_shared_task(cache, key, coro_factory):
+    """Returns an awaitable for coro_factory(), shared by every caller using the same key.
+
+    The first caller for a key starts the task and later callers await that same task, so
+    the work runs once even if callers overlap.
+
+    Args:
+        cache (dict): Dict of key -> asyncio.Task, or None to disable sharing.
+        key (str): Cache key.
+        coro_factory (callable): Returns the coroutine to run for this key.
+
+    Returns:
+        Awaitable result of coro_factory().
+    """
+
+    if cache is None:
+        return coro_factory()
+
+    # Failed tasks are retried rather than shared, since caches can outlive a single run
+    task = cache.get(key)
+    if task is None or (
+        task.done() and (task.cancelled() or task.exception() is not None)
+    ):
+        cache[key] = asyncio.ensure_future(coro_factory())
+
+    return cache[key]
@@ -0,0 +1,439 @@
+import asyncio
+import json
+import os
+import weakref
+from array import array
+from datetime import datetime
+
+from wayback_google_analytics.urls import get_domain
+from wayback_google_analytics.utils import DEFAULT_HEADERS
+
+# Rows requested per CDX page when filling a store
+CDX_PAGE_SIZE = 10000
+
+# CDX digests are base32 SHA-1 hashes, always 32 characters
+DIGEST_WIDTH = 32
+
+# Captures that can hold script tags. Other captures on the domain (images, css, pdfs)
+# only lead to a nearby page capture that is fetched anyway.
+HTML_MIMETYPES = {"text/html", "application/xhtml+xml", "unk"}
+
+# Bumped when columns or meta.json fields change. Stores written by an older version are filled again.
+CDX_STORE_VERSION = 3
+
+# {event loop: {store path: asyncio.Lock}}, so one update per store runs at a time
+_update_locks = weakref.WeakKeyDictionary()
+
+
+class CdxStore:
+    """On-disk columnar copy of a domain's CDX index, reused across runs.
+
+    Every capture is one row, split across column files that CDX pages are appended to:
+
+        timestamps.i64     int64 14-digit timestamps
+        digests.s32        fixed-width 32-byte content digests
+        urlkeys.bin        url keys, concatenated
+        urlkey_ends.i64    int64 end offset of each url key in urlkeys.bin
+        lengths.i64        int64 archived sizes in bytes, -1 if unknown
+        html.u8            1 for html captures (see HTML_MIMETYPES), 0 otherwise
+        meta.json          row count, latest timestamp and fill progress, written last
+
+    Readers map the columns with numpy.memmap and only look at the first meta["rows"]
+    rows, so a page that was interrupted while being appended is ignored. A fill that was
+    interrupted between pages keeps its resume key in meta.json and is resumed by the next
+    update (see update_cdx_store()).
+
+    Args:
+        directory (str): Directory holding one subdirectory per domain.
+        domain (str): Domain (see get_domain()).
+    """
+
+    def __init__(self, directory, domain):
+        self.path = os.path.join(directory, domain)
+        self.domain = domain
+        os.makedirs(self.path, exist_ok=True)
+        self.meta = self._read_meta()
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._column_path("meta.json")) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = None
+
+        if meta is not None and meta.get("version") == CDX_STORE_VERSION:
+            return meta
+
+        if meta is not None:
+            print(f"CDX store for {self.domain} is from an older version, filling it again")
+
+        # No rows are visible, so the next append truncates the old columns
+        return self._empty_meta()
+
+    def _empty_meta(self):
+        return {
+            "version": CDX_STORE_VERSION,
+            "domain": self.domain,
+            "rows": 0,
+            "max_timestamp": None,
+            "updated": None,
+            # Whether the last fill reached the last CDX page
+            "complete": False,
+            # Resume key and from= timestamp of a fill that was interrupted between pages
+            "resume_key": None,
+            "fill_from": None,
+        }
+
+    def reset(self):
+        """Drops every row, so the store is filled again from scratch."""
+
+        self.meta = self._empty_meta()
+        self._write_meta()
+        self._truncate()
+
+    def _write_meta(self):
+        temp_path = self._column_path("meta.json.tmp")
+        with open(temp_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(temp_path, self._column_path("meta.json"))
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def _truncate(self):
+        """Drops rows past meta["rows"] left by an append that was interrupted."""
+
+        rows = self.meta["rows"]
+        sizes = {
+            "timestamps.i64": rows * 8,
+            "digests.s32": rows * DIGEST_WIDTH,
+            "urlkey_ends.i64": rows * 8,
+            "lengths.i64": rows * 8,
+            "html.u8": rows,
+            "urlkeys.bin": self._get_urlkeys_size(),
+        }
+        for name, size in sizes.items():
+            path = self._column_path(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+
+    def _get_urlkeys_size(self):
+        """Returns the end offset of the last stored url key."""
+
+        if not self.meta["rows"]:
+            return 0
+
+        with open(self._column_path("urlkey_ends.i64"), "rb") as f:
+            f.seek((self.meta["rows"] - 1) * 8)
+            end = array("q")
+            end.frombytes(f.read(8))
+        return end[0]
+
+    def append(self, rows, **meta):
+        """Appends a page of CDX rows to the column files.
+
+        Args:
+            rows (list): (urlkey, timestamp, digest, length, mimetype) tuples, as strings.
+            **meta: Fields of meta.json to update along with the rows (e.g. resume_key), so
+                the fill's progress is saved together with the page.
+
+        Returns:
+            int: Number of rows appended.
+        """
+
+        if not rows:
+            if meta:
+                self.meta.update(meta)
+                self._write_meta()
+            return 0
+
+        self._truncate()
+
+        timestamps = array("q")
+        urlkey_ends = array("q")
+        lengths = array("q")
+        html = bytearray()
+        digests = bytearray()
+        urlkeys = bytearray()
+        offset = self._get_urlkeys_size()
+
+        for urlkey, timestamp, digest, length, mimetype in rows:
+            urlkey = urlkey.encode()
+            urlkeys += urlkey
+            offset += len(urlkey)
+            urlkey_ends.append(offset)
+            timestamps.append(int(timestamp))
+            digests += digest.encode()[:DIGEST_WIDTH].ljust(DIGEST_WIDTH, b"\0")
+            lengths.append(int(length) if length.isdigit() else -1)
+            html.append(mimetype in HTML_MIMETYPES)
+
+        for name, data in [
+            ("timestamps.i64", timestamps.tobytes()),
+            ("digests.s32", bytes(digests)),
+            ("urlkeys.bin", bytes(urlkeys)),
+            ("urlkey_ends.i64", urlkey_ends.tobytes()),
+            ("lengths.i64", lengths.tobytes()),
+            ("html.u8", bytes(html)),
+        ]:
+            with open(self._column_path(name), "ab") as f:
+                f.write(data)
+
+        # Rows only become visible once meta.json is updated
+        max_timestamp = max(timestamps)
+        if self.meta["max_timestamp"]:
+            max_timestamp = max(max_timestamp, int(self.meta["max_timestamp"]))
+        self.meta.update(meta)
+        self.meta["rows"] += len(rows)
+        self.meta["max_timestamp"] = str(max_timestamp)
+        self.meta["updated"] = datetime.now().strftime("%Y%m%d%H%M%S")
+        self._write_meta()
+
+        return len(rows)
+
+    def _map(self, name, dtype):
+        """Returns a read-only memmap over the first meta["rows"] rows of a column."""
+
+        # Imported here so NumPy is only loaded when a store is used
+        import numpy as np
+
+        if not self.meta["rows"]:
+            return np.empty(0, dtype=dtype)
+
+        return np.memmap(
+            self._column_path(name), dtype=dtype, mode="r", shape=(self.meta["rows"],)
+        )
+
+    def get_timestamps(self):
+        """Returns the timestamps column as an int64 memmap."""
+
+        return self._map("timestamps.i64", "<i8")
+
+    def get_digests(self):
+        """Returns the digests column as a fixed-width bytes memmap."""
+
+        return self._map("digests.s32", f"S{DIGEST_WIDTH}")
+
+    def get_lengths(self):
+        """Returns the lengths column as an int64 memmap, with -1 for unknown sizes."""
+
+        return self._map("lengths.i64", "<i8")
+
+    def get_html(self):
+        """Returns the html column as a uint8 memmap."""
+
+        return self._map("html.u8", "u1")
+
+    def get_urlkey(self, row):
+        """Returns the url key of a single row."""
+
+        ends = self._map("urlkey_ends.i64", "<i8")
+        start = int(ends[row - 1]) if row else 0
+        with open(self._column_path("urlkeys.bin"), "rb") as f:
+            f.seek(start)
+            return f.read(int(ends[row]) - start).decode()
+
+    def get_urlkeys_at(self, timestamp):
+        """Returns the url keys of the stored captures at exactly timestamp.
+
+        Args:
+            timestamp (int or str): 14-digit timestamp.
+
+        Returns:
+            set of url keys
+        """
+
+        import numpy as np
+
+        rows = np.flatnonzero(self.get_timestamps() == int(timestamp))
+        return {self.get_urlkey(int(row)) for row in rows}
+
+    def select_timestamps(
+        self,
+        start_date=None,
+        end_date=None,
+        frequency=None,
+        limit=None,
+        dedupe=False,
+        max_size=None,
+    ):
+        """Selects snapshot timestamps the way the CDX api would, without loading rows as
+        Python objects. Only the selected timestamps are converted to strings.
+
+        Like get_snapshot_rows(), only html captures are selected.
+
+        Args:
+            start_date (str, optional): 14-digit timestamp for starting point.
+            end_date (str, optional): 14-digit timestamp for end of range.
+            frequency (str, optional): Collapse option (digits of the timestamp to keep one capture per).
+            limit (int, optional): First (positive) or last (negative) number of snapshots.
+            dedupe (bool): Keep only the first capture of identical content (same digest).
+                This can select different snapshots than the CDX api would. Defaults to False.
+            max_size (int, optional): Skip captures larger than this many bytes. Defaults to None.
+
+        Returns:
+            Sorted list of timestamps:
+                ["20190101000000", "20190102000000", ...]
+        """
+
+        import numpy as np
+
+        timestamps = self.get_timestamps()
+
+        # CDX rows are sorted by url key, so order rows by time
+        order = np.argsort(timestamps, kind="stable")
+        sorted_timestamps = timestamps[order]
+
+        start = 0
+        end = len(order)
+        if start_date:
+            start = np.searchsorted(sorted_timestamps, int(start_date), side="left")
+        if end_date:
+            end = np.searchsorted(sorted_timestamps, int(end_date), side="right")
+        rows = order[start:end]
+
+        keep = self.get_html()[rows] == 1
+        if max_size:
+            lengths = self.get_lengths()[rows]
+            keep &= (lengths < 0) | (lengths <= max_size)
+        rows = rows[keep]
+
+        if dedupe and len(rows):
+            _, first = np.unique(self.get_digests()[rows], return_index=True)
+            rows = rows[np.sort(first)]
+
+        if frequency and len(rows):
+            buckets = timestamps[rows] // 10 ** (14 - int(frequency))
+            _, first = np.unique(buckets, return_index=True)
+            rows = rows[np.sort(first)]
+
+        if limit:
+            limit = int(limit)
+            rows = rows[:limit] if limit > 0 else rows[limit:]
+
+        return [str(timestamp) for timestamp in timestamps[rows]]
+
+
+def parse_cdx_page(text):
+    """Parses a plain text CDX page requested with fl=urlkey,timestamp,digest,length,mimetype
+    and showResumeKey=true.
+
+    Args:
+        text (str): Response body.
+
+    Returns:
+        (rows, resume_key): rows as (urlkey, timestamp, digest, length, mimetype) tuples,
+        and the key for the next page or None if this was the last page.
+    """
+
+    rows = []
+    resume_key = None
+    lines = text.splitlines()
+
+    for index, line in enumerate(lines):
+        # The resume key follows a blank line at the end of the page
+        if not line.strip():
+            remaining = [line for line in lines[index + 1 :] if line.strip()]
+            resume_key = remaining[0].strip() if remaining else None
+            break
+
+        fields = line.split()
+        if len(fields) == 5:
+            rows.append(tuple(fields))
+
+    return rows, resume_key
+
+
+async def update_cdx_store(session, url, store, semaphore):
+    """Appends captures of url's domain that aren't in the store yet, one CDX page at a time.
+
+    The first run fetches the domain's whole index of 200 captures. Later runs only fetch
+    captures from the latest stored timestamp on. Pages are ordered by url key rather than
+    time, so a fill that is interrupted (an error, or a url timeout cancelling it) is
+    resumed from its saved resume key instead, and one interrupted before a key was saved
+    is started again. Updates of the same store wait for each other, so urls on the same
+    domain (e.g. in stream mode, which has no CDX cache) don't append the same captures twice.
+
+    Args:
+        session (aiohttp.ClientSession)
+        url (str): Url whose domain is queried (matchType=domain).
+        store (CdxStore): Store for url's domain.
+        semaphore: asyncio.Semaphore()
+
+    Returns:
+        int: Number of rows appended.
+    """
+
+    locks = _update_locks.setdefault(asyncio.get_running_loop(), {})
+    async with locks.setdefault(os.path.abspath(store.path), asyncio.Lock()):
+        return await _update_cdx_store(session, url, store, semaphore)
+
+
+async def _update_cdx_store(session, url, store, semaphore):
+    """Does the work of update_cdx_store() while holding the store's lock."""
+
+    # Another url on the domain may have updated the store while this one waited
+    store.meta = store._read_meta()
+
+    if store.meta["resume_key"]:
+        print(f"Resuming the interrupted CDX fill for {store.domain}")
+        fill_from = store.meta["fill_from"]
+        resume_key = store.meta["resume_key"]
+    else:
+        if len(store) and not store.meta["complete"]:
+            print(f"CDX fill for {store.domain} was interrupted, filling it again")
+            store.reset()
+        fill_from = store.meta["max_timestamp"]
+        resume_key = None
+
+    # Queried by domain, so the index doesn't depend on which url on the domain came first
+    base_url = f"http://web.archive.org/cdx/search/cdx?url={get_domain(url)}&matchType=domain&filter=statuscode:200&fl=urlkey,timestamp,digest,length,mimetype&showResumeKey=true&limit={CDX_PAGE_SIZE}"
+
+    # from= is inclusive, so captures at fill_from that are already stored are skipped.
+    # Other urls captured in the same second are still new.
+    stored_at_from = set()
+    if fill_from:
+        base_url += f"&from={fill_from}"
+        stored_at_from = store.get_urlkeys_at(fill_from)
+
+    appended = 0
+
+    while True:
+        cdx_url = base_url
+        if resume_key:
+            # Resume keys are returned url-encoded
+            cdx_url += f"&resumeKey={resume_key}"
+
+        print("CDX url: ", cdx_url)
+
+        async with semaphore:
+            async with session.get(cdx_url, headers=DEFAULT_HEADERS) as response:
+                # Error pages have no resume key, so they would end the fill early
+                response.raise_for_status()
+                rows, resume_key = parse_cdx_page(await response.text())
+
+        if fill_from:
+            rows = [
+                row
+                for row in rows
+                if int(row[1]) > int(fill_from)
+                or (int(row[1]) == int(fill_from) and row[0] not in stored_at_from)
+            ]
+
+        # The resume key is saved with the page, so an interrupted fill resumes after it
+        appended += store.append(
+            rows,
+            complete=not resume_key,
+            resume_key=resume_key,
+            fill_from=fill_from if resume_key else None,
+        )
+
+        if not resume_key:
+            break
+
+    print(f"Stored {appended} new CDX rows for {store.domain} ({len(store)} total)")
+
+    return appended
@@ -0,0 +1,133 @@
+import re
+
+# UA-<account>-<property>: properties of one account share the account number
+UA_PATTERN = re.compile(r"^(UA-\d+)-\d+$")
+
+
+def get_account_id(code):
+    """Returns the id that links sites using a code: the account for UA properties, or the
+    code itself for GTM containers and GA4 measurement ids (which don't expose an account).
+
+    Args:
+        code (str): UA, GA or GTM code.
+
+    Returns:
+        str: Account or container id.
+
+    Example: "UA-12345678-2" -> "UA-12345678", "GTM-ABC1234" -> "GTM-ABC1234"
+    """
+
+    code = code.strip().upper()
+    match = UA_PATTERN.match(code)
+    return match.group(1) if match else code
+
+
+class UnionFind:
+    """Disjoint sets of sites, grown one link at a time.
+
+    Uses union by size and path halving, so each add/union/find runs in near-constant
+    time and clustering stays linear in the number of sightings.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, item):
+        """Adds item as its own set if it isn't already in one."""
+
+        if item not in self.parent:
+            self.parent[item] = item
+            self.size[item] = 1
+
+    def find(self, item):
+        """Returns the root of item's set."""
+
+        parent = self.parent
+        while parent[item] != item:
+            parent[item] = parent[parent[item]]
+            item = parent[item]
+        return item
+
+    def union(self, a, b):
+        """Merges the sets containing a and b and returns the new root."""
+
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+
+        self.parent[b] = a
+        self.size[a] += self.size.pop(b)
+        return a
+
+
+def cluster_sightings(sightings, min_size=1):
+    """Groups sites into clusters linked by any shared UA account, GA id or GTM container.
+
+    Each sighting links its site to the first site seen with the same account, so no pair
+    of sites is ever compared directly.
+
+    Args:
+        sightings (iterable): (url, code) tuples, e.g. from ResultStore.iter_sightings().
+        min_size (int): Smallest number of sites in a cluster to return. Defaults to 1.
+
+    Returns:
+        Clusters ordered by size, largest first:
+        [
+            {
+                "id": 0,
+                "size": 2,
+                "urls": ["otherurl.org", "someurl.com"],
+                "accounts": ["GTM-ABC1234", "UA-12345678"],
+            },
+        ]
+    """
+
+    sites = UnionFind()
+    # First site seen with each account, which later sites are linked to
+    account_sites = {}
+
+    for url, code in sightings:
+        account = get_account_id(code)
+        sites.add(url)
+
+        if account in account_sites:
+            sites.union(url, account_sites[account])
+        else:
+            account_sites[account] = url
+
+    members = {}
+    for url in sites.parent:
+        members.setdefault(sites.find(url), []).append(url)
+
+    accounts = {}
+    for account, url in account_sites.items():
+        accounts.setdefault(sites.find(url), []).append(account)
+
+    clusters = sorted(
+        (
+            (sorted(urls), sorted(accounts[root]))
+            for root, urls in members.items()
+            if len(urls) >= min_size
+        ),
+        key=lambda cluster: (-len(cluster[0]), cluster[0][0]),
+    )
+
+    return [
+        {"id": id, "size": len(urls), "urls": urls, "accounts": cluster_accounts}
+        for id, (urls, cluster_accounts) in enumerate(clusters)
+    ]
+
+
+def print_clusters(clusters):
+    """Prints clusters from cluster_sightings() as a readable summary."""
+
+    for cluster in clusters:
+        print(
+            f"Cluster {cluster['id']}: {cluster['size']} site(s) linked by {', '.join(cluster['accounts'])}"
+        )
+        for url in cluster["urls"]:
+            print(f"  {url}")
@@ -1,7 +1,24 @@
-from bs4 import BeautifulSoup
 import re
 
 
+def get_script_tags(html):
+    """Returns all script tags from given html, parsed with BeautifulSoup.
+
+    BeautifulSoup is imported here rather than at module level so that commands which
+    never parse html (e.g. --help) don't pay for importing it.
+
+    Args:
+        html (str): Raw html.
+
+    Returns:
+        [<script>...</script>, ...]
+    """
+
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html, "html.parser").find_all("script")
+
+
 def get_UA_code(html):
     """Returns UA codes (w/o duplicates) from given html, or None if not found.
 
@@ -13,7 +30,7 @@ def get_UA_code(html):
     """
 
     # Only search for codes in script tags
-    script_tags = BeautifulSoup(html, "html.parser").find_all("script")
+    script_tags = get_script_tags(html)
 
     # Regex pattern to find UA codes
     pattern = re.compile(r"UA-[\d-]{5,15}")
@@ -22,7 +39,7 @@ def get_UA_code(html):
 
     UA_codes = []
     for script in script_tags:
-        curr_codes = pattern.findall(script.text)
+        curr_codes = pattern.findall(script.text) + pattern.findall(script.get("src", ""))
         UA_codes += curr_codes
 
 
@@ -41,7 +58,7 @@ def get_GA_code(html):
     """
 
     # Only search for codes in script tags
-    script_tags = BeautifulSoup(html, "html.parser").find_all("script")
+    script_tags = get_script_tags(html)
 
     # Regex pattern to find GA codes
     pattern = re.compile(r"G-[\d-]{5,15}")
@@ -50,7 +67,7 @@ def get_GA_code(html):
 
     GA_codes = []
     for script in script_tags:
-        curr_codes = pattern.findall(script.text)
+        curr_codes = pattern.findall(script.text) + pattern.findall(script.get("src", ""))
         GA_codes += curr_codes
 
     # Remove duplicates and return
@@ -67,7 +84,7 @@ def get_GTM_code(html):
     """
 
     # Only search for codes in script tags
-    script_tags = BeautifulSoup(html, "html.parser").find_all("script")
+    script_tags = get_script_tags(html)
 
     # This pattern
     pattern = re.compile(r"GTM-[\w-]{1,15}")
@@ -76,9 +93,106 @@ def get_GTM_code(html):
 
     GTM_codes = []
     for script in script_tags:
-        curr_codes = pattern.findall(script.text)
+        curr_codes = pattern.findall(script.text) + pattern.findall(script.get("src", ""))
         GTM_codes += curr_codes
 
 
     # Remove duplicates and return
     return list(set(GTM_codes))
+
+
+# Byte patterns for get_codes_from_bytes(). Comments are matched too, so that scripts
+# inside them are skipped like html.parser skips them, while comments inside scripts
+# (common in old pages) stay part of the script.
+SCRIPT_PATTERN = re.compile(
+    rb"<!--.*?(?:-->|\Z)|<script\b([^>]*)>(.*?)(?:</script\s*>|\Z)", re.I | re.S
+)
+SRC_PATTERN = re.compile(rb"""\bsrc\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.I)
+CODE_PATTERNS = {
+    "UA": re.compile(rb"UA-[\d-]{5,15}"),
+    "GA": re.compile(rb"G-[\d-]{5,15}"),
+    "GTM": re.compile(rb"GTM-[\w-]{1,15}"),
+}
+
+
+def to_ascii_compatible(body):
+    """Returns body re-encoded as UTF-8 if it is UTF-16, otherwise body unchanged.
+
+    Pages in any ASCII-compatible encoding (UTF-8, Latin-1, Shift JIS, ...) can be scanned
+    as they are, since codes and script tags are plain ASCII. UTF-16 pages are recognised by
+    their byte order mark, or by null bytes between the characters of the first line.
+
+    Args:
+        body (bytes): Raw response body.
+
+    Returns:
+        bytes
+    """
+
+    if body[:2] in (b"\xff\xfe", b"\xfe\xff"):
+        return body.decode("utf-16", errors="replace").encode("utf-8")
+
+    head = body[:512]
+    if head and head.count(b"\x00") > len(head) // 4:
+        encoding = "utf-16-le" if head[1:2] == b"\x00" else "utf-16-be"
+        return body.decode(encoding, errors="replace").encode("utf-8")
+
+    return body
+
+
+def iter_scripts(body):
+    """Yields the src attribute and text of every script tag in a raw page.
+
+    Args:
+        body (bytes): Raw response body.
+
+    Yields:
+        (src, text) as bytes, with b"" for a missing src or empty text.
+    """
+
+    for script in SCRIPT_PATTERN.finditer(to_ascii_compatible(body)):
+        if script.group(0).startswith(b"<!--"):
+            continue
+        # The src is double-quoted, single-quoted or bare
+        src = SRC_PATTERN.search(script.group(1))
+        src = b"".join(value or b"" for value in src.groups()) if src else b""
+        yield src, script.group(2)
+
+
+def get_codes_from_bytes(body):
+    """Returns UA, GA and GTM codes (w/o duplicates) from the script tags of a raw page.
+
+    Finds the same codes as get_UA_code(), get_GA_code() and get_GTM_code(), but scans the
+    bytes directly instead of decoding the page and parsing it with BeautifulSoup. Only the
+    matched codes are decoded.
+
+    Args:
+        body (bytes): Raw response body.
+
+    Returns:
+        {"UA": ["UA-12345678-1"], "GA": ["G-1234567890"], "GTM": ["GTM-ABC1234"]}
+    """
+
+    found = {code_type: {} for code_type in CODE_PATTERNS}
+
+    for src, text in iter_scripts(body):
+        for code_type, pattern in CODE_PATTERNS.items():
+            # Loaders name the id they load in their src (e.g. gtag/js?id=G-1234567890)
+            for code in pattern.findall(src) + pattern.findall(text):
+                found[code_type][code.decode("ascii")] = True
+
+    return {code_type: list(codes) for code_type, codes in found.items()}
+
+
+def get_script_srcs(body):
+    """Returns the src of every external script in a raw page (w/o duplicates).
+
+    Args:
+        body (bytes): Raw response body.
+
+    Returns:
+        ["/web/20190101000000js_/https://www.someurl.com/js/app.js", ...]
+    """
+
+    srcs = (src.decode("utf-8", errors="replace").strip() for src, _ in iter_scripts(body))
+    return list(dict.fromkeys(src for src in srcs if src))
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+# Package directory, used to find the scraper's own frames in a blocked stack
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def install_uvloop():
+    """Switches asyncio to uvloop's faster event loop if it is installed.
+
+    Returns:
+        bool: True if uvloop is used, False if it isn't installed.
+    """
+
+    try:
+        import uvloop
+    except ImportError:
+        print(
+            "uvloop is not installed, using the default event loop. Install it with: pip install uvloop"
+        )
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+class LoopLagMonitor:
+    """Measures event loop lag and reports where synchronous code blocks the loop.
+
+    A sampler coroutine sleeps for `interval` and records how late it wakes up. A watchdog
+    thread notices when the sampler is overdue by more than `threshold` and captures the
+    loop thread's stack at that moment, so reports point at the blocking code (e.g.
+    BeautifulSoup parsing in get_codes_from_single_timestamp()) rather than at whatever
+    happened to run next.
+
+    Args:
+        threshold (float): Lag in seconds that counts as blocking. Defaults to 0.1.
+        interval (float): Seconds between samples. Defaults to 0.05.
+        verbose (bool): Print each blocking event as it happens. Defaults to True.
+    """
+
+    def __init__(self, threshold=0.1, interval=0.05, verbose=True):
+        self.threshold = threshold
+        self.interval = interval
+        self.verbose = verbose
+
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked = 0
+        self.locations = Counter()
+
+        self._last_beat = None
+        self._blocked_stack = None
+        self._loop_thread_id = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Starts sampling the running event loop."""
+
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
+
+        return self
+
+    def stop(self):
+        """Stops sampling."""
+
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+        if self._watchdog:
+            self._watchdog.join()
+
+    async def _sample(self):
+        """Records how late each wake-up is compared to the requested interval."""
+
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+
+            lag = max(0.0, now - start - self.interval)
+            self.samples += 1
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+            if lag >= self.threshold:
+                self.blocked += 1
+                location = self._blocked_stack or "unknown (blocked between watchdog checks)"
+                self.locations[location] += 1
+                if self.verbose:
+                    print(f"Event loop blocked for {lag:.3f}s at: {location}")
+
+            self._blocked_stack = None
+
+    def _watch(self):
+        """Captures the loop thread's stack while the sampler is overdue."""
+
+        while not self._stopped.wait(self.threshold / 4):
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue >= self.threshold and self._blocked_stack is None:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._blocked_stack = format_blocking_location(frame)
+
+    def get_report(self):
+        """Returns a summary of loop lag.
+
+        Returns:
+            {
+                "samples": 120,
+                "mean_lag": 0.004,
+                "max_lag": 0.35,
+                "blocked": 3,
+                "locations": [("codes.py:16 in get_UA_code <- ...", 3)],
+            }
+        """
+
+        return {
+            "samples": self.samples,
+            "mean_lag": self.total_lag / self.samples if self.samples else 0.0,
+            "max_lag": self.max_lag,
+            "blocked": self.blocked,
+            "locations": self.locations.most_common(10),
+        }
+
+    def print_report(self):
+        """Prints a summary of loop lag and the most common blocking locations."""
+
+        report = self.get_report()
+        print(
+            f"Event loop lag: {report['samples']} samples, mean {report['mean_lag'] * 1000:.1f}ms, "
+            f"max {report['max_lag'] * 1000:.1f}ms, blocked > {self.threshold * 1000:.0f}ms {report['blocked']} times"
+        )
+        for location, count in report["locations"]:
+            print(f"  {count}x {location}")
+
+
+def format_blocking_location(frame):
+    """Formats a stack as "innermost frame <- scraper frames", e.g.
+    "parser.py:120 in feed <- codes.py:16 in get_UA_code <- async_utils.py:152 in get_codes_from_single_timestamp".
+
+    Args:
+        frame: Innermost frame of the blocked thread.
+
+    Returns:
+        str: Blocking location.
+    """
+
+    stack = traceback.extract_stack(frame)
+
+    def describe(entry):
+        return f"{os.path.basename(entry.filename)}:{entry.lineno} in {entry.name}"
+
+    # Innermost frames first
+    package_frames = [
+        entry
+        for entry in reversed(stack)
+        if entry.filename.startswith(PACKAGE_DIR)
+        and not entry.filename.endswith("event_loop.py")
+    ]
+
+    parts = [describe(stack[-1])]
+    parts += [describe(entry) for entry in package_frames[:3] if entry is not stack[-1]]
+
+    return " <- ".join(parts)
+
+
+async def run_monitored(coro, threshold=0.1):
+    """Awaits a coroutine while a LoopLagMonitor runs, then prints its report.
+
+    Args:
+        coro: Coroutine to run (e.g. main(args)).
+        threshold (float): Lag in seconds that counts as blocking. Defaults to 0.1.
+
+    Returns:
+        Result of coro.
+    """
+
+    monitor = LoopLagMonitor(threshold=threshold).start()
+    try:
+        return await coro
+    finally:
+        monitor.stop()
+        monitor.print_report()
@@ -0,0 +1,166 @@
+import asyncio
+
+from wayback_google_analytics.async_utils import (
+    get_capture_index,
+    get_closest_capture,
+    get_shared_task,
+)
+from wayback_google_analytics.codes import CODE_PATTERNS
+from wayback_google_analytics.utils import DEFAULT_HEADERS
+
+# Container script that holds the tags (and UA/GA ids) a GTM container configures
+GTM_JS_URL = "www.googletagmanager.com/gtm.js?id={container}"
+
+
+class ContainerCache:
+    """Shares gtm.js lookups between snapshots and urls.
+
+    Each container's CDX index is queried once, and each version of a container (same
+    content digest) is fetched and scanned once, however many snapshots it was live in.
+    """
+
+    def __init__(self):
+        # {container: task returning [(timestamp, digest), ...]}
+        self.indexes = {}
+        # {(container, digest): task returning {"UA": [...], "GA": [...]}}
+        self.versions = {}
+
+
+async def get_container_index(session, container, semaphore):
+    """Returns every archived capture of a container's gtm.js.
+
+    Args:
+        session (aiohttp.ClientSession)
+        container (str): GTM container id (e.g. GTM-ABC1234).
+        semaphore: asyncio.Semaphore()
+
+    Returns:
+        Sorted list of (timestamp, digest) tuples (see get_capture_index()).
+    """
+
+    return await get_capture_index(
+        session, GTM_JS_URL.format(container=container), semaphore
+    )
+
+
+async def get_container_codes(session, container, timestamp, semaphore):
+    """Returns the UA and GA ids configured in one archived version of a container.
+
+    Args:
+        session (aiohttp.ClientSession)
+        container (str): GTM container id.
+        timestamp (str): 14-digit timestamp of the gtm.js capture.
+        semaphore: asyncio.Semaphore()
+
+    Returns:
+        {"UA": ["UA-12345678-1"], "GA": ["G-1234567890"]}
+    """
+
+    # id_ returns the capture as archived, without the Wayback Machine's rewriting
+    url = f"https://web.archive.org/web/{timestamp}id_/https://{GTM_JS_URL.format(container=container)}"
+
+    print("Retrieving container: ", url)
+
+    async with semaphore:
+        async with session.get(url, headers=DEFAULT_HEADERS) as response:
+            body = await response.read()
+
+    return {
+        code_type: list(
+            dict.fromkeys(
+                code.decode("ascii") for code in CODE_PATTERNS[code_type].findall(body)
+            )
+        )
+        for code_type in ["UA", "GA"]
+    }
+
+
+async def expand_gtm_records(session, records, semaphore, cache=None):
+    """Returns the UA and GA ids configured by the GTM containers found in each snapshot.
+
+    Each snapshot uses the archived version of its containers closest to it in time.
+
+    Args:
+        session (aiohttp.ClientSession)
+        records (list): Records from get_records_from_snapshots().
+        semaphore: asyncio.Semaphore()
+        cache (ContainerCache, optional): Cache shared with other urls. Defaults to a new cache.
+
+    Returns:
+        List of records in the same format, with the ids configured through GTM:
+            [(20190101000000, {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}), ...]
+    """
+
+    if cache is None:
+        cache = ContainerCache()
+
+    records = [record for record in records if record and record[1].get("GTM")]
+    containers = list(
+        dict.fromkeys(container for _, found in records for container in found["GTM"])
+    )
+
+    # Shared tasks are shielded, so this url timing out doesn't cancel them for other urls
+    indexes = await asyncio.gather(
+        *[
+            asyncio.shield(
+                get_shared_task(
+                    cache.indexes,
+                    container,
+                    lambda container=container: get_container_index(
+                        session, container, semaphore
+                    ),
+                )
+            )
+            for container in containers
+        ],
+        return_exceptions=True,
+    )
+
+    # Containers whose captures couldn't be listed (or were cancelled) are skipped
+    indexes = dict(zip(containers, indexes))
+    for container, index in indexes.items():
+        if isinstance(index, BaseException):
+            print(f"Error retrieving captures of container {container}: ", index)
+            indexes[container] = []
+
+    # Version of each container that each snapshot used
+    versions = {}
+    for timestamp, found in records:
+        for container in found["GTM"]:
+            capture = get_closest_capture(indexes[container], timestamp)
+            if capture is not None:
+                versions[(timestamp, container)] = capture
+
+    async def get_version_codes(container, capture):
+        capture_timestamp, digest = capture
+        return await asyncio.shield(
+            get_shared_task(
+                cache.versions,
+                (container, digest),
+                lambda: get_container_codes(
+                    session, container, capture_timestamp, semaphore
+                ),
+            )
+        )
+
+    keys = list(versions)
+    version_codes = await asyncio.gather(
+        *[
+            get_version_codes(container, versions[timestamp, container])
+            for timestamp, container in keys
+        ],
+        return_exceptions=True,
+    )
+
+    expanded = {}
+    for (timestamp, container), codes in zip(keys, version_codes):
+        if isinstance(codes, BaseException):
+            print(f"Error retrieving container {container}: ", codes)
+            continue
+        found = expanded.setdefault(timestamp, {"UA": [], "GA": [], "GTM": []})
+        for code_type, code_list in codes.items():
+            found[code_type] += [
+                code for code in code_list if code not in found[code_type]
+            ]
+
+    return sorted(expanded.items())
@@ -0,0 +1,140 @@
+import csv
+import json
+import os
+import sys
+
+# Input formats accepted by iter_urls()
+INPUT_FORMATS = ["txt", "csv", "jsonl"]
+
+
+def get_input_format(path, input_format=None):
+    """Returns the input format for a given path, guessing from its extension if not provided.
+
+    Args:
+        path (str): Path to input file, or "-" for stdin.
+        input_format (str, optional): txt/csv/jsonl. Defaults to None.
+
+    Returns:
+        str: txt/csv/jsonl.
+    """
+
+    if input_format:
+        if input_format not in INPUT_FORMATS:
+            raise ValueError(
+                f"Invalid input format: {input_format}. Please use txt, csv or jsonl."
+            )
+        return input_format
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".csv":
+        return "csv"
+
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+
+    # Plain text (one url per line) for stdin and everything else
+    return "txt"
+
+
+def iter_urls(path, input_format=None, column=None):
+    """Opens a file (or stdin) and returns a generator that lazily yields one url at a time.
+
+    The file is opened immediately so a missing path raises FileNotFoundError here rather
+    than on the first iteration.
+
+    Args:
+        path (str): Path to input file, or "-" for stdin.
+        input_format (str, optional): txt/csv/jsonl. Guessed from extension if not provided.
+        column (str, optional): Column name or index (csv) or key (jsonl) holding the url.
+            Defaults to a "url" column/key, or the first column of a csv without a header.
+
+    Returns:
+        Generator of urls:
+            "https://www.someurl.com", "https://www.someotherurl.com", ...
+    """
+
+    input_format = get_input_format(path, input_format)
+
+    if path == "-":
+        stream = sys.stdin
+    else:
+        stream = open(path, "r", newline="")
+
+    readers = {
+        "txt": _iter_txt_urls,
+        "csv": _iter_csv_urls,
+        "jsonl": _iter_jsonl_urls,
+    }
+
+    def generator():
+        try:
+            for url in readers[input_format](stream, column):
+                url = url.strip()
+                if url:
+                    yield url
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+    return generator()
+
+
+def _iter_txt_urls(stream, column=None):
+    """Yields one url per line, skipping blank lines and # comments."""
+
+    for line in stream:
+        if not line.lstrip().startswith("#"):
+            yield line
+
+
+def _iter_csv_urls(stream, column=None):
+    """Yields urls from a single csv column."""
+
+    reader = csv.reader(stream)
+
+    # Column given as an index, e.g. --input_column 2
+    if column is not None and str(column).isdigit():
+        index = int(column)
+        for row in reader:
+            if len(row) > index:
+                yield row[index]
+        return
+
+    first_row = next(reader, None)
+    if first_row is None:
+        return
+
+    header = [cell.strip().lower() for cell in first_row]
+    name = (column or "url").lower()
+
+    if name in header:
+        index = header.index(name)
+    elif column:
+        raise ValueError(f"Column '{column}' not found in csv header: {first_row}")
+    else:
+        # No header, so use the first column and treat the first row as data
+        index = 0
+        if first_row:
+            yield first_row[0]
+
+    for row in reader:
+        if len(row) > index:
+            yield row[index]
+
+
+def _iter_jsonl_urls(stream, column=None):
+    """Yields urls from json lines, either plain strings or objects with a url key."""
+
+    key = column or "url"
+
+    for line in stream:
+        if not line.strip():
+            continue
+
+        item = json.loads(line)
+
+        if isinstance(item, str):
+            yield item
+        elif isinstance(item, dict) and item.get(key):
+            yield item[key]
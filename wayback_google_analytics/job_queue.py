@@ -0,0 +1,546 @@
+import aiohttp
+import asyncio
+import functools
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from wayback_google_analytics.async_utils import (
+    get_snapshot_timestamps,
+    get_codes_from_snapshots,
+)
+from wayback_google_analytics.models import SeenDates
+from wayback_google_analytics.scraper import get_current_codes
+from wayback_google_analytics.single_flight import SingleFlightSession
+from wayback_google_analytics.utils import get_14_digit_timestamp
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    url TEXT NOT NULL,
+    page INTEGER NOT NULL DEFAULT 0,
+    payload TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    UNIQUE (kind, url, page)
+);
+CREATE INDEX IF NOT EXISTS items_status ON items (status, lease_expires);
+CREATE TABLE IF NOT EXISTS current_codes (
+    url TEXT PRIMARY KEY,
+    codes TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS archived_codes (
+    url TEXT NOT NULL,
+    code_type TEXT NOT NULL,
+    code TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    PRIMARY KEY (url, code_type, code)
+);
+"""
+
+# Options stored with a job so every worker scrapes with the same settings
+JOB_OPTIONS = ["start_date", "end_date", "frequency", "limit", "skip_current"]
+
+
+class JobQueue:
+    """SQLite-backed work queue so several processes or containers on the same host can work
+    on one job.
+
+    The database uses WAL mode, which relies on shared memory between the processes using
+    it, so the file must be on a local disk. Network filesystems (NFS, SMB) can corrupt it.
+
+    Each input url is a "url" item (current codes + CDX query). Completing it adds
+    "snapshots" items, one per page of CDX timestamps, which are scraped with
+    get_codes_from_snapshots(). Workers lease items, keep leases alive with heartbeats and
+    write results back in the same transaction that marks an item done. Items whose lease
+    expires (e.g. a worker died) are leased again, up to max_attempts times.
+
+    Methods are synchronous. Async code runs them with call(), on the queue's own thread,
+    since sqlite can wait up to 30 seconds for another worker's lock.
+
+    Args:
+        path (str): Path to job database. Created if it doesn't exist.
+        max_attempts (int): Times an item is tried before it is marked failed. Defaults to 3.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+
+        # One thread runs every call(), so transactions never interleave
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+        # Autocommit mode, with explicit transactions from _transaction()
+        self.conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.executor.shutdown()
+        self.conn.close()
+
+    async def call(self, method, *args, **kwargs):
+        """Runs a JobQueue method on the queue's thread without blocking the event loop.
+
+        Example:
+            item = await queue.call(queue.lease, owner, lease_seconds)
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(method, *args, **kwargs)
+        )
+
+    @contextmanager
+    def _transaction(self):
+        """Runs a block in a write transaction, so concurrent workers can't interleave."""
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def set_options(self, **options):
+        """Stores job options the first time a job is created and returns the job's options.
+
+        Args:
+            **options: start_date, end_date, frequency, limit and skip_current.
+
+        Returns:
+            dict: Options the job was created with.
+        """
+
+        with self._transaction() as conn:
+            for key in JOB_OPTIONS:
+                conn.execute(
+                    "INSERT OR IGNORE INTO job (key, value) VALUES (?, ?)",
+                    (key, json.dumps(options.get(key))),
+                )
+
+        return self.get_options()
+
+    def get_options(self):
+        """Returns job options stored by set_options()."""
+
+        rows = self.conn.execute("SELECT key, value FROM job").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def add_urls(self, urls):
+        """Adds url items to the queue, ignoring urls that are already queued.
+
+        Args:
+            urls (iterable): Urls to scrape.
+
+        Returns:
+            int: Number of new urls.
+        """
+
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (kind, url) VALUES ('url', ?)",
+                ((url,) for url in urls),
+            )
+            return conn.total_changes - before
+
+    def lease(self, owner, lease_seconds=60):
+        """Leases the next pending item, or an item whose lease has expired.
+
+        Args:
+            owner (str): Worker id.
+            lease_seconds (float): Time until the lease expires without a heartbeat.
+
+        Returns:
+            dict with id, kind, url and payload, or None if nothing is available.
+        """
+
+        now = time.time()
+
+        with self._transaction() as conn:
+            # Items whose last attempt's lease expired won't be retried
+            conn.execute(
+                """
+                UPDATE items SET status = 'failed', error = 'Lease expired'
+                WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?
+                """,
+                (now, self.max_attempts),
+            )
+
+            row = conn.execute(
+                """
+                SELECT id, kind, url, payload FROM items
+                WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?))
+                    AND attempts < ?
+                ORDER BY id LIMIT 1
+                """,
+                (now, self.max_attempts),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            conn.execute(
+                """
+                UPDATE items
+                SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE id = ?
+                """,
+                (owner, now + lease_seconds, row[0]),
+            )
+
+        item_id, kind, url, payload = row
+        return {
+            "id": item_id,
+            "kind": kind,
+            "url": url,
+            "payload": json.loads(payload) if payload else None,
+        }
+
+    def heartbeat(self, item, owner, lease_seconds=60):
+        """Extends a lease. Returns False if the lease has been lost to another worker."""
+
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE items SET lease_expires = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'leased'
+                """,
+                (time.time() + lease_seconds, item["id"], owner),
+            )
+            return cursor.rowcount == 1
+
+    def _finish(self, conn, item, owner):
+        """Marks a leased item done, returning False if the lease was lost."""
+
+        cursor = conn.execute(
+            """
+            UPDATE items SET status = 'done', lease_expires = NULL
+            WHERE id = ? AND lease_owner = ? AND status = 'leased'
+            """,
+            (item["id"], owner),
+        )
+        return cursor.rowcount == 1
+
+    def complete_url(self, item, owner, current_codes, timestamps, page_size=50):
+        """Stores a url's current codes and queues its CDX timestamps in pages.
+
+        Args:
+            item (dict): Leased "url" item.
+            owner (str): Worker id.
+            current_codes (dict): Result of get_current_codes(), or None if skipped.
+            timestamps (list): Timestamps from get_snapshot_timestamps().
+            page_size (int): Timestamps per "snapshots" item. Defaults to 50.
+
+        Returns:
+            bool: False if the lease was lost and nothing was written.
+        """
+
+        with self._transaction() as conn:
+            if not self._finish(conn, item, owner):
+                return False
+
+            if current_codes is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO current_codes (url, codes) VALUES (?, ?)",
+                    (item["url"], json.dumps(current_codes)),
+                )
+
+            pages = [
+                timestamps[i : i + page_size]
+                for i in range(0, len(timestamps), page_size)
+            ]
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO items (kind, url, page, payload)
+                VALUES ('snapshots', ?, ?, ?)
+                """,
+                (
+                    (item["url"], page, json.dumps(page_timestamps))
+                    for page, page_timestamps in enumerate(pages)
+                ),
+            )
+
+        return True
+
+    def complete_snapshots(self, item, owner, archived_codes):
+        """Merges codes from one page of snapshots into the url's archived codes.
+
+        Args:
+            item (dict): Leased "snapshots" item.
+            owner (str): Worker id.
+            archived_codes (dict): Result of get_codes_from_snapshots().
+
+        Returns:
+            bool: False if the lease was lost and nothing was written.
+        """
+
+        with self._transaction() as conn:
+            if not self._finish(conn, item, owner):
+                return False
+
+            for code_type, codes in archived_codes.items():
+                for code, seen in codes.items():
+                    # Store sortable 14-digit timestamps so pages can be merged with MIN/MAX
+                    if isinstance(seen, SeenDates):
+                        first_seen = str(seen.first_timestamp)
+                        last_seen = str(seen.last_timestamp)
+                    else:
+                        first_seen = get_14_digit_timestamp(seen["first_seen"])
+                        last_seen = get_14_digit_timestamp(seen["last_seen"])
+                    conn.execute(
+                        """
+                        INSERT INTO archived_codes (url, code_type, code, first_seen, last_seen)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT (url, code_type, code) DO UPDATE SET
+                            first_seen = MIN(first_seen, excluded.first_seen),
+                            last_seen = MAX(last_seen, excluded.last_seen)
+                        """,
+                        (item["url"], code_type, code, first_seen, last_seen),
+                    )
+
+        return True
+
+    def fail(self, item, owner, error):
+        """Releases a leased item after an error, so it is retried until max_attempts."""
+
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                UPDATE items
+                SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    lease_expires = NULL, error = ?
+                WHERE id = ? AND lease_owner = ? AND status = 'leased'
+                """,
+                (self.max_attempts, str(error), item["id"], owner),
+            )
+
+    def get_counts(self):
+        """Returns the number of items in each status, e.g. {"pending": 3, "done": 10}."""
+
+        rows = self.conn.execute(
+            "SELECT status, COUNT(*) FROM items GROUP BY status"
+        ).fetchall()
+        return dict(rows)
+
+    def is_finished(self):
+        """Returns True if no item is pending or leased."""
+
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM items WHERE status IN ('pending', 'leased')"
+        ).fetchone()
+        return row[0] == 0
+
+    def get_results(self):
+        """Returns results for every queued url, in the same format as get_analytics_codes().
+
+        Returns:
+            [{"someurl.com": {"current_UA_code": [...], "archived_UA_codes": {...}, ...}}, ...]
+        """
+
+        results = []
+        urls = self.conn.execute(
+            "SELECT url FROM items WHERE kind = 'url' ORDER BY id"
+        ).fetchall()
+
+        for (url,) in urls:
+            info = {}
+
+            row = self.conn.execute(
+                "SELECT codes FROM current_codes WHERE url = ?", (url,)
+            ).fetchone()
+            if row:
+                info.update(json.loads(row[0]))
+
+            for code_type in ["UA", "GA", "GTM"]:
+                info[f"archived_{code_type}_codes"] = {}
+
+            rows = self.conn.execute(
+                """
+                SELECT code_type, code, first_seen, last_seen FROM archived_codes
+                WHERE url = ? ORDER BY first_seen
+                """,
+                (url,),
+            ).fetchall()
+            for code_type, code, first_seen, last_seen in rows:
+                info[f"archived_{code_type}"][code] = SeenDates(first_seen, last_seen)
+
+            results.append({url: info})
+
+        return results
+
+
+def get_worker_id():
+    """Returns a unique id for this worker, e.g. "hostname-1234-9f1c"."""
+
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}"
+
+
+async def process_item(session, queue, item, owner, options, semaphore, page_size=50):
+    """Does the work for one leased item and writes its results back to the queue.
+
+    Args:
+        session (aiohttp.ClientSession)
+        queue (JobQueue)
+        item (dict): Leased item from JobQueue.lease().
+        owner (str): Worker id.
+        options (dict): Job options from JobQueue.get_options().
+        semaphore: asyncio.Semaphore
+        page_size (int): Timestamps per "snapshots" item. Defaults to 50.
+
+    Returns:
+        bool: False if the lease was lost and results were discarded.
+    """
+
+    if item["kind"] == "url":
+        current_codes = None
+        if not options.get("skip_current"):
+            current_codes = await get_current_codes(session, item["url"], semaphore)
+
+        timestamps = await get_snapshot_timestamps(
+            session=session,
+            url=item["url"],
+            start_date=options.get("start_date"),
+            end_date=options.get("end_date"),
+            frequency=options.get("frequency"),
+            limit=options.get("limit"),
+            semaphore=semaphore,
+        )
+
+        return await queue.call(
+            queue.complete_url,
+            item,
+            owner,
+            current_codes,
+            timestamps,
+            page_size=page_size,
+        )
+
+    archived_codes = await get_codes_from_snapshots(
+        session=session,
+        url=item["url"],
+        timestamps=item["payload"],
+        semaphore=semaphore,
+    )
+
+    return await queue.call(queue.complete_snapshots, item, owner, archived_codes)
+
+
+async def run_queue_worker(
+    path,
+    semaphore=None,
+    concurrency=5,
+    lease_seconds=60,
+    poll_interval=5,
+    page_size=50,
+):
+    """Works on a job database until every item is done or failed.
+
+    Args:
+        path (str): Path to job database.
+        semaphore: asyncio.Semaphore. Defaults to asyncio.Semaphore(10).
+        concurrency (int): Number of items worked on at once. Defaults to 5.
+        lease_seconds (float): Lease length; heartbeats renew it every third of this. Defaults to 60.
+        poll_interval (float): Seconds to wait when other workers hold every remaining item. Defaults to 5.
+        page_size (int): Timestamps per "snapshots" item. Defaults to 50.
+
+    Returns:
+        dict: Item counts by status when the job finished.
+    """
+
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(10)
+
+    queue = JobQueue(path)
+    owner = get_worker_id()
+    options = queue.get_options()
+
+    async def heartbeat(item):
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            if not await queue.call(queue.heartbeat, item, owner, lease_seconds):
+                print(f"Lost lease on item {item['id']} ({item['url']})")
+                return
+
+    async def work(session):
+        while True:
+            item = await queue.call(queue.lease, owner, lease_seconds)
+
+            if item is None:
+                if await queue.call(queue.is_finished):
+                    return
+                await asyncio.sleep(poll_interval)
+                continue
+
+            heartbeat_task = asyncio.create_task(heartbeat(item))
+            try:
+                await process_item(
+                    session, queue, item, owner, options, semaphore, page_size
+                )
+            except Exception as e:
+                print(f"Error processing {item['kind']} item for {item['url']}: ", e)
+                await queue.call(queue.fail, item, owner, e)
+            finally:
+                heartbeat_task.cancel()
+
+    print(f"Worker {owner} started on {path}")
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            # Items on the same domain often request the same pages at the same time
+            session = SingleFlightSession(session)
+            await asyncio.gather(*[work(session) for _ in range(concurrency)])
+        return await queue.call(queue.get_counts)
+    finally:
+        queue.close()
+
+
+async def run_queue_job(path, urls, semaphore=None, concurrency=5, **options):
+    """Queues urls in a job database, works on the job alongside any other workers and
+    returns the results once every item is done.
+
+    Args:
+        path (str): Path to job database. Options of an existing job take precedence.
+        urls (list): Urls to scrape.
+        semaphore: asyncio.Semaphore. Defaults to asyncio.Semaphore(10).
+        concurrency (int): Number of items worked on at once. Defaults to 5.
+        **options: start_date, end_date, frequency, limit and skip_current.
+
+    Returns:
+        Results in the same format as get_analytics_codes().
+    """
+
+    queue = JobQueue(path)
+    try:
+        await queue.call(queue.set_options, **options)
+        added = await queue.call(queue.add_urls, urls)
+        print(f"Queued {added} new urls in {path}")
+    finally:
+        queue.close()
+
+    counts = await run_queue_worker(path, semaphore=semaphore, concurrency=concurrency)
+    print("Job finished: ", counts)
+
+    queue = JobQueue(path)
+    try:
+        return await queue.call(queue.get_results)
+    finally:
+        queue.close()
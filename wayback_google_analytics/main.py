@@ -1,21 +1,82 @@
 import aiohttp
 import argparse
 import asyncio
+import json
+import os
+import sys
 
 from wayback_google_analytics.utils import (
     get_limit_from_frequency,
     get_14_digit_timestamp,
     validate_dates,
     COLLAPSE_OPTIONS,
+    DEFAULT_RATE_LIMIT,
 )
 
 from wayback_google_analytics.scraper import (
     get_analytics_codes,
+    stream_analytics_codes,
 )
 
 from wayback_google_analytics.output import (
     init_output,
     write_output,
+    OutputWriter,
+    OUTPUT_TYPES,
+)
+
+from wayback_google_analytics.inputs import (
+    iter_urls,
+    INPUT_FORMATS,
+)
+
+from wayback_google_analytics.rate_limit import (
+    RateLimiter,
+    RateLimitedSemaphore,
+)
+
+from wayback_google_analytics.workers import (
+    run_sharded,
+)
+
+from wayback_google_analytics.job_queue import (
+    run_queue_job,
+    run_queue_worker,
+)
+
+from wayback_google_analytics.single_flight import (
+    SingleFlightSession,
+)
+
+from wayback_google_analytics.store import (
+    ResultStore,
+    print_lookup,
+)
+
+from wayback_google_analytics.clusters import (
+    cluster_sightings,
+    print_clusters,
+)
+
+from wayback_google_analytics.server import (
+    AnalyticsService,
+    serve,
+)
+
+from wayback_google_analytics.watch import (
+    watch,
+    print_change,
+)
+
+from wayback_google_analytics.planner import (
+    plan_requests,
+    get_cdx_cache,
+    print_plan,
+)
+
+from wayback_google_analytics.event_loop import (
+    install_uvloop,
+    run_monitored,
 )
 
 
@@ -29,8 +90,8 @@ async def main(args):
         None
     """
 
-    # If input_file is provided, read urls from file path
-    if args.input_file:
+    # If input_file is provided, read urls from file path (stream mode reads them lazily)
+    if args.input_file and not args.stream:
         try:
             with open(args.input_file, "r") as f:
                 args.urls = f.read().splitlines()
@@ -38,8 +99,9 @@ async def main(args):
             print("File not found. Please enter a valid file path.")
             return
 
-    # Throws ValueError immediately if output type is incorrect or there is an issue writing to file
-    if args.output:
+    # Throws ValueError immediately if output type is incorrect or there is an issue writing to file.
+    # --plan only prints the plan, so it leaves no output file behind.
+    if args.output and not args.plan:
         output_file = init_output(args.output)
 
     # Check if start_date is before end_date
@@ -66,42 +128,240 @@ async def main(args):
         )
         args.frequency = COLLAPSE_OPTIONS[args.frequency]
 
-    semaphore = asyncio.Semaphore(10)
+    # Workers share one rate budget, defaulting to DEFAULT_RATE_LIMIT
+    if args.workers > 1 and not args.rate_limit:
+        args.rate_limit = DEFAULT_RATE_LIMIT
+
+    limiter = RateLimiter(args.rate_limit) if args.rate_limit else None
+
+    if args.queue and (
+        args.timeline
+        or args.cdx_store
+        or args.progressive
+        or args.url_timeout
+        or args.job_timeout
+        or args.max_snapshot_kb
+        or args.expand_gtm
+        or args.fetch_scripts
+    ):
+        raise ValueError(
+            "--timeline, --cdx_store, --progressive, --max_snapshot_kb, --expand_gtm, --fetch_scripts and timeouts can't be combined with --queue."
+        )
+
+    if args.cdx_dedupe and not args.cdx_store:
+        raise ValueError("--cdx_dedupe needs --cdx_store.")
+
+    # Captures larger than --max_snapshot_kb are skipped
+    args.max_size = int(args.max_snapshot_kb * 1000) if args.max_snapshot_kb else None
+
+    # In stream mode, urls are read lazily and results written as they arrive
+    if args.stream:
+        if args.workers > 1 or args.queue:
+            raise ValueError("--workers and --queue can't be combined with --stream.")
+        if args.plan or args.budget is not None:
+            raise ValueError("--plan and --budget can't be combined with --stream.")
+        await stream_main(args, output_file, limiter)
+        return
+
+    # Container and script lookups make requests the plan doesn't count
+    if (args.plan or args.budget is not None) and (
+        args.queue
+        or args.workers > 1
+        or args.cdx_store
+        or args.expand_gtm
+        or args.fetch_scripts
+    ):
+        raise ValueError(
+            "--plan and --budget can't be combined with --queue, --workers, --cdx_store, --expand_gtm or --fetch_scripts."
+        )
+
+    semaphore = get_semaphore(limiter)
+    cdx_cache = None
+
+    # Query the CDX api up front to estimate the run, sampling snapshots to fit a budget
+    if args.plan or args.budget is not None:
+        async with aiohttp.ClientSession() as session:
+            plan = await plan_requests(
+                session=session,
+                urls=args.urls,
+                start_date=args.start_date,
+                end_date=args.end_date,
+                frequency=args.frequency,
+                limit=args.limit,
+                semaphore=semaphore,
+                skip_current=args.skip_current,
+                rate_limit=args.rate_limit,
+                budget=args.budget,
+                max_size=args.max_size,
+            )
+        print_plan(plan)
+
+        if args.plan:
+            return
+
+        cdx_cache = get_cdx_cache(plan)
 
     # Warn user if large request
-    if abs(int(args.limit)) > 500 or len(args.urls) > 9:
-        response = input(
-            f"""Large requests can lead to being rate limited by archive.org.\n\n Current limit: {args.limit} (Recommended < 500) \n\n Current # of urls: {len(args.urls)} (Recommended < 10, unless limit < 50)
+    elif abs(int(args.limit)) > 500 or len(args.urls) > 9:
+        print(
+            f"Large requests can lead to being rate limited by archive.org. Current limit: {args.limit} (Recommended < 500), current # of urls: {len(args.urls)} (Recommended < 10, unless limit < 50). Use --plan to estimate the requests needed and --budget to cap them."
+        )
 
-        Do you wish to proceed? (Yes/no)
-                         """
+    try:
+        if args.queue:
+            # Work on the job through a database that other workers can join
+            results = await run_queue_job(
+                path=args.queue,
+                urls=args.urls,
+                semaphore=semaphore,
+                concurrency=args.pool_size,
+                start_date=args.start_date,
+                end_date=args.end_date,
+                frequency=args.frequency,
+                limit=args.limit,
+                skip_current=args.skip_current,
+            )
+            print(results)
+        elif args.workers > 1:
+            # Shard urls across processes, each with its own event loop and session
+            results = await run_sharded(
+                urls=args.urls,
+                workers=args.workers,
+                limiter=limiter,
+                use_uvloop=args.uvloop,
+                start_date=args.start_date,
+                end_date=args.end_date,
+                frequency=args.frequency,
+                limit=args.limit,
+                skip_current=args.skip_current,
+                timeline=args.timeline,
+                cdx_store_dir=args.cdx_store,
+                cdx_dedupe=args.cdx_dedupe,
+                progressive=args.progressive,
+                url_timeout=args.url_timeout,
+                job_timeout=args.job_timeout,
+                max_size=args.max_size,
+                expand_gtm=args.expand_gtm,
+                fetch_scripts=args.fetch_scripts,
+            )
+            print(results)
+        else:
+            async with semaphore:
+                async with aiohttp.ClientSession() as session:
+                    results = await get_analytics_codes(
+                        session=SingleFlightSession(session),
+                        urls=args.urls,
+                        start_date=args.start_date,
+                        end_date=args.end_date,
+                        frequency=args.frequency,
+                        limit=args.limit,
+                        semaphore=semaphore,
+                        skip_current=args.skip_current,
+                        timeline=args.timeline,
+                        cdx_store_dir=args.cdx_store,
+                        cdx_dedupe=args.cdx_dedupe,
+                        cdx_cache=cdx_cache,
+                        progressive=args.progressive,
+                        url_timeout=args.url_timeout,
+                        job_timeout=args.job_timeout,
+                        max_size=args.max_size,
+                        expand_gtm=args.expand_gtm,
+                        fetch_scripts=args.fetch_scripts,
+                    )
+                    print(results)
+
+        # handle printing the output
+        if args.output:
+            write_output(output_file, args.output, results)
+
+        if args.store:
+            with ResultStore(args.store) as store:
+                store.add_results(results)
+    except aiohttp.ClientError as e:
+        print(
+            "Your request was rate limited. Wait 5 minutes and try again and consider reducing the limit and # of numbers."
         )
-        if response.lower() not in ("yes", "y"):
-            print("Request cancelled.")
-            exit()
+
+
+def get_semaphore(limiter=None):
+    """Returns the semaphore used to limit concurrent requests, rate limited if a limiter is given.
+
+    Args:
+        limiter (RateLimiter, optional): Rate limiter from --rate_limit. Defaults to None.
+
+    Returns:
+        asyncio.Semaphore or RateLimitedSemaphore
+    """
+
+    if limiter:
+        return RateLimitedSemaphore(10, limiter)
+
+    return asyncio.Semaphore(10)
+
+
+async def stream_main(args, output_file, limiter=None):
+    """Runs stream_analytics_codes() over urls read lazily from --input_file (or stdin) and
+    writes each result to output as soon as it is ready.
+
+    Args:
+        args: Command line arguments (argparse)
+        output_file (str): Path to output file from init_output().
+        limiter (RateLimiter, optional): Rate limiter from --rate_limit. Defaults to None.
+
+    Returns:
+        None
+    """
+
+    if args.input_file:
+        try:
+            urls = iter_urls(
+                args.input_file,
+                input_format=args.input_format,
+                column=args.input_column,
+            )
+        except FileNotFoundError:
+            print("File not found. Please enter a valid file path.")
+            return
+    else:
+        urls = iter(args.urls)
+
+    semaphore = get_semaphore(limiter)
+    store = ResultStore(args.store) if args.store else None
 
     try:
-        async with semaphore:
+        with OutputWriter(output_file, args.output) as writer:
             async with aiohttp.ClientSession() as session:
-                results = await get_analytics_codes(
-                    session=session,
-                    urls=args.urls,
+                async for entry in stream_analytics_codes(
+                    session=SingleFlightSession(session),
+                    urls=urls,
                     start_date=args.start_date,
                     end_date=args.end_date,
                     frequency=args.frequency,
                     limit=args.limit,
                     semaphore=semaphore,
                     skip_current=args.skip_current,
-                )
-                print(results)
-
-        # handle printing the output
-        if args.output:
-            write_output(output_file, args.output, results)
+                    pool_size=args.pool_size,
+                    timeline=args.timeline,
+                    cdx_store_dir=args.cdx_store,
+                    cdx_dedupe=args.cdx_dedupe,
+                    progressive=args.progressive,
+                    url_timeout=args.url_timeout,
+                    job_timeout=args.job_timeout,
+                    max_size=args.max_size,
+                    expand_gtm=args.expand_gtm,
+                    fetch_scripts=args.fetch_scripts,
+                ):
+                    print(entry)
+                    writer.write(entry)
+                    if store:
+                        store.add_results(entry)
     except aiohttp.ClientError as e:
         print(
             "Your request was rate limited. Wait 5 minutes and try again and consider reducing the limit and # of numbers."
         )
+    finally:
+        if store:
+            store.close()
 
 
 def setup_args():
@@ -114,6 +374,28 @@ def setup_args():
         --frequency: Can limit snapshots to remove duplicates (1 per hr, day, month, etc). Defaults to None.
         --limit: Limit number of snapshots returned. Defaults to None.
         --skip_current: Add this flag to skip current UA/GA codes when getting archived codes.
+        --timeline: Add every run of snapshots each archived code was present in, showing gaps.
+        --cdx_store: Directory to keep each domain's CDX index in, reused by later runs. Defaults to None.
+        --cdx_dedupe: With --cdx_store, skip captures whose content is identical to an earlier one.
+        --progressive: Fetch snapshots coarse to fine (yearly, then monthly, daily and hourly).
+        --url_timeout: Seconds each url may take before its results are truncated. Defaults to None.
+        --job_timeout: Seconds the whole run may take before results are truncated. Defaults to None.
+        --max_snapshot_kb: Skip captures larger than this many kilobytes. Defaults to None.
+        --expand_gtm: Add the UA/GA codes configured by archived versions of each GTM container found.
+        --fetch_scripts: Also scan the archived same-site scripts each snapshot loads.
+        --stream: Read urls lazily and write results as they arrive, using a fixed-size worker pool.
+        --input_format: Format of --input_file in stream mode (txt, csv, jsonl). Defaults to file extension.
+        --input_column: Csv column (name or index) or jsonl key holding urls. Defaults to "url".
+        --pool_size: Number of urls (or queue items) processed concurrently in stream/queue mode. Defaults to 5.
+        --workers: Number of processes to shard urls across. Defaults to 1.
+        --rate_limit: Maximum requests per second, shared by all workers. Defaults to None (5 with --workers).
+        --queue: Path to a job database on a local disk that other workers on the same host can join with the worker command. Defaults to None.
+        --store: Path to a result store database that results are added to. Defaults to None.
+        --plan: Print the requests, archived bytes and time the run would take, without running it.
+        --budget: Maximum requests for the run. Snapshots are sampled evenly over time to fit. Defaults to None.
+        --uvloop: Use uvloop's faster event loop (if installed).
+        --monitor_loop: Report event loop lag and where synchronous code blocks the loop.
+        --lag_threshold: Lag in milliseconds reported as blocking by --monitor_loop. Defaults to 100.
 
     Returns:
         Command line arguments (argparse)
@@ -127,7 +409,7 @@ def setup_args():
         "-i",
         "--input_file",
         default=None,
-        help="Enter a file path to a list of urls in a readable file type (e.g. .txt, .csv, .md)",
+        help="Enter a file path to a list of urls in a readable file type (e.g. .txt, .csv, .md). Use - to read from stdin with --stream.",
     )
     group.add_argument(
         "-u",
@@ -139,8 +421,8 @@ def setup_args():
         "-o",
         "--output",
         default="json",
-        help="Enter an output type to write results to file. Defaults to json.",
-        choices=["csv", "txt", "json", "xlsx"],
+        help="Enter an output type to write results to file. Defaults to json. Parquet and arrow require pyarrow.",
+        choices=OUTPUT_TYPES,
     )
     parser.add_argument(
         "-s",
@@ -174,12 +456,538 @@ def setup_args():
         help="Add this flag to skip current UA/GA codes when getting archived codes.",
     )
 
+    parser.add_argument(
+        "--timeline",
+        action="store_true",
+        help="Add this flag to record every run of snapshots each archived code was present in, so gaps (e.g. a code removed and later restored) are kept.",
+    )
+
+    parser.add_argument(
+        "--cdx_store",
+        default=None,
+        help="Directory to keep each domain's CDX index in (created if needed). Later runs only fetch new captures.",
+    )
+
+    parser.add_argument(
+        "--cdx_dedupe",
+        action="store_true",
+        help="Add this flag with --cdx_store to skip captures whose content (digest) is identical to an earlier one. This can pick different snapshots than the CDX api would.",
+    )
+
+    parser.add_argument(
+        "--progressive",
+        action="store_true",
+        help="Add this flag to fetch one snapshot per year first, then per month, day and hour, so partial results cover the whole time range.",
+    )
+
+    parser.add_argument(
+        "--url_timeout",
+        default=None,
+        type=float,
+        help="Seconds each url may take. Snapshots still being fetched are then cancelled, and the codes found so far are kept and marked as truncated. Defaults to None.",
+    )
+    parser.add_argument(
+        "--job_timeout",
+        default=None,
+        type=float,
+        help="Seconds the whole run may take, after which every unfinished url is truncated the same way. Defaults to None.",
+    )
+
+    parser.add_argument(
+        "--max_snapshot_kb",
+        default=None,
+        type=float,
+        help="Skip captures larger than this many kilobytes (as archived), to save bandwidth. Defaults to None.",
+    )
+
+    parser.add_argument(
+        "--expand_gtm",
+        action="store_true",
+        help="Add this flag to also fetch the archived gtm.js of each GTM container found and add the UA/GA codes it configures (gtm_UA_codes, gtm_GA_codes).",
+    )
+
+    parser.add_argument(
+        "--fetch_scripts",
+        action="store_true",
+        help="Add this flag to also fetch the archived same-site scripts each snapshot loads (e.g. /js/analytics.js) and add the codes they contain. Each script version is fetched once.",
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Add this flag to read urls lazily and write results as they arrive, for very large url lists.",
+    )
+    parser.add_argument(
+        "--input_format",
+        default=None,
+        help="Format of --input_file in stream mode. Defaults to the file extension (plain text if unknown).",
+        choices=INPUT_FORMATS,
+    )
+    parser.add_argument(
+        "--input_column",
+        default=None,
+        help="Csv column (name or index) or jsonl key holding urls in stream mode. Defaults to url.",
+    )
+    parser.add_argument(
+        "--pool_size",
+        default=5,
+        type=int,
+        help="Number of urls processed concurrently in stream mode (or queue items with --queue). Defaults to 5.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=1,
+        type=int,
+        help="Number of processes to shard urls across, each with its own event loop. Defaults to 1.",
+    )
+    parser.add_argument(
+        "-r",
+        "--rate_limit",
+        default=None,
+        type=float,
+        help=f"Maximum requests per second to archive.org, shared by all workers. Defaults to None ({DEFAULT_RATE_LIMIT} with --workers).",
+    )
+
+    parser.add_argument(
+        "-q",
+        "--queue",
+        default=None,
+        help="Path to a job database on a local disk (created if needed). Other processes on the same host can join the job with: wayback-google-analytics worker JOB_DB",
+    )
+    parser.add_argument(
+        "--store",
+        default=None,
+        help="Path to a result store database (created if needed). Results from every run are added to it, indexed by code and url.",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Add this flag to print the requests, archived bytes and time the run would take per url (using one CDX query per domain) without running it.",
+    )
+    parser.add_argument(
+        "--budget",
+        default=None,
+        type=int,
+        help="Maximum requests for the run, including CDX queries and live pages. Snapshots are sampled evenly over time to fit. Defaults to None.",
+    )
+    add_event_loop_args(parser)
+
     return parser.parse_args()
 
 
+async def worker_main(args):
+    """Joins a job database created with --queue and works on it until it is finished.
+
+    Args:
+        args: Command line arguments (argparse)
+
+    Returns:
+        None
+    """
+
+    limiter = RateLimiter(args.rate_limit) if args.rate_limit else None
+
+    counts = await run_queue_worker(
+        args.job_db,
+        semaphore=get_semaphore(limiter),
+        concurrency=args.pool_size,
+        lease_seconds=args.lease_seconds,
+    )
+    print("Job finished: ", counts)
+
+
+def setup_worker_args(argv=None):
+    """Setup command line arguments for the worker command. Returns args for use in worker_main().
+
+    CLI Args:
+        job_db: Path to a job database created with --queue.
+        --pool_size: Number of queue items worked on at once. Defaults to 5.
+        --rate_limit: Maximum requests per second for this worker. Defaults to None.
+        --lease_seconds: Seconds before an item leased by a dead worker is retried. Defaults to 60.
+
+    Returns:
+        Command line arguments (argparse)
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="wayback-google-analytics worker",
+        description="Join a job database created with --queue and work on it until it is finished.",
+    )
+    parser.add_argument("job_db", help="Path to a job database created with --queue.")
+    parser.add_argument(
+        "--pool_size",
+        default=5,
+        type=int,
+        help="Number of queue items worked on at once. Defaults to 5.",
+    )
+    parser.add_argument(
+        "-r",
+        "--rate_limit",
+        default=None,
+        type=float,
+        help="Maximum requests per second for this worker. Defaults to None.",
+    )
+    parser.add_argument(
+        "--lease_seconds",
+        default=60,
+        type=float,
+        help="Seconds before an item leased by a worker that stopped responding is retried. Defaults to 60.",
+    )
+    add_event_loop_args(parser)
+
+    return parser.parse_args(argv)
+
+
+def lookup_main(args):
+    """Looks up codes in a result store built with --store and prints the sites sharing them.
+
+    Args:
+        args: Command line arguments (argparse)
+
+    Returns:
+        None
+    """
+
+    if not os.path.exists(args.store):
+        print("Store not found. Build one by running with --store first.")
+        return
+
+    with ResultStore(args.store) as store:
+        lookup = store.lookup(args.codes)
+
+    if args.json:
+        print(json.dumps(lookup, indent=4))
+    else:
+        print_lookup(lookup)
+
+
+def setup_lookup_args(argv=None):
+    """Setup command line arguments for the lookup command. Returns args for use in lookup_main().
+
+    CLI Args:
+        codes: UA, GA or GTM codes to look up.
+        --store: Path to a result store database built with --store.
+        --json: Print results as json.
+
+    Returns:
+        Command line arguments (argparse)
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="wayback-google-analytics lookup",
+        description="Find sites sharing UA/GA/GTM codes in a result store built with --store, without scraping.",
+    )
+    parser.add_argument("codes", nargs="+", help="UA, GA or GTM codes to look up.")
+    parser.add_argument(
+        "--store",
+        required=True,
+        help="Path to a result store database built with --store.",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Add this flag to print results as json.",
+    )
+
+    return parser.parse_args(argv)
+
+
+def clusters_main(args):
+    """Clusters the sites in a result store by shared UA accounts, GA ids and GTM containers.
+
+    Args:
+        args: Command line arguments (argparse)
+
+    Returns:
+        None
+    """
+
+    if not os.path.exists(args.store):
+        print("Store not found. Build one by running with --store first.")
+        return
+
+    with ResultStore(args.store) as store:
+        clusters = cluster_sightings(store.iter_sightings(), min_size=args.min_size)
+
+    if args.json:
+        print(json.dumps(clusters, indent=4))
+    else:
+        print_clusters(clusters)
+
+
+def setup_clusters_args(argv=None):
+    """Setup command line arguments for the clusters command. Returns args for use in clusters_main().
+
+    CLI Args:
+        --store: Path to a result store database built with --store.
+        --min_size: Smallest number of sites in a cluster to print. Defaults to 2.
+        --json: Print results as json.
+
+    Returns:
+        Command line arguments (argparse)
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="wayback-google-analytics clusters",
+        description="Group sites in a result store built with --store into clusters linked by any shared UA account, GA id or GTM container.",
+    )
+    parser.add_argument(
+        "--store",
+        required=True,
+        help="Path to a result store database built with --store.",
+    )
+    parser.add_argument(
+        "--min_size",
+        default=2,
+        type=int,
+        help="Smallest number of sites in a cluster to print. Defaults to 2.",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Add this flag to print results as json.",
+    )
+
+    return parser.parse_args(argv)
+
+
+async def serve_main(args):
+    """Runs the job api until interrupted.
+
+    Args:
+        args: Command line arguments (argparse)
+
+    Returns:
+        None
+    """
+
+    service = AnalyticsService(
+        rate_limit=args.rate_limit,
+        pool_size=args.pool_size,
+        max_jobs=args.max_jobs,
+        max_backlog=args.max_backlog,
+    )
+    await serve(args.host, args.port, service)
+
+
+def setup_serve_args(argv=None):
+    """Setup command line arguments for the serve command. Returns args for use in serve_main().
+
+    CLI Args:
+        --host: Interface to listen on. Defaults to 127.0.0.1.
+        --port: Port to listen on. Defaults to 8080.
+        --rate_limit: Maximum requests per second to archive.org, shared by all jobs. Defaults to 5.
+        --pool_size: Number of urls processed concurrently per job. Defaults to 5.
+        --max_jobs: Number of jobs run at once. Defaults to 4.
+        --max_backlog: Seconds of queued requests above which new jobs are refused. Defaults to 30.
+
+    Returns:
+        Command line arguments (argparse)
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="wayback-google-analytics serve",
+        description="Serve a job api (POST /jobs, GET /jobs/ID, GET /jobs/ID/results) that shares one connection pool, cache and rate limit between all clients.",
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Interface to listen on. Defaults to 127.0.0.1.",
+    )
+    parser.add_argument(
+        "--port",
+        default=8080,
+        type=int,
+        help="Port to listen on. Defaults to 8080.",
+    )
+    parser.add_argument(
+        "-r",
+        "--rate_limit",
+        default=DEFAULT_RATE_LIMIT,
+        type=float,
+        help=f"Maximum requests per second to archive.org, shared by all jobs. Defaults to {DEFAULT_RATE_LIMIT}.",
+    )
+    parser.add_argument(
+        "--pool_size",
+        default=5,
+        type=int,
+        help="Number of urls processed concurrently per job. Defaults to 5.",
+    )
+    parser.add_argument(
+        "--max_jobs",
+        default=4,
+        type=int,
+        help="Number of jobs run at once; later jobs wait until one finishes. Defaults to 4.",
+    )
+    parser.add_argument(
+        "--max_backlog",
+        default=30,
+        type=float,
+        help="Seconds of queued requests to archive.org above which new jobs are refused with 503. Defaults to 30.",
+    )
+    add_event_loop_args(parser)
+
+    return parser.parse_args(argv)
+
+
+async def watch_main(args):
+    """Watches the urls in a watchlist until interrupted (or for --cycles cycles).
+
+    Args:
+        args: Command line arguments (argparse)
+
+    Returns:
+        None
+    """
+
+    if not os.path.exists(args.watchlist):
+        print("File not found. Please enter a valid file path.")
+        return
+
+    limiter = RateLimiter(args.rate_limit) if args.rate_limit else None
+
+    with ResultStore(args.store) as store:
+        await watch(
+            args.watchlist,
+            store,
+            interval=args.interval * 3600,
+            semaphore=get_semaphore(limiter),
+            limit=args.limit,
+            cycles=args.cycles,
+            on_change=lambda change: print_change(change, args.changes),
+        )
+
+
+def setup_watch_args(argv=None):
+    """Setup command line arguments for the watch command. Returns args for use in watch_main().
+
+    CLI Args:
+        watchlist: Path to a list of urls to watch (txt, csv or jsonl).
+        --store: Path to a result store database holding what earlier checks found.
+        --interval: Hours per cycle. Defaults to 24.
+        --limit: Limit number of snapshots per check. Defaults to -100.
+        --rate_limit: Maximum requests per second. Defaults to None.
+        --cycles: Stop after this many cycles. Defaults to None (run until interrupted).
+        --changes: Path to a json lines file that changes are appended to. Defaults to None.
+
+    Returns:
+        Command line arguments (argparse)
+    """
+
+    parser = argparse.ArgumentParser(
+        prog="wayback-google-analytics watch",
+        description="Re-check a list of urls on a schedule, printing only new, disappeared and changed codes.",
+    )
+    parser.add_argument("watchlist", help="Path to a list of urls to watch (txt, csv or jsonl).")
+    parser.add_argument(
+        "--store",
+        required=True,
+        help="Path to a result store database (created if needed) holding what earlier checks found.",
+    )
+    parser.add_argument(
+        "--interval",
+        default=24,
+        type=float,
+        help="Hours per cycle. Checks are spread evenly across each cycle. Defaults to 24.",
+    )
+    parser.add_argument(
+        "-l",
+        "--limit",
+        default=-100,
+        help="Limits number of snapshots per check. Defaults to -100 (most recent 100 snapshots).",
+    )
+    parser.add_argument(
+        "-r",
+        "--rate_limit",
+        default=None,
+        type=float,
+        help="Maximum requests per second to archive.org. Defaults to None.",
+    )
+    parser.add_argument(
+        "--cycles",
+        default=None,
+        type=int,
+        help="Stop after this many cycles. Defaults to None (run until interrupted).",
+    )
+    parser.add_argument(
+        "--changes",
+        default=None,
+        help="Path to a json lines file that changes are appended to. Defaults to None.",
+    )
+    add_event_loop_args(parser)
+
+    return parser.parse_args(argv)
+
+
+def add_event_loop_args(parser):
+    """Adds --uvloop, --monitor_loop and --lag_threshold to a parser."""
+
+    parser.add_argument(
+        "--uvloop",
+        action="store_true",
+        help="Add this flag to use uvloop's faster event loop (pip install uvloop).",
+    )
+    parser.add_argument(
+        "--monitor_loop",
+        action="store_true",
+        help="Add this flag to report event loop lag and where synchronous code blocks the loop.",
+    )
+    parser.add_argument(
+        "--lag_threshold",
+        default=100,
+        type=float,
+        help="Lag in milliseconds reported as blocking by --monitor_loop. Defaults to 100.",
+    )
+
+
+def run(coro, args):
+    """Runs a coroutine on the event loop chosen by args, monitoring lag if requested.
+
+    Args:
+        coro: Coroutine to run (e.g. main(args)).
+        args: Command line arguments (argparse)
+
+    Returns:
+        None
+    """
+
+    if args.uvloop:
+        install_uvloop()
+
+    if args.monitor_loop:
+        coro = run_monitored(coro, threshold=args.lag_threshold / 1000)
+
+    asyncio.run(coro)
+
+
 def main_entrypoint():
+    # Subcommands are dispatched before the main parser, which requires --urls/--input_file
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        args = setup_worker_args(sys.argv[2:])
+        run(worker_main(args), args)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "lookup":
+        lookup_main(setup_lookup_args(sys.argv[2:]))
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        args = setup_serve_args(sys.argv[2:])
+        run(serve_main(args), args)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        args = setup_watch_args(sys.argv[2:])
+        run(watch_main(args), args)
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "clusters":
+        clusters_main(setup_clusters_args(sys.argv[2:]))
+        return
+
     args = setup_args()
-    asyncio.run(main(args))
+    run(main(args), args)
 
 
 if __name__ == "__main__":
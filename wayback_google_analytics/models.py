@@ -0,0 +1,194 @@
+# Code types found by the scraper, in the order results are written
+CODE_TYPES = ["UA", "GA", "GTM"]
+
+
+def format_timestamp(timestamp):
+    """Formats an integer 14-digit timestamp as a date (dd/mm/YYYY:HH:MM), without the
+    datetime round trip of get_date_from_timestamp().
+
+    Args:
+        timestamp (int): 14-digit timestamp (YYYYmmddHHMMSS)
+
+    Returns:
+        str: Date in format dd/mm/YYYY:HH:MM
+
+    Example: 20121001000000 -> 01/10/2012:00:00
+    """
+
+    digits = str(timestamp)
+    return f"{digits[6:8]}/{digits[4:6]}/{digits[0:4]}:{digits[8:10]}:{digits[10:12]}"
+
+
+class CodeSighting:
+    """First and last snapshot a code was seen in, as integer timestamps.
+
+    Args:
+        timestamp (int or str): 14-digit timestamp of the first snapshot the code was seen in.
+    """
+
+    __slots__ = ("first_seen", "last_seen")
+
+    def __init__(self, timestamp):
+        self.first_seen = self.last_seen = int(timestamp)
+
+    def add(self, timestamp):
+        """Widens the sighting to include another snapshot."""
+
+        timestamp = int(timestamp)
+        if timestamp < self.first_seen:
+            self.first_seen = timestamp
+        if timestamp > self.last_seen:
+            self.last_seen = timestamp
+
+    def to_dict(self):
+        """Returns {"first_seen": "01/01/2019:00:00", "last_seen": "01/01/2020:00:00"}, as
+        SeenDates that keep the 14-digit timestamps."""
+
+        return SeenDates(self.first_seen, self.last_seen)
+
+
+class SeenDates(dict):
+    """{"first_seen": "01/01/2019:00:00", "last_seen": "01/01/2020:00:00"}, which also keeps
+    the 14-digit timestamps the dates were formatted from.
+
+    The dates are rounded to the minute, so outputs that store real dates (parquet, arrow
+    and the result store) read first_timestamp and last_timestamp instead. They aren't
+    keys, so json output is unchanged.
+
+    Args:
+        first_seen (int): 14-digit timestamp.
+        last_seen (int): 14-digit timestamp.
+    """
+
+    __slots__ = ("first_timestamp", "last_timestamp")
+
+    def __init__(self, first_seen, last_seen):
+        super().__init__(
+            first_seen=format_timestamp(first_seen), last_seen=format_timestamp(last_seen)
+        )
+        self.first_timestamp = int(first_seen)
+        self.last_timestamp = int(last_seen)
+
+
+class UrlResult:
+    """Current and archived codes for a single url, serialized with to_dict().
+
+    Args:
+        url (str): Url as entered by the user.
+    """
+
+    __slots__ = (
+        "url",
+        "current_codes",
+        "archived_codes",
+        "timelines",
+        "coverage",
+        "gtm_codes",
+    )
+
+    def __init__(self, url):
+        self.url = url
+        # None if current codes were skipped or the live page couldn't be retrieved
+        self.current_codes = None
+        self.archived_codes = {code_type: {} for code_type in CODE_TYPES}
+        # {code_type: {code: CodeTimeline}} in timeline mode, otherwise None
+        self.timelines = None
+        # {"snapshots": 100, "fetched": 40, "failed": 2, "truncated": True} with a deadline, otherwise None
+        self.coverage = None
+        # {"UA": {code: CodeSighting}, "GA": {...}} configured through GTM containers, otherwise None
+        self.gtm_codes = None
+
+    def add_codes(self, code_type, codes, timestamp):
+        """Records codes of one type found in the snapshot at timestamp.
+
+        Args:
+            code_type (str): UA, GA or GTM.
+            codes (iterable): Codes found in the snapshot.
+            timestamp (int or str): 14-digit timestamp of the snapshot.
+        """
+
+        add_sightings(self.archived_codes[code_type], codes, timestamp)
+
+    def to_dict(self):
+        """Returns the result in the format returned by process_url().
+
+        Returns:
+            {
+                "someurl.com": {
+                    "current_UA_code": ["UA-12345678-1"],
+                    ...,
+                    "archived_UA_codes": {
+                        "UA-12345678-1": {"first_seen": "01/01/2019:00:00", "last_seen": "01/01/2020:00:00"},
+                    },
+                    ...,
+                }
+            }
+        """
+
+        entry = dict(self.current_codes or {})
+        for code_type in CODE_TYPES:
+            entry[f"archived_{code_type}_codes"] = get_archived_dict(
+                self.archived_codes[code_type]
+            )
+
+        if self.timelines is not None:
+            for code_type in CODE_TYPES:
+                entry[f"timeline_{code_type}_codes"] = {
+                    code: timeline.to_list()
+                    for code, timeline in self.timelines[code_type].items()
+                }
+
+        if self.gtm_codes is not None:
+            for code_type, sightings in self.gtm_codes.items():
+                entry[f"gtm_{code_type}_codes"] = get_archived_dict(sightings)
+
+        if self.coverage is not None:
+            entry["truncated"] = self.coverage["truncated"]
+            entry["coverage"] = {
+                key: value for key, value in self.coverage.items() if key != "truncated"
+            }
+
+        return {self.url: entry}
+
+
+def add_sightings(sightings, codes, timestamp):
+    """Adds the snapshot at timestamp to the sighting of each code in a {code: CodeSighting} dict."""
+
+    for code in codes:
+        if code in sightings:
+            sightings[code].add(timestamp)
+        else:
+            sightings[code] = CodeSighting(timestamp)
+
+
+def get_archived_dict(sightings):
+    """Serializes {code: CodeSighting} as {code: {"first_seen": ..., "last_seen": ...}}."""
+
+    return {code: sighting.to_dict() for code, sighting in sightings.items()}
+
+
+def reduce_code_records(records):
+    """Reduces per-snapshot records into the first and last snapshot each code was seen in.
+
+    Args:
+        records (iterable): (timestamp, {"UA": [...], "GA": [...], "GTM": [...]}) records from
+            get_codes_from_single_timestamp(). None records (failed snapshots) are skipped.
+
+    Returns:
+        {
+            "UA_codes": {"UA-12345678-1": CodeSighting(20190101000000)},
+            "GA_codes": {},
+            "GTM_codes": {},
+        }
+    """
+
+    results = {f"{code_type}_codes": {} for code_type in CODE_TYPES}
+    for record in records:
+        if not record:
+            continue
+        timestamp, found = record
+        for code_type, codes in found.items():
+            add_sightings(results[f"{code_type}_codes"], codes, timestamp)
+
+    return results
+
@@ -1,24 +1,39 @@
 from datetime import datetime
+import csv
+import importlib.util
 import json
 import os
-import pandas as pd
+
+from wayback_google_analytics.models import CODE_TYPES, SeenDates
+from wayback_google_analytics.utils import get_14_digit_timestamp
+
+# Output types accepted by init_output() and write_output()
+OUTPUT_TYPES = ["csv", "txt", "json", "xlsx", "parquet", "arrow"]
+
+# Columnar output types, which need the optional pyarrow dependency
+COLUMNAR_TYPES = ["parquet", "arrow"]
 
 
 def init_output(type, output_dir="./output"):
     """Creates output directory and initializes empty output file.
 
     Args:
-        type (str): csv/txt/json.
+        type (str): csv/txt/json/xlsx/parquet/arrow.
         output_dir (str): Path to output directory. Defaults to ./output.
 
     Returns:
         None
     """
 
-    valid_types = ["csv", "txt", "json", "xlsx"]
-    if type not in valid_types:
+    if type not in OUTPUT_TYPES:
         raise ValueError(
-            f"Invalid output type: {type}. Please use csv, txt, xlsx or json."
+            f"Invalid output type: {type}. Please use csv, txt, xlsx, json, parquet or arrow."
+        )
+
+    # Check for pyarrow now rather than after scraping
+    if type in COLUMNAR_TYPES and importlib.util.find_spec("pyarrow") is None:
+        raise ValueError(
+            f"{type} output requires pyarrow. Install it with: pip install \"wayback-google-analytics[parquet]\""
         )
 
     # Create output directory if it doesn't exist
@@ -46,11 +61,11 @@ def init_output(type, output_dir="./output"):
 
 
 def write_output(output_file, output_type, results):
-    """Writes results to the correct output file in json, csv or txt.
+    """Writes results to the correct output file in json, csv, txt, xlsx, parquet or arrow.
 
     Args:
         output_file (str): Path to output file.
-        output_type (str): csv/txt/json.
+        output_type (str): csv/txt/json/xlsx/parquet/arrow.
         results (dict): Results from scraper.
 
     Returns:
@@ -62,23 +77,308 @@ def write_output(output_file, output_type, results):
         with open(output_file, "w") as f:
             json.dump(results, f, indent=4)
         return
-    # If csv or xlsx, convert results to pandas dataframes.
-    urls_df = get_urls_df(results)
-    codes_df = get_codes_df(results)
 
-    # If csv, write dataframes to separate csv files for urls, codes.
-    if output_type == "csv":
-        urls_output_file = output_file.replace(".csv", "_urls.csv")
-        codes_output_file = output_file.replace(".csv", "_codes.csv")
-        urls_df.to_csv(urls_output_file, index=False)
-        codes_df.to_csv(codes_output_file, index=False)
+    # If csv, xlsx, parquet or arrow, write rows one entry at a time.
+    with OutputWriter(output_file, output_type) as writer:
+        for entry in results:
+            writer.write(entry)
+
+
+# Column names for the urls sheet/csv
+URLS_COLUMNS = [
+    "url",
+    "UA_Code",
+    "GA_Code",
+    "GTM_Code",
+    "Archived_UA_Codes",
+    "Archived_GA_Codes",
+    "Archived_GTM_Codes",
+]
+
+# Column names for the codes sheet/csv
+CODES_COLUMNS = ["code", "websites", "active"]
+
+# Rows buffered before being written as one parquet row group / arrow record batch
+ROW_GROUP_SIZE = 10000
+
+
+class OutputWriter:
+    """Writes results to output file one entry at a time, as they arrive from the scraper.
+
+    Json and txt entries are written straight to disk, producing the same file as
+    write_output(). Csv and xlsx url rows are also written as they arrive (xlsx in
+    xlsxwriter's constant_memory mode), while codes are collected in an index and written
+    when the writer is closed, since each code row combines every url it was seen on.
+    Parquet and arrow get one row per code sighting (see get_sighting_rows()), written in
+    row groups of ROW_GROUP_SIZE rows.
+
+    Example:
+        with OutputWriter(output_file, "json") as writer:
+            async for entry in stream_analytics_codes(...):
+                writer.write(entry)
+    """
+
+    def __init__(self, output_file, output_type):
+        self.output_file = output_file
+        self.output_type = output_type
+        self.count = 0
+        self.codes_index = {}
+        self._file = None
+
+        if output_type in ("json", "txt"):
+            self._file = open(output_file, "w")
+
+        if output_type == "csv":
+            self._file = open(output_file.replace(".csv", "_urls.csv"), "w", newline="")
+            self._urls_writer = csv.writer(self._file)
+            self._urls_writer.writerow(URLS_COLUMNS)
+
+        if output_type == "xlsx":
+            import xlsxwriter
+
+            self._workbook = xlsxwriter.Workbook(output_file, {"constant_memory": True})
+            self._header_format = self._workbook.add_format({"bold": True})
+            self._urls_sheet = self._workbook.add_worksheet("URLs")
+            self._codes_sheet = self._workbook.add_worksheet("Codes")
+            self._urls_sheet.write_row(0, 0, URLS_COLUMNS, self._header_format)
+
+        if output_type in COLUMNAR_TYPES:
+            self._rows = []
+            self._columnar_writer = open_columnar_writer(output_file, output_type)
+
+    def write(self, entry):
+        """Adds a single result entry ({url: {...}}) to output."""
+
+        if self.output_type in ("json", "txt"):
+            # Match indentation of json.dump(results, f, indent=4) for a list of entries
+            prefix = "[\n" if self.count == 0 else ",\n"
+            lines = json.dumps(entry, indent=4).splitlines()
+            self._file.write(prefix + "\n".join(f"    {line}" for line in lines))
+            self.count += 1
+            return
+
+        if self.output_type in COLUMNAR_TYPES:
+            for url, info in entry.items():
+                self._rows.extend(get_sighting_rows(url, info))
+            if len(self._rows) >= ROW_GROUP_SIZE:
+                self._flush_rows()
+            self.count += 1
+            return
+
+        for url, info in entry.items():
+            row = get_url_row(url, info)
+            add_to_codes_index(self.codes_index, url, info)
+
+            if self.output_type == "csv":
+                self._urls_writer.writerow([row[column] for column in URLS_COLUMNS])
+            else:
+                self._urls_sheet.write_row(
+                    self.count + 1, 0, [row[column] for column in URLS_COLUMNS]
+                )
+
+        self.count += 1
+
+    def close(self):
+        """Finishes writing the output file."""
+
+        if self.output_type in ("json", "txt"):
+            self._file.write("\n]" if self.count else "[]")
+            self._file.close()
+            return
+
+        if self.output_type in COLUMNAR_TYPES:
+            self._flush_rows()
+            self._columnar_writer.close()
+            return
+
+        codes_rows = get_codes_rows(self.codes_index)
+        columns = CODES_COLUMNS if self.codes_index else ["Message"]
+
+        if self.output_type == "csv":
+            self._file.close()
+            codes_file = self.output_file.replace(".csv", "_codes.csv")
+            with open(codes_file, "w", newline="") as f:
+                codes_writer = csv.writer(f)
+                codes_writer.writerow(columns)
+                for row in codes_rows:
+                    codes_writer.writerow([row[column] for column in columns])
+            return
+
+        self._codes_sheet.write_row(0, 0, columns, self._header_format)
+        for i, row in enumerate(codes_rows):
+            self._codes_sheet.write_row(i + 1, 0, [row[column] for column in columns])
+        self._workbook.close()
+
+    def _flush_rows(self):
+        """Writes buffered sighting rows as one row group."""
+
+        if self._rows:
+            self._columnar_writer.write_table(get_sightings_table(self._rows))
+            self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def get_sightings_schema():
+    """Returns the pyarrow schema for parquet/arrow output: one row per code per url."""
+
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("url", pa.string()),
+            ("code", pa.string()),
+            ("code_type", pa.string()),
+            ("first_seen", pa.timestamp("s")),
+            ("last_seen", pa.timestamp("s")),
+            ("is_current", pa.bool_()),
+        ]
+    )
+
+
+def open_columnar_writer(output_file, output_type):
+    """Opens a pyarrow parquet or arrow IPC file writer with the sightings schema.
+
+    Args:
+        output_file (str): Path to output file.
+        output_type (str): parquet/arrow.
+
+    Returns:
+        Writer with write_table() and close().
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if output_type == "parquet":
+        return pq.ParquetWriter(output_file, get_sightings_schema())
+
+    return pa.ipc.new_file(output_file, get_sightings_schema())
+
+
+def get_sightings_table(rows):
+    """Converts sighting rows from get_sighting_rows() into a pyarrow table."""
+
+    import pyarrow as pa
+
+    return pa.Table.from_pylist(rows, schema=get_sightings_schema())
+
+
+def get_sighting_rows(url, info):
+    """Flattens a single url's results into one row per code, with real dates.
+
+    Archived codes get their first/last seen dates; codes that are only current get
+    empty dates. is_current marks codes also found on the live page.
+
+    Args:
+        url (str): Url.
+        info (dict): Results for url from scraper.
+
+    Returns:
+        [
+            {
+                "url": "someurl.com",
+                "code": "UA-12345678-1",
+                "code_type": "UA",
+                "first_seen": datetime(2019, 1, 1, 0, 0),
+                "last_seen": datetime(2020, 1, 1, 0, 0),
+                "is_current": True,
+            },
+        ]
+    """
+
+    rows = []
+
+    for code_type in ["UA", "GA", "GTM"]:
+        current = info.get(f"current_{code_type}_code") or []
+        if isinstance(current, str):
+            current = [current]
+
+        archived = info.get(f"archived_{code_type}_codes") or {}
+
+        for code, seen in archived.items():
+            first_seen, last_seen = get_seen_datetimes(seen)
+            rows.append(
+                {
+                    "url": url,
+                    "code": code,
+                    "code_type": code_type,
+                    "first_seen": first_seen,
+                    "last_seen": last_seen,
+                    "is_current": code in current,
+                }
+            )
+
+        for code in current:
+            if code not in archived:
+                rows.append(
+                    {
+                        "url": url,
+                        "code": code,
+                        "code_type": code_type,
+                        "first_seen": None,
+                        "last_seen": None,
+                        "is_current": True,
+                    }
+                )
+
+    return rows
+
+
+def get_seen_datetimes(seen):
+    """Returns the first and last seen dates of an archived code as datetimes.
+
+    Dates from the scraper (SeenDates) keep their 14-digit timestamps, down to the second.
+    Plain dicts (e.g. results read back from json) only have dates rounded to the minute.
 
-    # If xlsx, write dataframes to separate sheets for urls, codes.
-    if output_type == "xlsx":
-        writer = pd.ExcelWriter(output_file, engine="xlsxwriter")
-        urls_df.to_excel(writer, sheet_name="URLs", index=False)
-        codes_df.to_excel(writer, sheet_name="Codes", index=False)
-        writer.close()
+    Args:
+        seen (dict): {"first_seen": "01/01/2019:00:00", "last_seen": "01/01/2020:00:00"}
+
+    Returns:
+        (datetime, datetime)
+    """
+
+    if isinstance(seen, SeenDates):
+        return (
+            datetime.strptime(str(seen.first_timestamp), "%Y%m%d%H%M%S"),
+            datetime.strptime(str(seen.last_timestamp), "%Y%m%d%H%M%S"),
+        )
+
+    return parse_seen_date(seen["first_seen"]), parse_seen_date(seen["last_seen"])
+
+
+def parse_seen_date(date):
+    """Converts a first/last seen date (dd/mm/YYYY:HH:MM) back into a datetime."""
+
+    return datetime.strptime(get_14_digit_timestamp(date), "%Y%m%d%H%M%S")
+
+
+def get_url_row(url, info):
+    """Flattens a single url's results into one row of the urls sheet.
+
+    Args:
+        url (str): Url.
+        info (dict): Results for url from scraper.
+
+    Returns:
+        {"url": "someurl.com", "UA_Code": "UA-12345678-1", ..., "Archived_UA_Codes": "1. UA-12345678-1 (...)"}
+    """
+
+    return {
+        "url": url,
+        "UA_Code": format_current_codes(info.get("current_UA_code", "")),
+        "GA_Code": format_current_codes(info.get("current_GA_code", "")),
+        "GTM_Code": format_current_codes(info.get("current_GTM_code", "")),
+        "Archived_UA_Codes": format_archived_codes(info.get("archived_UA_codes", {})),
+        "Archived_GA_Codes": format_archived_codes(info.get("archived_GA_codes", {})),
+        "Archived_GTM_Codes": format_archived_codes(
+            info.get("archived_GTM_codes", {})
+        ),
+    }
 
 
 def get_urls_df(results):
@@ -91,31 +391,33 @@ def get_urls_df(results):
         urls_df (pd.DataFrame): Pandas dataframe of results.
     """
 
+    import pandas as pd
+
     url_list = []
 
     for item in results:
         for url, info in item.items():
-            url_list.append(
-                {
-                    "url": url,
-                    "UA_Code": info.get("current_UA_code", ""),
-                    "GA_Code": info.get("current_GA_code", ""),
-                    "GTM_Code": info.get("current_GTM_code", ""),
-                    "Archived_UA_Codes": format_archived_codes(
-                        info.get("archived_UA_codes", {})
-                    ),
-                    "Archived_GA_Codes": format_archived_codes(
-                        info.get("archived_GA_codes", {})
-                    ),
-                    "Archived_GTM_Codes": format_archived_codes(
-                        info.get("archived_GTM_codes", {})
-                    ),
-                }
-            )
+            url_list.append(get_url_row(url, info))
 
     return pd.DataFrame(url_list)
 
 
+def format_current_codes(codes):
+    """Helper function to format a list of current codes as a comma separated string.
+
+    Args:
+        codes (list): Current codes, e.g. ["UA-12345678-1", "UA-12345678-2"].
+
+    Returns:
+        str: Formatted string, e.g. "UA-12345678-1, UA-12345678-2".
+    """
+
+    if isinstance(codes, list):
+        return ", ".join(codes)
+
+    return codes
+
+
 def format_archived_codes(archived_codes):
     """Helper function to flatten archived codes and format them into a single string where
     each item is numbered and separated by a newline.
@@ -139,6 +441,68 @@ def format_archived_codes(archived_codes):
     return "\n\n".join(results)
 
 
+def add_to_codes_index(codes_index, url, info):
+    """Adds every current and archived code for a url to an index of code -> websites.
+
+    Args:
+        codes_index (dict): Index to update.
+        url (str): Url.
+        info (dict): Results for url from scraper.
+
+    Returns:
+        {
+            "UA-12345678-1": {
+                "websites": ["someurl.com", "someurl.com"],
+                "active": ["Current (at someurl.com)", "01/01/2019 - 01/01/2020(at someurl.com)"],
+            },
+        }
+    """
+
+    # Only the current and archived codes are indexed. Other keys (timeline_*_codes,
+    # gtm_*_codes, coverage) describe the same codes or aren't codes at all.
+    for code_type in CODE_TYPES:
+        current_codes = info.get(f"current_{code_type}_code")
+        for code in current_codes if isinstance(current_codes, list) else []:
+            entry = codes_index.setdefault(code, {"websites": [], "active": []})
+            entry["websites"].append(url)
+            entry["active"].append(f"Current (at {url})")
+
+        archived_codes = info.get(f"archived_{code_type}_codes") or {}
+        for code, seen in archived_codes.items():
+            entry = codes_index.setdefault(code, {"websites": [], "active": []})
+            entry["websites"].append(url)
+            entry["active"].append(
+                f"{seen['first_seen']} - {seen['last_seen']}(at {url})"
+            )
+
+    return codes_index
+
+
+def get_codes_rows(codes_index):
+    """Formats an index from add_to_codes_index() into rows of the codes sheet, sorted by code.
+
+    Rows are yielded one at a time so writers don't hold a second copy of every code.
+
+    Args:
+        codes_index (dict): Index of code -> websites.
+
+    Yields:
+        {"code": "UA-12345678-1", "websites": "someurl.com, otherurl.org", "active": "1. ..."}
+        or a single {"Message": "No codes found."} if the index is empty.
+    """
+
+    if not codes_index:
+        yield {"Message": "No codes found."}
+        return
+
+    for code in sorted(codes_index):
+        yield {
+            "code": code,
+            "websites": ", ".join(codes_index[code]["websites"]),
+            "active": format_active(codes_index[code]["active"]),
+        }
+
+
 def get_codes_df(results):
     """Flattens the result json (list of dictionries) into a Pandas dataframe and returns it.
 
@@ -150,46 +514,16 @@ def get_codes_df(results):
 
     """
 
-    code_list = []
+    import pandas as pd
+
+    codes_index = {}
 
-    # Flattens results into list of dicts for each code, including duplicates
+    # Index every code by the websites it was found on, including duplicates
     for item in results:
         for url, info in item.items():
-            for key, code in info.items():
-                if type(code) is list:
-                    for c in code:
-                        code_list.append(
-                            {
-                                "code": c,
-                                "websites": url,
-                                "active": f"Current (at {url})",
-                            }
-                        )
-                if type(code) is dict:
-                    for c in code:
-                        code_list.append(
-                            {
-                                "code": c,
-                                "websites": url,
-                                "active": f"{code[c]['first_seen']} - {code[c]['last_seen']}(at {url})",
-                            }
-                        )
-
-    # Return a df w/ string message if no codes found
-    if not code_list:
-        return pd.DataFrame([{"Message": "No codes found."}])
-
-    # Convert list of dicts to pandas dataframe
-    codes_df = pd.DataFrame(code_list)
-
-    # Combine all duplicates and format combined columns
-    codes_df = (
-        codes_df.groupby("code")
-        .agg({"websites": lambda x: ", ".join(x), "active": format_active})
-        .reset_index()
-    )
+            add_to_codes_index(codes_index, url, info)
 
-    return codes_df
+    return pd.DataFrame(list(get_codes_rows(codes_index)))
 
 
 def format_active(list):
@@ -0,0 +1,252 @@
+import asyncio
+from datetime import datetime
+
+from wayback_google_analytics.async_utils import get_snapshot_rows
+from wayback_google_analytics.urls import get_domain, group_urls
+from wayback_google_analytics.utils import DEFAULT_RATE_LIMIT
+
+
+def stratified_sample(timestamps, size):
+    """Picks up to size timestamps spread evenly over time rather than by count, so a
+    burst of captures in one month doesn't use up the sample.
+
+    The time range is split into size equal strata and the first capture in each stratum
+    is picked. Slots left by empty strata are filled with captures evenly spaced among
+    those not picked yet.
+
+    Args:
+        timestamps (list): Sorted 14-digit timestamps.
+        size (int): Maximum number of timestamps to pick.
+
+    Returns:
+        Sorted list of picked timestamps.
+    """
+
+    if size >= len(timestamps):
+        return list(timestamps)
+    if size <= 0:
+        return []
+
+    seconds = [
+        datetime.strptime(timestamp, "%Y%m%d%H%M%S").timestamp()
+        for timestamp in timestamps
+    ]
+    first = seconds[0]
+    width = (seconds[-1] - first) / size or 1
+
+    picked = {}
+    for index, second in enumerate(seconds):
+        stratum = min(int((second - first) / width), size - 1)
+        picked.setdefault(stratum, index)
+
+    picked = set(picked.values())
+    remaining = [index for index in range(len(timestamps)) if index not in picked]
+    missing = size - len(picked)
+    if missing:
+        step = len(remaining) / missing
+        picked.update(remaining[int(i * step)] for i in range(missing))
+
+    return [timestamps[index] for index in sorted(picked)]
+
+
+def allocate_budget(counts, weights, budget):
+    """Splits a budget of snapshot requests between domains as evenly as possible.
+
+    Every domain gets the same sample size, except domains with fewer snapshots, which
+    keep all of them and leave the rest of their share to the others.
+
+    Args:
+        counts (dict): {domain: number of snapshots}.
+        weights (dict): {domain: number of urls}, since each url fetches every sampled snapshot.
+        budget (int): Snapshot requests to split.
+
+    Returns:
+        {domain: sample size}
+    """
+
+    def cost(size):
+        return sum(min(counts[domain], size) * weights[domain] for domain in counts)
+
+    # Largest common sample size that fits the budget
+    low, high = 0, max(counts.values(), default=0)
+    while low < high:
+        size = (low + high + 1) // 2
+        if cost(size) <= budget:
+            low = size
+        else:
+            high = size - 1
+
+    return {domain: min(count, low) for domain, count in counts.items()}
+
+
+async def plan_requests(
+    session,
+    urls,
+    start_date,
+    end_date,
+    frequency,
+    limit,
+    semaphore,
+    skip_current=False,
+    rate_limit=None,
+    budget=None,
+    max_size=None,
+):
+    """Estimates the requests, archived bytes and time a run would take, optionally
+    sampling snapshots to fit a request budget.
+
+    Only the CDX api is queried (once per domain), with the same query and selection as a
+    run (see get_snapshot_rows()). Those queries count towards the budget, and the run
+    reuses their timestamps (see get_cdx_cache()) instead of querying again.
+
+    Args:
+        session (aiohttp.ClientSession)
+        urls (list): Urls to plan for.
+        start_date (str, optional): 14-digit timestamp for starting point.
+        end_date (str, optional): 14-digit timestamp for end of range.
+        frequency (str, optional): Collapse option (see COLLAPSE_OPTIONS).
+        limit (int, optional): Limit number of snapshots per domain.
+        semaphore: asyncio.Semaphore()
+        skip_current (bool): Whether the run skips live pages. Defaults to False.
+        rate_limit (float, optional): Requests per second used to estimate time. Defaults to DEFAULT_RATE_LIMIT.
+        budget (int, optional): Maximum requests for the whole run. Defaults to None (no sampling).
+        max_size (int, optional): Skip captures larger than this many bytes. Defaults to None.
+
+    Returns:
+        {
+            "urls": [
+                {"url": "someurl.com", "domain": "someurl.com", "snapshots": 250, "sampled": 40, "requests": 42, "bytes": 1048576, "seconds": 8.4},
+            ],
+            "requests": 42,
+            "bytes": 1048576,
+            "seconds": 8.4,
+            "rate_limit": 5,
+            "budget": 42,
+            "timestamps": {"someurl.com": ["20190101000000", ...]},
+        }
+
+    Raises:
+        ValueError: If the budget doesn't cover the CDX queries and live pages.
+    """
+
+    rate_limit = rate_limit or DEFAULT_RATE_LIMIT
+
+    # Equivalent urls are scraped once, and every url on a domain shares a CDX query
+    urls = [group[0] for group in group_urls(urls).values()]
+    domains = {}
+    for url in urls:
+        domains.setdefault(get_domain(url), []).append(url)
+
+    indexes = await asyncio.gather(
+        *[
+            get_snapshot_rows(
+                session=session,
+                url=domain_urls[0],
+                start_date=start_date,
+                end_date=end_date,
+                frequency=frequency,
+                limit=limit,
+                semaphore=semaphore,
+                max_size=max_size,
+            )
+            for domain_urls in domains.values()
+        ]
+    )
+    indexes = dict(zip(domains, indexes))
+
+    overhead = len(domains) + (0 if skip_current else len(urls))
+    timestamps = {
+        domain: [timestamp for timestamp, _ in index]
+        for domain, index in indexes.items()
+    }
+
+    if budget is not None:
+        if budget < overhead:
+            raise ValueError(
+                f"A budget of {budget} requests doesn't cover the {overhead} CDX queries and live pages needed."
+            )
+        sizes = allocate_budget(
+            {domain: len(index) for domain, index in indexes.items()},
+            {domain: len(domain_urls) for domain, domain_urls in domains.items()},
+            budget - overhead,
+        )
+        timestamps = {
+            domain: stratified_sample(timestamps[domain], sizes[domain])
+            for domain in domains
+        }
+
+    plan = {"urls": [], "rate_limit": rate_limit, "budget": budget}
+    for domain, domain_urls in domains.items():
+        lengths = dict(indexes[domain])
+        sampled_bytes = sum(lengths[timestamp] or 0 for timestamp in timestamps[domain])
+
+        for index, url in enumerate(domain_urls):
+            # The domain's CDX query is counted against its first url
+            requests = len(timestamps[domain]) + (0 if skip_current else 1)
+            requests += 1 if index == 0 else 0
+
+            plan["urls"].append(
+                {
+                    "url": url,
+                    "domain": domain,
+                    "snapshots": len(indexes[domain]),
+                    "sampled": len(timestamps[domain]),
+                    "requests": requests,
+                    "bytes": sampled_bytes,
+                    "seconds": round(requests / rate_limit, 1),
+                }
+            )
+
+    plan["requests"] = sum(entry["requests"] for entry in plan["urls"])
+    plan["bytes"] = sum(entry["bytes"] for entry in plan["urls"])
+    plan["seconds"] = round(plan["requests"] / rate_limit, 1)
+    plan["timestamps"] = timestamps
+
+    return plan
+
+
+def get_cdx_cache(plan):
+    """Returns a CDX cache (see process_url()) holding the planned timestamps, so the run
+    fetches exactly the planned snapshots without querying the CDX api again.
+
+    Args:
+        plan (dict): Plan from plan_requests().
+
+    Returns:
+        {domain: asyncio.Future}
+    """
+
+    loop = asyncio.get_running_loop()
+    cdx_cache = {}
+    for domain, timestamps in plan["timestamps"].items():
+        cdx_cache[domain] = loop.create_future()
+        cdx_cache[domain].set_result(timestamps)
+
+    return cdx_cache
+
+
+def print_plan(plan):
+    """Prints a plan from plan_requests() as a table with totals."""
+
+    print(f"{'url':<40} {'snapshots':>10} {'sampled':>8} {'requests':>9} {'MB':>8} {'time':>9}")
+    for entry in plan["urls"]:
+        print(
+            f"{entry['url'][:40]:<40} {entry['snapshots']:>10} {entry['sampled']:>8} {entry['requests']:>9} {entry['bytes'] / 1e6:>8.1f} {format_duration(entry['seconds']):>9}"
+        )
+
+    print(
+        f"\nTotal: {plan['requests']} requests, {plan['bytes'] / 1e6:.1f} MB archived, about {format_duration(plan['seconds'])} at {plan['rate_limit']} requests per second"
+    )
+    if plan["budget"] is not None:
+        print(f"Budget: {plan['budget']} requests")
+
+
+def format_duration(seconds):
+    """Returns seconds as a short duration (e.g. 42s, 12m 5s, 3h 20m)."""
+
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds // 3600}h {seconds % 3600 // 60}m"
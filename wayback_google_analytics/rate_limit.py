@@ -0,0 +1,72 @@
+import asyncio
+import multiprocessing
+import time
+
+
+class RateLimiter:
+    """Spaces requests evenly to stay under a given number of requests per second.
+
+    The next free request slot is kept in shared memory, so a limiter passed to worker
+    processes (e.g. as a ProcessPoolExecutor initarg) enforces one budget across all of them.
+
+    Args:
+        rate (float): Maximum requests per second.
+    """
+
+    def __init__(self, rate):
+        if rate <= 0:
+            raise ValueError(f"Invalid rate limit: {rate}. Please use a positive number.")
+
+        self.rate = rate
+        self.interval = 1 / rate
+        self._next_slot = multiprocessing.Value("d", 0.0)
+
+    def reserve(self):
+        """Reserves the next free request slot and returns how many seconds until it starts."""
+
+        with self._next_slot.get_lock():
+            now = time.time()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+
+        return slot - now
+
+    def backlog(self):
+        """Returns how many seconds of requests are already reserved ahead of now."""
+
+        return max(0.0, self._next_slot.value - time.time())
+
+    async def wait(self):
+        """Waits until this caller's request slot starts."""
+
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class RateLimitedSemaphore:
+    """Drop-in replacement for asyncio.Semaphore that also waits for a RateLimiter slot.
+
+    Scraper functions take a semaphore and use it as "async with semaphore:" around each
+    request, so passing one of these limits both concurrency and request rate.
+
+    Args:
+        value (int): Maximum concurrent requests.
+        limiter (RateLimiter): Shared rate limiter.
+    """
+
+    def __init__(self, value, limiter):
+        self._semaphore = asyncio.Semaphore(value)
+        self.limiter = limiter
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            await self.limiter.wait()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
@@ -1,22 +1,55 @@
 import aiohttp
 import asyncio
+import copy
 from wayback_google_analytics.codes import (
-    get_UA_code,
-    get_GA_code,
-    get_GTM_code,
+    get_codes_from_bytes,
 )
 from wayback_google_analytics.async_utils import (
     get_snapshot_timestamps,
-    get_codes_from_snapshots,
+    get_sightings_from_snapshots,
+    get_records_from_snapshots,
+    get_deadline,
+    get_remaining,
+    get_shared_task,
+)
+
+from wayback_google_analytics.models import (
+    CODE_TYPES,
+    UrlResult,
+    reduce_code_records,
+)
+
+from wayback_google_analytics.timeline import (
+    build_timelines,
+)
+
+from wayback_google_analytics.cdx_store import (
+    CdxStore,
+)
+
+from wayback_google_analytics.gtm import (
+    ContainerCache,
+    expand_gtm_records,
+)
+
+from wayback_google_analytics.scripts import (
+    ScriptCache,
 )
 
 from wayback_google_analytics.utils import (
     DEFAULT_HEADERS,
+    order_progressive,
+)
+
+from wayback_google_analytics.urls import (
+    get_domain,
+    group_urls,
+    normalize_url,
 )
 
 
 async def get_html(session, url, semaphore):
-    """Returns html from a single url.
+    """Returns the raw html from a single url, without decoding it.
 
     Args:
         session (aiohttp.ClientSession)
@@ -24,12 +57,12 @@ async def get_html(session, url, semaphore):
         semaphore: asyncio.semaphore
 
     Returns:
-        html (str): html from url.
+        html (bytes): html from url.
     """
     async with semaphore:
         try:
             async with session.get(url, headers=DEFAULT_HEADERS) as response:
-                return await response.text()
+                return await response.read()
         except aiohttp.ServerTimeoutError as e:
             print(f"Request to {url} timed out", e)
         except aiohttp.ClientError as e:
@@ -39,8 +72,83 @@ async def get_html(session, url, semaphore):
             return None
 
 
+async def get_current_codes(session, url, semaphore):
+    """Returns the UA/GA/GTM codes currently on a url's live page.
+
+    Args:
+        session (aiohttp.ClientSession)
+        url (str): Url to scrape.
+        semaphore: asyncio.semaphore
+
+    Returns:
+        {
+            "current_UA_code": ["UA-12345678-1"],
+            "current_GA_code": ["G-1234567890"],
+            "current_GTM_code": ["GTM-12345678"],
+        }
+        or {} if the page couldn't be retrieved.
+    """
+
+    html = await get_html(session, url, semaphore)
+    print("Retrieving current codes for: ", url)
+
+    if not html:
+        return {}
+
+    found = get_codes_from_bytes(html)
+    current_codes = {
+        f"current_{code_type}_code": found[code_type] for code_type in CODE_TYPES
+    }
+    print("Finished gathering current codes for: ", url)
+
+    return current_codes
+
+
+async def wait_until(awaitable, deadline, default, cancel=True):
+    """Waits for awaitable until deadline, returning default if it isn't done in time.
+
+    Args:
+        awaitable: Coroutine or task to wait for.
+        deadline (float): Event loop time (see get_deadline()), or None to wait without a limit.
+        default: Returned if the deadline passes first.
+        cancel (bool): Cancel the awaitable at the deadline. Pass False for tasks shared with
+            other urls (e.g. from get_shared_task()). Defaults to True.
+
+    Returns:
+        (result, timed_out)
+    """
+
+    task = asyncio.ensure_future(awaitable)
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), get_remaining(deadline)), False
+    except asyncio.TimeoutError:
+        if cancel:
+            task.cancel()
+        return default, True
+
+
 async def process_url(
-    session, url, start_date, end_date, frequency, limit, semaphore, skip_current
+    session,
+    url,
+    start_date,
+    end_date,
+    frequency,
+    limit,
+    semaphore,
+    skip_current,
+    cdx_cache=None,
+    timeline=False,
+    cdx_store_dir=None,
+    cdx_dedupe=False,
+    progressive=False,
+    timeout=None,
+    deadline=None,
+    max_size=None,
+    expand_gtm=False,
+    gtm_cache=None,
+    fetch_scripts=False,
+    script_cache=None,
 ):
     """Returns a dictionary of current and archived UA/GA codes for a single url.
 
@@ -53,6 +161,22 @@ async def process_url(
         limit (int):
         semaphore: asyncio.semaphore
         skip_current (bool): Determine whether to skip getting current codes
+        cdx_cache (dict, optional): Shares CDX timestamps between urls on the same domain.
+        timeline (bool): Add every run of snapshots each code was present in. Defaults to False.
+        cdx_store_dir (str, optional): Directory of CdxStores to select snapshots from. Defaults to None.
+        cdx_dedupe (bool): Skip stored captures whose content is identical to an earlier one. Defaults to False.
+        progressive (bool): Fetch snapshots coarse to fine (see order_progressive()). Defaults to False.
+        timeout (float, optional): Seconds this url may take. Snapshots still being fetched
+            when it runs out are cancelled and the codes found so far are kept. Defaults to None.
+        deadline (float, optional): Event loop time that also stops this url (e.g. the job's
+            deadline from get_deadline()). Defaults to None.
+        max_size (int, optional): Skip captures larger than this many bytes. Defaults to None.
+        expand_gtm (bool): Add the UA/GA codes configured by archived versions of each GTM
+            container found. Defaults to False.
+        gtm_cache (ContainerCache, optional): Shares container lookups between urls. Defaults to None.
+        fetch_scripts (bool): Also scan the archived same-site scripts each snapshot loads.
+            Defaults to False.
+        script_cache (ScriptCache, optional): Shares script lookups between urls. Defaults to None.
 
     Returns:
         "someurl.com": {
@@ -76,47 +200,116 @@ async def process_url(
                     "first_seen": "20190101000000",
                     "last_seen": "20190101000000",
                 },
+            "timeline_UA_codes": {
+                "UA-12345678-1": [{"first_seen": "01/01/2019:00:00", "last_seen": "01/01/2019:00:00"}],
+            },
+            ... (timeline_*_codes only with timeline=True)
+            "truncated": False,
+            "coverage": {"snapshots": 100, "fetched": 100, "failed": 0},
+            ... (truncated and coverage only with a timeout or deadline)
+            "gtm_UA_codes": {
+                "UA-12345678-1": {"first_seen": "01/01/2019:00:00", "last_seen": "01/01/2019:00:00"},
+            },
+            "gtm_GA_codes": {},
+            ... (gtm_*_codes only with expand_gtm=True)
         },
 
     """
-    async with semaphore:
-        # Initialize dict for entry
-        curr_entry = {url: {}}
-
-        # Get html + current codes
-        if not skip_current:
-            html = await get_html(session, url, semaphore)
-            print("Retrieving current codes for: ", url)
-            if html:
-                curr_entry[url]["current_UA_code"] = get_UA_code(html)
-                curr_entry[url]["current_GA_code"] = get_GA_code(html)
-                curr_entry[url]["current_GTM_code"] = get_GTM_code(html)
-                curr_entry[url]["current_GTM_code"] = get_GTM_code(html)
-                print("Finished gathering current codes for: ", url)
-
-        # Get snapshots for Wayback Machine
-        print("Retrieving archived codes for: ", url)
-        archived_snapshots = await get_snapshot_timestamps(
+    # Collect codes in a UrlResult, which is only serialized to dicts once at the end
+    result = UrlResult(url)
+    deadline = get_deadline(timeout, deadline)
+    truncated = False
+    if fetch_scripts and script_cache is None:
+        script_cache = ScriptCache()
+    elif not fetch_scripts:
+        script_cache = None
+
+    # Get html + current codes
+    if not skip_current:
+        result.current_codes, truncated = await wait_until(
+            get_current_codes(session, url, semaphore), deadline, default={}
+        )
+
+    # Get snapshots for Wayback Machine
+    print("Retrieving archived codes for: ", url)
+    # CDX queries use matchType=domain, so every url on a domain gets the same timestamps
+    archived_snapshots, cdx_timed_out = await wait_until(
+        get_shared_task(
+            cdx_cache,
+            get_domain(url),
+            lambda: get_snapshot_timestamps(
+                session=session,
+                url=url,
+                start_date=start_date,
+                end_date=end_date,
+                frequency=frequency,
+                limit=limit,
+                semaphore=semaphore,
+                cdx_store=CdxStore(cdx_store_dir, get_domain(url)) if cdx_store_dir else None,
+                max_size=max_size,
+                dedupe=cdx_dedupe,
+            ),
+        ),
+        deadline,
+        default=[],
+        cancel=cdx_cache is None,
+    )
+    truncated = truncated or cdx_timed_out
+
+    # Requests start in the order of timestamps, since they queue for the semaphore in turn
+    if progressive:
+        archived_snapshots = order_progressive(archived_snapshots)
+
+    # Get historic codes from archived snapshots
+    if timeline or deadline is not None or expand_gtm:
+        # Keep every snapshot's codes, so gaps between sightings (and coverage) can be counted
+        records = await get_records_from_snapshots(
             session=session,
             url=url,
-            start_date=start_date,
-            end_date=end_date,
-            frequency=frequency,
-            limit=limit,
+            timestamps=archived_snapshots,
             semaphore=semaphore,
+            deadline=deadline,
+            script_cache=script_cache,
         )
-
-        # Get historic codes from archived snapshots, appending them to curr_entry
-        archived_codes = await get_codes_from_snapshots(
-            session=session, url=url, timestamps=archived_snapshots, semaphore=semaphore
+        archived_codes = reduce_code_records(records)
+        if expand_gtm:
+            gtm_records, gtm_timed_out = await wait_until(
+                expand_gtm_records(session, records, semaphore, gtm_cache),
+                deadline,
+                default=[],
+            )
+            truncated = truncated or gtm_timed_out
+            gtm_codes = reduce_code_records(gtm_records)
+            result.gtm_codes = {
+                code_type: gtm_codes[f"{code_type}_codes"] for code_type in ["UA", "GA"]
+            }
+        if timeline:
+            timelines = build_timelines(records)
+            result.timelines = {
+                code_type: timelines[f"{code_type}_codes"] for code_type in CODE_TYPES
+            }
+        if deadline is not None:
+            result.coverage = {
+                "snapshots": len(archived_snapshots),
+                "fetched": len(records),
+                "failed": sum(record is None for record in records),
+                "truncated": truncated or len(records) < len(archived_snapshots),
+            }
+    else:
+        archived_codes = await get_sightings_from_snapshots(
+            session=session,
+            url=url,
+            timestamps=archived_snapshots,
+            semaphore=semaphore,
+            script_cache=script_cache,
         )
-        curr_entry[url]["archived_UA_codes"] = archived_codes["UA_codes"]
-        curr_entry[url]["archived_GA_codes"] = archived_codes["GA_codes"]
-        curr_entry[url]["archived_GTM_codes"] = archived_codes["GTM_codes"]
 
-        print("Finished retrieving archived codes for: ", url)
+    for code_type in CODE_TYPES:
+        result.archived_codes[code_type] = archived_codes[f"{code_type}_codes"]
+
+    print("Finished retrieving archived codes for: ", url)
 
-        return curr_entry
+    return result.to_dict()
 
 
 async def get_analytics_codes(
@@ -128,6 +321,16 @@ async def get_analytics_codes(
     limit=None,
     semaphore=None,
     skip_current=False,
+    timeline=False,
+    cdx_store_dir=None,
+    cdx_cache=None,
+    cdx_dedupe=False,
+    progressive=False,
+    url_timeout=None,
+    job_timeout=None,
+    max_size=None,
+    expand_gtm=False,
+    fetch_scripts=False,
 ):
     """Takes array of urls and returns array of dictionaries with all found analytics codes for a given time range.
 
@@ -138,6 +341,17 @@ async def get_analytics_codes(
         end_date (str, optional): End date for time range. Defaults to None.
         frequency (str, optional): Can limit snapshots to remove duplicates (1 per hr, day, month, etc). Defaults to None.
         limit (int, optional): Limit number of snapshots returned. Defaults to None.
+        timeline (bool, optional): Add every run of snapshots each code was present in. Defaults to False.
+        cdx_store_dir (str, optional): Directory of CdxStores to select snapshots from. Defaults to None.
+        cdx_cache (dict, optional): CDX timestamps per domain, e.g. planned with get_cdx_cache().
+            Defaults to None (a new cache for this run).
+        cdx_dedupe (bool, optional): Skip stored captures whose content is identical to an earlier one. Defaults to False.
+        progressive (bool, optional): Fetch snapshots coarse to fine (see order_progressive()). Defaults to False.
+        url_timeout (float, optional): Seconds each url may take before its results are truncated. Defaults to None.
+        job_timeout (float, optional): Seconds all urls may take before their results are truncated. Defaults to None.
+        max_size (int, optional): Skip captures larger than this many bytes. Defaults to None.
+        expand_gtm (bool, optional): Add the UA/GA codes configured by each GTM container found. Defaults to False.
+        fetch_scripts (bool, optional): Also scan the archived same-site scripts each snapshot loads. Defaults to False.
 
     Returns:
         {
@@ -171,23 +385,193 @@ async def get_analytics_codes(
         }
     """
 
-    tasks = []
-    for url in urls:
+    # Equivalent urls (e.g. example.com and https://www.example.com/) are scraped once
+    urls = list(urls)
+    url_groups = group_urls(urls)
+    if cdx_cache is None:
+        cdx_cache = {}
+    job_deadline = get_deadline(job_timeout)
+    gtm_cache = ContainerCache() if expand_gtm else None
+    script_cache = ScriptCache() if fetch_scripts else None
+
+    tasks = {}
+    for canonical_url, group in url_groups.items():
         task = asyncio.create_task(
             process_url(
                 session=session,
-                url=url,
+                url=group[0],
                 start_date=start_date,
                 end_date=end_date,
                 frequency=frequency,
                 limit=limit,
                 semaphore=semaphore,
                 skip_current=skip_current,
+                cdx_cache=cdx_cache,
+                timeline=timeline,
+                cdx_store_dir=cdx_store_dir,
+                cdx_dedupe=cdx_dedupe,
+                progressive=progressive,
+                timeout=url_timeout,
+                deadline=job_deadline,
+                max_size=max_size,
+                expand_gtm=expand_gtm,
+                gtm_cache=gtm_cache,
+                fetch_scripts=fetch_scripts,
+                script_cache=script_cache,
             )
         )
-        tasks.append(task)
-        await asyncio.sleep(5)
+        tasks[canonical_url] = task
+        # Urls are staggered, but never past the job's deadline
+        remaining = get_remaining(job_deadline)
+        await asyncio.sleep(5 if remaining is None else min(5, remaining))
+
+    # Process urls concurrently
+    await asyncio.gather(*tasks.values())
+
+    # Fan results back out to every url as entered, in input order
+    results = []
+    fanned_out = set()
+    for url in urls:
+        canonical_url = normalize_url(url)
+        info = tasks[canonical_url].result()[url_groups[canonical_url][0]]
+        if canonical_url in fanned_out:
+            info = copy.deepcopy(info)
+        fanned_out.add(canonical_url)
+        results.append({url: info})
 
-    # Process urls concurrently and return results
-    results = await asyncio.gather(*tasks)
     return results
+
+
+async def stream_analytics_codes(
+    session,
+    urls,
+    start_date="20121001000000",
+    end_date=None,
+    frequency=None,
+    limit=None,
+    semaphore=None,
+    skip_current=False,
+    pool_size=5,
+    timeline=False,
+    cdx_store_dir=None,
+    cdx_cache=None,
+    cdx_dedupe=False,
+    progressive=False,
+    url_timeout=None,
+    job_timeout=None,
+    max_size=None,
+    expand_gtm=False,
+    fetch_scripts=False,
+):
+    """Lazily consumes an iterable of urls with a fixed-size pool of workers and yields
+    results as they finish. Unlike get_analytics_codes(), only pool_size urls are queued
+    or in progress at any time, so memory stays constant no matter how many urls there are.
+
+    Args:
+        session (aiohttp.ClientSession)
+        urls (iterable): Iterable (e.g. generator from iter_urls()) of urls to scrape.
+        start_date (str, optional): Start date for time range. Defaults to Oct 1, 2012, when UA codes were adopted.
+        end_date (str, optional): End date for time range. Defaults to None.
+        frequency (str, optional): Can limit snapshots to remove duplicates (1 per hr, day, month, etc). Defaults to None.
+        limit (int, optional): Limit number of snapshots returned. Defaults to None.
+        semaphore: asyncio.Semaphore. Defaults to asyncio.Semaphore(10).
+        skip_current (bool): Determine whether to skip getting current codes
+        pool_size (int): Number of urls processed concurrently. Defaults to 5.
+        timeline (bool, optional): Add every run of snapshots each code was present in. Defaults to False.
+        cdx_store_dir (str, optional): Directory of CdxStores to select snapshots from. Defaults to None.
+        cdx_cache (dict, optional): Shares CDX timestamps between urls on the same domain. Not
+            used by default, so memory stays constant. Defaults to None.
+        cdx_dedupe (bool, optional): Skip stored captures whose content is identical to an earlier one. Defaults to False.
+        progressive (bool, optional): Fetch snapshots coarse to fine (see order_progressive()). Defaults to False.
+        url_timeout (float, optional): Seconds each url may take before its results are truncated. Defaults to None.
+        job_timeout (float, optional): Seconds all urls may take before their results are truncated. Defaults to None.
+        max_size (int, optional): Skip captures larger than this many bytes. Defaults to None.
+        expand_gtm (bool, optional): Add the UA/GA codes configured by each GTM container found. Defaults to False.
+        fetch_scripts (bool, optional): Also scan the archived same-site scripts each snapshot loads. Defaults to False.
+
+    Yields:
+        {"someurl.com": {...}} (see get_analytics_codes()), in order of completion. Urls
+        that couldn't be processed yield {"someurl.com": {"error": "..."}}, so consumers
+        can see and retry them.
+    """
+
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(10)
+
+    job_deadline = get_deadline(job_timeout)
+    gtm_cache = ContainerCache() if expand_gtm else None
+    script_cache = ScriptCache() if fetch_scripts else None
+
+    # Bounded queues give backpressure: the producer waits while workers are busy and
+    # workers wait while results haven't been consumed.
+    url_queue = asyncio.Queue(maxsize=pool_size)
+    result_queue = asyncio.Queue(maxsize=pool_size)
+
+    async def producer():
+        error = None
+        try:
+            for url in urls:
+                await url_queue.put(url)
+        except Exception as e:
+            error = e
+
+        # One sentinel per worker, so workers finish even if reading input failed
+        for _ in range(pool_size):
+            await url_queue.put(None)
+
+        if error:
+            raise error
+
+    async def worker():
+        while True:
+            url = await url_queue.get()
+            if url is None:
+                await result_queue.put(None)
+                return
+
+            try:
+                result = await process_url(
+                    session=session,
+                    url=url,
+                    start_date=start_date,
+                    end_date=end_date,
+                    frequency=frequency,
+                    limit=limit,
+                    semaphore=semaphore,
+                    skip_current=skip_current,
+                    timeline=timeline,
+                    cdx_store_dir=cdx_store_dir,
+                    cdx_cache=cdx_cache,
+                    cdx_dedupe=cdx_dedupe,
+                    progressive=progressive,
+                    timeout=url_timeout,
+                    deadline=job_deadline,
+                    max_size=max_size,
+                    expand_gtm=expand_gtm,
+                    gtm_cache=gtm_cache,
+                    fetch_scripts=fetch_scripts,
+                    script_cache=script_cache,
+                )
+            except Exception as e:
+                print(f"Error processing {url}: ", e)
+                result = {url: {"error": str(e) or type(e).__name__}}
+
+            await result_queue.put(result)
+
+    tasks = [asyncio.create_task(producer())]
+    tasks += [asyncio.create_task(worker()) for _ in range(pool_size)]
+
+    try:
+        finished_workers = 0
+        while finished_workers < pool_size:
+            result = await result_queue.get()
+            if result is None:
+                finished_workers += 1
+                continue
+            yield result
+
+        # Surface errors from the producer (e.g. a malformed input line)
+        await tasks[0]
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,197 @@
+import asyncio
+import re
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit
+
+from wayback_google_analytics.async_utils import (
+    get_capture_index,
+    get_closest_capture,
+    get_shared_task,
+)
+from wayback_google_analytics.codes import CODE_PATTERNS
+from wayback_google_analytics.urls import get_domain
+from wayback_google_analytics.utils import DEFAULT_HEADERS
+
+# Script urls and script versions kept by default. Each entry is a small list or dict.
+DEFAULT_MAX_SCRIPTS = 1000
+
+# Pages with more scripts than this are usually bundling third-party widgets
+MAX_SCRIPTS_PER_PAGE = 10
+
+# Urls rewritten by the Wayback Machine, e.g. /web/20190101000000js_/https://someurl.com/app.js
+WAYBACK_PATTERN = re.compile(r"^(?:https?:)?(?://web\.archive\.org)?/web/\d{1,14}[a-z_]*/(.*)$")
+
+
+class ScriptCache:
+    """Shares archived script lookups between snapshots and urls, up to max_size entries.
+
+    Each script url's CDX index is queried once, and each version of a script (same
+    content digest, whatever url it was served from) is fetched and scanned once, however
+    many snapshots load it. The least recently used entries are dropped first.
+    """
+
+    def __init__(self, max_size=DEFAULT_MAX_SCRIPTS):
+        self.max_size = max_size
+        # {script url: task returning [(timestamp, digest), ...]}
+        self.indexes = OrderedDict()
+        # {digest: task returning {"UA": [...], "GA": [...], "GTM": [...]}}
+        self.versions = OrderedDict()
+
+    def share(self, cache, key, coro_factory):
+        """Returns get_shared_task() for key, evicting the oldest entries past max_size.
+
+        Evicted tasks keep running for callers already awaiting them.
+        """
+
+        task = get_shared_task(cache, key, coro_factory)
+        cache.move_to_end(key)
+        while len(cache) > self.max_size:
+            cache.popitem(last=False)
+
+        return task
+
+    async def get_codes(self, session, page_url, timestamp, srcs, semaphore):
+        """Returns the codes in the archived versions of the same-site scripts a page loads.
+
+        Each script uses its capture closest in time to the page's snapshot.
+
+        Args:
+            session (aiohttp.ClientSession)
+            page_url (str): Url of the page (or of its snapshot).
+            timestamp (str): 14-digit timestamp of the page's snapshot.
+            srcs (list): Script srcs from get_script_srcs().
+            semaphore: asyncio.Semaphore()
+
+        Returns:
+            {"UA": ["UA-12345678-1"], "GA": [], "GTM": []}
+        """
+
+        script_urls = get_same_site_scripts(page_url, srcs)
+
+        # Shared tasks are shielded, so a snapshot cancelled at its url's deadline doesn't
+        # cancel them for the other snapshots and urls awaiting them
+        async def get_script_codes(script_url):
+            index = await asyncio.shield(
+                self.share(
+                    self.indexes,
+                    script_url,
+                    lambda: get_capture_index(session, script_url, semaphore),
+                )
+            )
+            capture = get_closest_capture(index, timestamp)
+            if capture is None:
+                return {}
+            capture_timestamp, digest = capture
+            return await asyncio.shield(
+                self.share(
+                    self.versions,
+                    digest,
+                    lambda: get_archived_script_codes(
+                        session, script_url, capture_timestamp, semaphore
+                    ),
+                )
+            )
+
+        results = await asyncio.gather(
+            *[get_script_codes(script_url) for script_url in script_urls],
+            return_exceptions=True,
+        )
+
+        found = {"UA": [], "GA": [], "GTM": []}
+        for script_url, codes in zip(script_urls, results):
+            if isinstance(codes, BaseException):
+                print(f"Error retrieving script {script_url}: ", codes)
+                continue
+            for code_type, code_list in codes.items():
+                found[code_type] += [
+                    code for code in code_list if code not in found[code_type]
+                ]
+
+        return found
+
+
+def resolve_script_url(page_url, src):
+    """Returns the original url of a script, undoing the Wayback Machine's rewriting.
+
+    Args:
+        page_url (str): Url of the page (or of its snapshot) that loads the script.
+        src (str): The script's src attribute.
+
+    Returns:
+        str: Absolute url, or None if src isn't an http(s) url.
+
+    Example:
+        ("https://web.archive.org/web/20190101000000/someurl.com", "/js/app.js")
+            -> "http://someurl.com/js/app.js"
+    """
+
+    page = WAYBACK_PATTERN.match(page_url)
+    page_url = page.group(1) if page else page_url
+    if "://" not in page_url:
+        page_url = "http://" + page_url
+
+    script = WAYBACK_PATTERN.match(src)
+    url = script.group(1) if script else urljoin(page_url, src)
+    if url.startswith("//"):
+        url = "http:" + url
+
+    if urlsplit(url).scheme not in ("http", "https"):
+        return None
+
+    return url.split("#", 1)[0]
+
+
+def get_same_site_scripts(page_url, srcs):
+    """Returns the urls of the scripts served from a page's domain or its subdomains.
+
+    Args:
+        page_url (str): Url of the page (or of its snapshot).
+        srcs (list): Script srcs from get_script_srcs().
+
+    Returns:
+        Up to MAX_SCRIPTS_PER_PAGE script urls, in page order.
+    """
+
+    page = WAYBACK_PATTERN.match(page_url)
+    domain = get_domain(page.group(1) if page else page_url)
+
+    script_urls = []
+    for src in srcs:
+        url = resolve_script_url(page_url, src)
+        if url is None or url in script_urls:
+            continue
+        script_domain = get_domain(url)
+        if script_domain == domain or script_domain.endswith("." + domain):
+            script_urls.append(url)
+
+    return script_urls[:MAX_SCRIPTS_PER_PAGE]
+
+
+async def get_archived_script_codes(session, script_url, timestamp, semaphore):
+    """Returns the UA, GA and GTM codes in one archived version of a script.
+
+    Args:
+        session (aiohttp.ClientSession)
+        script_url (str): Original url of the script.
+        timestamp (str): 14-digit timestamp of the script's capture.
+        semaphore: asyncio.Semaphore()
+
+    Returns:
+        {"UA": ["UA-12345678-1"], "GA": ["G-1234567890"], "GTM": []}
+    """
+
+    # id_ returns the capture as archived, without the Wayback Machine's rewriting
+    url = f"https://web.archive.org/web/{timestamp}id_/{script_url}"
+
+    print("Retrieving script: ", url)
+
+    async with semaphore:
+        async with session.get(url, headers=DEFAULT_HEADERS) as response:
+            body = await response.read()
+
+    return {
+        code_type: list(
+            dict.fromkeys(code.decode("ascii") for code in pattern.findall(body))
+        )
+        for code_type, pattern in CODE_PATTERNS.items()
+    }
@@ -0,0 +1,370 @@
+import aiohttp
+import asyncio
+import json
+import math
+import time
+import uuid
+from aiohttp import web
+
+from wayback_google_analytics.rate_limit import RateLimiter, RateLimitedSemaphore
+from wayback_google_analytics.scraper import stream_analytics_codes
+from wayback_google_analytics.single_flight import SingleFlightSession
+from wayback_google_analytics.utils import (
+    get_limit_from_frequency,
+    get_14_digit_timestamp,
+    validate_dates,
+    COLLAPSE_OPTIONS,
+)
+
+# Seconds that responses are shared between clients (snapshots never change, CDX rarely)
+RESPONSE_CACHE_TTL = 300
+
+# Body bytes kept for shared responses, least recently used first out
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Seconds that CDX timestamps are shared between jobs with the same options
+CDX_CACHE_TTL = 3600
+
+# Domains kept across all CDX caches, oldest first out
+CDX_CACHE_MAX_DOMAINS = 10000
+
+# Seconds that finished jobs and their results are kept
+JOB_TTL = 3600
+
+
+class Job:
+    """A submitted list of urls, its options and the results collected so far."""
+
+    def __init__(self, urls, options):
+        self.id = uuid.uuid4().hex
+        self.urls = urls
+        self.options = options
+        self.status = "queued"
+        self.results = []
+        self.error = None
+        self.finished_at = None
+        self.updated = asyncio.Condition()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "urls": len(self.urls),
+            "completed": len(self.results),
+            # Urls whose result is an error entry (see stream_analytics_codes())
+            "failed": sum(
+                "error" in info for entry in self.results for info in entry.values()
+            ),
+            "error": self.error,
+        }
+
+
+class AnalyticsService:
+    """Runs jobs for every client with one connection pool, one rate limiter and shared
+    caches, so later requests for the same snapshots or domains are served warm.
+
+    Args:
+        rate_limit (float): Requests per second to archive.org, shared by all jobs.
+        pool_size (int): Urls processed concurrently per job. Defaults to 5.
+        max_jobs (int): Jobs run at once; later jobs wait as "queued". Defaults to 4.
+        max_backlog (float): Seconds of reserved requests above which new jobs are refused. Defaults to 30.
+    """
+
+    def __init__(self, rate_limit, pool_size=5, max_jobs=4, max_backlog=30):
+        self.limiter = RateLimiter(rate_limit)
+        self.semaphore = RateLimitedSemaphore(10, self.limiter)
+        self.pool_size = pool_size
+        self.max_backlog = max_backlog
+        self.job_slots = asyncio.Semaphore(max_jobs)
+
+        self.jobs = {}
+        self.tasks = set()
+        # {(start_date, end_date, frequency, limit): (created, {domain: task})}
+        self.cdx_caches = {}
+        self.session = None
+
+    async def start(self):
+        self.session = SingleFlightSession(
+            aiohttp.ClientSession(),
+            ttl=RESPONSE_CACHE_TTL,
+            max_bytes=RESPONSE_CACHE_MAX_BYTES,
+        )
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.session:
+            await self.session.close()
+
+    def get_retry_after(self):
+        """Returns seconds a client should wait before submitting, or 0 to admit a job now."""
+
+        backlog = self.limiter.backlog()
+        if backlog > self.max_backlog:
+            return math.ceil(backlog - self.max_backlog)
+        return 0
+
+    def get_cdx_cache(self, options):
+        """Returns the CDX cache shared by jobs with the same date range, frequency and limit.
+
+        Caches expire after CDX_CACHE_TTL seconds. Past CDX_CACHE_MAX_DOMAINS domains in
+        total, the oldest domains of the oldest caches are dropped first.
+        """
+
+        now = time.monotonic()
+        self.cdx_caches = {
+            key: (created, cache)
+            for key, (created, cache) in self.cdx_caches.items()
+            if now - created < CDX_CACHE_TTL
+        }
+
+        # Dicts keep insertion order, so the first domain in a cache is its oldest
+        excess = sum(len(cache) for _, cache in self.cdx_caches.values())
+        excess -= CDX_CACHE_MAX_DOMAINS
+        for _, cache in sorted(self.cdx_caches.values(), key=lambda entry: entry[0]):
+            while excess > 0 and cache:
+                del cache[next(iter(cache))]
+                excess -= 1
+
+        key = tuple(
+            options[option] for option in ["start_date", "end_date", "frequency", "limit"]
+        )
+        if key not in self.cdx_caches:
+            self.cdx_caches[key] = (now, {})
+        return self.cdx_caches[key][1]
+
+    def prune_jobs(self):
+        """Forgets finished jobs older than JOB_TTL."""
+
+        now = time.monotonic()
+        for job_id in [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.finished_at and now - job.finished_at > JOB_TTL
+        ]:
+            del self.jobs[job_id]
+
+    def submit(self, urls, options):
+        """Creates a job and starts running it in the background."""
+
+        self.prune_jobs()
+
+        job = Job(urls, options)
+        self.jobs[job.id] = job
+
+        task = asyncio.ensure_future(self.run_job(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+        return job
+
+    async def run_job(self, job):
+        """Runs a job once a job slot is free, notifying streaming clients of each result."""
+
+        async with self.job_slots:
+            job.status = "running"
+            try:
+                async for entry in stream_analytics_codes(
+                    session=self.session,
+                    urls=iter(job.urls),
+                    semaphore=self.semaphore,
+                    pool_size=self.pool_size,
+                    cdx_cache=self.get_cdx_cache(job.options),
+                    **job.options,
+                ):
+                    job.results.append(entry)
+                    async with job.updated:
+                        job.updated.notify_all()
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.finished_at = time.monotonic()
+                async with job.updated:
+                    job.updated.notify_all()
+
+
+def get_job_options(body):
+    """Validates a job request and converts its options the same way as the command line.
+
+    Args:
+        body (dict): {"urls": [...], "start_date": "01/01/2015", "frequency": "yearly", ...}
+
+    Returns:
+        (urls, options) for AnalyticsService.submit().
+
+    Raises:
+        ValueError: If the request is invalid.
+    """
+
+    if not isinstance(body, dict):
+        raise ValueError("Please send a json object.")
+
+    urls = body.get("urls")
+    if not urls or not isinstance(urls, list):
+        raise ValueError("Please provide a list of urls.")
+    if not all(isinstance(url, str) for url in urls):
+        raise ValueError("Urls must be strings.")
+
+    start_date = body.get("start_date", "01/10/2012:00:00")
+    end_date = body.get("end_date")
+    frequency = body.get("frequency")
+    limit = body.get("limit", -100)
+
+    for option, value in [("start_date", start_date), ("end_date", end_date)]:
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"Invalid {option}: {value}. Please use dd/mm/YYYY:HH:MM.")
+
+    # The limit is part of the CDX query (and the CDX cache key), so only integers pass
+    if not isinstance(limit, int) or isinstance(limit, bool):
+        raise ValueError(f"Invalid limit: {limit}. Please use a whole number.")
+
+    if start_date and end_date and not validate_dates(start_date, end_date):
+        raise ValueError("Start date must be before end date.")
+
+    if start_date:
+        start_date = get_14_digit_timestamp(start_date)
+    if end_date:
+        end_date = get_14_digit_timestamp(end_date)
+
+    if frequency:
+        if frequency not in COLLAPSE_OPTIONS:
+            raise ValueError(
+                f"Invalid frequency: {frequency}. Please use hourly, daily, monthly, or yearly."
+            )
+        limit = (
+            get_limit_from_frequency(
+                frequency=frequency, start_date=start_date, end_date=end_date
+            )
+            + 1
+        )
+        frequency = COLLAPSE_OPTIONS[frequency]
+
+    timeouts = {}
+    for option in ["url_timeout", "job_timeout"]:
+        timeouts[option] = body.get(option)
+        if timeouts[option] is not None:
+            if not isinstance(timeouts[option], (int, float)) or timeouts[option] <= 0:
+                raise ValueError(
+                    f"Invalid {option}: {timeouts[option]}. Please use a positive number of seconds."
+                )
+
+    return urls, {
+        "start_date": start_date,
+        "end_date": end_date,
+        "frequency": frequency,
+        "limit": limit,
+        "skip_current": bool(body.get("skip_current", False)),
+        "timeline": bool(body.get("timeline", False)),
+        "progressive": bool(body.get("progressive", False)),
+        "expand_gtm": bool(body.get("expand_gtm", False)),
+        "fetch_scripts": bool(body.get("fetch_scripts", False)),
+        **timeouts,
+    }
+
+
+async def submit_job(request):
+    """POST /jobs: submits urls and options, returning the job's id and status."""
+
+    service = request.app["service"]
+
+    retry_after = service.get_retry_after()
+    if retry_after:
+        return web.json_response(
+            {"error": "The request budget for archive.org is exhausted. Try again later."},
+            status=503,
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    try:
+        urls, options = get_job_options(await request.json())
+    except (ValueError, json.JSONDecodeError) as e:
+        return web.json_response({"error": str(e)}, status=400)
+
+    job = service.submit(urls, options)
+    return web.json_response(job.to_dict(), status=202)
+
+
+def get_job(request):
+    """Returns the job with the id in the request path, or raises a 404 error."""
+
+    job = request.app["service"].jobs.get(request.match_info["job_id"])
+    if job is None:
+        raise web.HTTPNotFound(text=json.dumps({"error": "Job not found."}))
+    return job
+
+
+async def job_status(request):
+    """GET /jobs/{job_id}: returns a job's status and progress."""
+
+    return web.json_response(get_job(request).to_dict())
+
+
+async def job_results(request):
+    """GET /jobs/{job_id}/results: streams results as json lines while the job runs."""
+
+    job = get_job(request)
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+
+    sent = 0
+    while True:
+        async with job.updated:
+            await job.updated.wait_for(
+                lambda: len(job.results) > sent or job.finished_at is not None
+            )
+
+        for entry in job.results[sent:]:
+            await response.write((json.dumps(entry) + "\n").encode())
+        sent = len(job.results)
+
+        if job.finished_at is not None and sent == len(job.results):
+            break
+
+    await response.write_eof()
+    return response
+
+
+def create_app(service):
+    """Returns the aiohttp application serving the job api."""
+
+    app = web.Application()
+    app["service"] = service
+
+    async def on_startup(app):
+        await service.start()
+
+    async def on_cleanup(app):
+        await service.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+
+    app.router.add_post("/jobs", submit_job)
+    app.router.add_get("/jobs/{job_id}", job_status)
+    app.router.add_get("/jobs/{job_id}/results", job_results)
+
+    return app
+
+
+async def serve(host, port, service):
+    """Serves the job api until cancelled.
+
+    Args:
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+        service (AnalyticsService)
+    """
+
+    runner = web.AppRunner(create_app(service))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Serving on http://{host}:{port}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,144 @@
+import asyncio
+from collections import OrderedDict
+
+# Seconds a finished response is kept for requests that arrive just after it completes
+DEFAULT_TTL = 10
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time: callers for a key that is already in flight
+    await the same future instead of starting a new call. Successful results are kept for
+    ttl seconds afterwards, so late joiners don't trigger a new call either.
+
+    With max_size, kept results are also bounded: once their total size is over max_size,
+    the least recently used results are forgotten early.
+
+    Args:
+        ttl (float): Seconds to keep a successful result. Defaults to DEFAULT_TTL.
+        max_size (int, optional): Total size of kept results. Defaults to None (no bound).
+        get_size (callable, optional): Returns the size of a result. Defaults to 1 per result.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_size=None, get_size=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.get_size = get_size or (lambda result: 1)
+        self.flights = {}
+        # Finished results kept for late joiners, least recently used first: {key: size}
+        self.kept = OrderedDict()
+        self.kept_size = 0
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, coro_factory):
+        """Returns the result of coro_factory(), shared with concurrent callers using key.
+
+        Args:
+            key: Hashable key identifying the call (e.g. a url).
+            coro_factory (callable): Returns the coroutine to run if key isn't in flight.
+
+        Returns:
+            Result of the (possibly shared) coroutine.
+        """
+
+        future = self.flights.get(key)
+
+        if future is None:
+            self.calls += 1
+            future = asyncio.ensure_future(coro_factory())
+            self.flights[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.shared += 1
+            if key in self.kept:
+                self.kept.move_to_end(key)
+
+        # Shielded, so a caller that is cancelled doesn't cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def _finish(self, key, future):
+        """Forgets failed calls immediately and successful ones after ttl seconds."""
+
+        if future.cancelled() or future.exception() is not None or not self.ttl:
+            self._forget(key, future)
+            return
+
+        asyncio.get_event_loop().call_later(self.ttl, self._forget, key, future)
+
+        if self.flights.get(key) is future:
+            size = self.get_size(future.result())
+            self.kept[key] = size
+            self.kept_size += size
+
+        if self.max_size is not None:
+            while self.kept_size > self.max_size and self.kept:
+                oldest = next(iter(self.kept))
+                self._forget(oldest, self.flights[oldest])
+
+    def _forget(self, key, future):
+        if self.flights.get(key) is future:
+            del self.flights[key]
+            self.kept_size -= self.kept.pop(key, 0)
+
+
+class SingleFlightSession:
+    """Wraps an aiohttp.ClientSession so concurrent GET requests for the same url share one
+    request. Responses support read(), text(), status, headers and charset.
+
+    Other attributes are passed through to the wrapped session.
+
+    Args:
+        session (aiohttp.ClientSession)
+        ttl (float): Seconds to keep a finished response. Defaults to DEFAULT_TTL.
+        max_bytes (int, optional): Total body bytes kept for finished responses, least
+            recently used first out. Defaults to None (only ttl applies).
+    """
+
+    def __init__(self, session, ttl=DEFAULT_TTL, max_bytes=None):
+        self.session = session
+        self.single_flight = SingleFlight(
+            ttl, max_size=max_bytes, get_size=lambda fetched: len(fetched[0])
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+    def get(self, url, **kwargs):
+        """Returns an async context manager for a (possibly shared) GET request to url."""
+
+        return SharedResponse(self, url, kwargs)
+
+    async def _fetch(self, url, kwargs):
+        async with self.session.get(url, **kwargs) as response:
+            body = await response.read()
+            return body, response.charset, response.status, response.headers
+
+
+class SharedResponse:
+    """Response from SingleFlightSession.get(), used as `async with session.get(url) as response`."""
+
+    def __init__(self, owner, url, kwargs):
+        self.owner = owner
+        self.url = url
+        self.kwargs = kwargs
+        self._body = None
+        self.charset = None
+        self.status = None
+        self.headers = None
+
+    async def __aenter__(self):
+        fetched = await self.owner.single_flight.do(
+            self.url, lambda: self.owner._fetch(self.url, self.kwargs)
+        )
+        self._body, self.charset, self.status, self.headers = fetched
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def read(self):
+        return self._body
+
+    async def text(self):
+        # Only the declared charset is used: bodies read as text (e.g. CDX pages) are ASCII
+        return self._body.decode(self.charset or "utf-8", errors="replace")
@@ -0,0 +1,391 @@
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from heapq import heappop, heappush
+
+from wayback_google_analytics.output import get_sighting_rows
+from wayback_google_analytics.urls import normalize_url
+from wayback_google_analytics.utils import get_date_from_timestamp
+
+# Lookups by url use the (url, code) primary key, so only code and date need their own indexes
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url TEXT PRIMARY KEY,
+    input_url TEXT NOT NULL,
+    last_updated TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS codes (
+    code TEXT PRIMARY KEY,
+    code_type TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sightings (
+    url TEXT NOT NULL,
+    code TEXT NOT NULL,
+    code_type TEXT NOT NULL,
+    first_seen TEXT,
+    last_seen TEXT,
+    is_current INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (url, code)
+);
+CREATE INDEX IF NOT EXISTS sightings_code ON sightings (code);
+CREATE INDEX IF NOT EXISTS sightings_type_first_seen ON sightings (code_type, first_seen);
+"""
+
+# Format of first_seen/last_seen in the store, which sorts chronologically
+TIMESTAMP_FORMAT = "%Y%m%d%H%M%S"
+
+
+class ResultStore:
+    """SQLite store that collects results from every run, indexed by code and by url.
+
+    Urls are stored in their canonical form (see normalize_url()), so runs over
+    "https://www.example.com" and "example.com" update the same sightings. Repeat runs
+    widen first_seen/last_seen rather than replacing them. Dates are stored as 14-digit
+    timestamps.
+
+    Args:
+        path (str): Path to store database. Created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Autocommit mode, with explicit transactions from _transaction()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @contextmanager
+    def _transaction(self):
+        """Runs a block in a write transaction, so concurrent runs can't interleave."""
+
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def add_results(self, results):
+        """Upserts results from get_analytics_codes() (or single stream entries).
+
+        Args:
+            results (list or dict): Results in the format returned by the scraper.
+
+        Returns:
+            int: Number of sightings written.
+        """
+
+        if isinstance(results, dict):
+            results = [results]
+
+        now = datetime.now().strftime(TIMESTAMP_FORMAT)
+        count = 0
+
+        with self._transaction() as conn:
+            for entry in results:
+                for input_url, info in entry.items():
+                    # Urls that failed (see stream_analytics_codes()) weren't checked
+                    if "error" in info:
+                        continue
+
+                    url = normalize_url(input_url)
+                    conn.execute(
+                        """
+                        INSERT INTO urls (url, input_url, last_updated) VALUES (?, ?, ?)
+                        ON CONFLICT (url) DO UPDATE SET
+                            input_url = excluded.input_url,
+                            last_updated = excluded.last_updated
+                        """,
+                        (url, input_url, now),
+                    )
+
+                    # Live page was checked, so codes it no longer has aren't current
+                    if any(key.startswith("current_") for key in info):
+                        conn.execute(
+                            "UPDATE sightings SET is_current = 0 WHERE url = ?", (url,)
+                        )
+
+                    for row in get_sighting_rows(url, info):
+                        self._upsert_sighting(conn, row)
+                        count += 1
+
+        return count
+
+    def _upsert_sighting(self, conn, row):
+        """Inserts a sighting, widening the dates of one that is already stored."""
+
+        first_seen = format_store_date(row["first_seen"])
+        last_seen = format_store_date(row["last_seen"])
+
+        conn.execute(
+            "INSERT OR IGNORE INTO codes (code, code_type) VALUES (?, ?)",
+            (row["code"], row["code_type"]),
+        )
+        conn.execute(
+            """
+            INSERT INTO sightings (url, code, code_type, first_seen, last_seen, is_current)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url, code) DO UPDATE SET
+                first_seen = MIN(
+                    COALESCE(first_seen, excluded.first_seen),
+                    COALESCE(excluded.first_seen, first_seen)
+                ),
+                last_seen = MAX(
+                    COALESCE(last_seen, excluded.last_seen),
+                    COALESCE(excluded.last_seen, last_seen)
+                ),
+                is_current = MAX(is_current, excluded.is_current)
+            """,
+            (
+                row["url"],
+                row["code"],
+                row["code_type"],
+                first_seen,
+                last_seen,
+                int(row["is_current"]),
+            ),
+        )
+
+    def get_sites(self, code):
+        """Returns every url a code was seen on (uses the code index).
+
+        Args:
+            code (str): UA, GA or GTM code.
+
+        Returns:
+            [
+                {
+                    "url": "someurl.com",
+                    "code": "UA-12345678-1",
+                    "code_type": "UA",
+                    "first_seen": "20190101000000",
+                    "last_seen": "20200101000000",
+                    "is_current": True,
+                },
+            ]
+        """
+
+        cursor = self.conn.execute(
+            """
+            SELECT url, code, code_type, first_seen, last_seen, is_current
+            FROM sightings WHERE code = ? ORDER BY url
+            """,
+            (code,),
+        )
+        return [get_sighting(row) for row in cursor]
+
+    def get_codes(self, url, start_date=None, end_date=None):
+        """Returns the codes a url used, optionally only those seen between two dates.
+
+        Args:
+            url (str): Url, in any form that normalizes to the stored url.
+            start_date (str): 14-digit timestamp. Defaults to None.
+            end_date (str): 14-digit timestamp. Defaults to None.
+
+        Returns:
+            List of sightings in the same format as get_sites().
+        """
+
+        query = """
+            SELECT url, code, code_type, first_seen, last_seen, is_current
+            FROM sightings WHERE url = ?
+        """
+        params = [normalize_url(url)]
+
+        # Codes with no archived dates (only seen on the live page) don't match a date range
+        if start_date:
+            query += " AND last_seen >= ?"
+            params.append(start_date)
+        if end_date:
+            query += " AND first_seen <= ?"
+            params.append(end_date)
+
+        cursor = self.conn.execute(query + " ORDER BY first_seen, code", params)
+        return [get_sighting(row) for row in cursor]
+
+    def get_last_updated(self, url):
+        """Returns the 14-digit timestamp of the last run that added url, or None."""
+
+        row = self.conn.execute(
+            "SELECT last_updated FROM urls WHERE url = ?", (normalize_url(url),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def lookup(self, codes):
+        """Finds the sites that share each code, and the periods when several used it at once.
+
+        Only reads the sightings of the given codes (through the code index), so lookups
+        stay fast however many runs the store holds.
+
+        Args:
+            codes (list): UA, GA or GTM codes.
+
+        Returns:
+            {
+                "codes": {
+                    "UA-12345678-1": {
+                        "sites": [{"url": "someurl.com", ...}, {"url": "otherurl.org", ...}],
+                        "overlaps": [
+                            {
+                                "urls": ["someurl.com", "otherurl.org", "thirdurl.net"],
+                                "first_seen": "20190101000000",
+                                "last_seen": "20190601000000",
+                            },
+                        ],
+                    },
+                },
+                "shared_sites": {"someurl.com": ["UA-12345678-1", "G-1234567890"]},
+            }
+        """
+
+        results = {}
+        codes_by_site = {}
+
+        for code in codes:
+            code = code.strip().upper()
+            sites = self.get_sites(code)
+            results[code] = {"sites": sites, "overlaps": get_overlaps(sites)}
+
+            for sighting in sites:
+                codes_by_site.setdefault(sighting["url"], []).append(code)
+
+        return {
+            "codes": results,
+            # Sites that used more than one of the codes looked up
+            "shared_sites": {
+                url: site_codes
+                for url, site_codes in codes_by_site.items()
+                if len(site_codes) > 1
+            },
+        }
+
+    def iter_sightings(self):
+        """Yields (url, code) for every sighting, streamed from the database.
+
+        Yields:
+            ("someurl.com", "UA-12345678-1")
+        """
+
+        yield from self.conn.execute("SELECT url, code FROM sightings")
+
+    def get_counts(self):
+        """Returns the number of urls, codes and sightings in the store."""
+
+        return {
+            table: self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ["urls", "codes", "sightings"]
+        }
+
+
+def get_sighting(row):
+    """Converts a sightings row into a dict."""
+
+    url, code, code_type, first_seen, last_seen, is_current = row
+    return {
+        "url": url,
+        "code": code,
+        "code_type": code_type,
+        "first_seen": first_seen,
+        "last_seen": last_seen,
+        "is_current": bool(is_current),
+    }
+
+
+def get_overlaps(sightings):
+    """Returns the periods when at least two sightings' first/last seen date ranges overlap,
+    with every url that used the code during each period.
+
+    Sightings are swept in order of first_seen, keeping the ranges still open in a heap by
+    last_seen. Each url is only listed again in a later period if its range spans the gap
+    between them, so the result grows linearly with the number of sightings rather than
+    with the number of overlapping pairs. Sightings without dates are skipped.
+
+    Args:
+        sightings (list): Sightings of one code, as returned by get_sites().
+
+    Returns:
+        [{"urls": ["someurl.com", "otherurl.org"], "first_seen": "20190101000000", "last_seen": "20190601000000"}]
+    """
+
+    dated = sorted(
+        (sighting for sighting in sightings if sighting["first_seen"]),
+        key=lambda sighting: sighting["first_seen"],
+    )
+
+    overlaps = []
+    # (last_seen, url) of the ranges still open
+    active = []
+    period = None
+
+    for sighting in dated:
+        # Drop ranges that ended before this one started. The period ends with the range
+        # that leaves a single one open.
+        while active and active[0][0] < sighting["first_seen"]:
+            last_seen, _ = heappop(active)
+            if period is not None and len(active) == 1:
+                period["last_seen"] = last_seen
+                overlaps.append(period)
+                period = None
+
+        if active:
+            if period is None:
+                period = {
+                    "urls": [url for _, url in active],
+                    "first_seen": sighting["first_seen"],
+                    "last_seen": None,
+                }
+            period["urls"].append(sighting["url"])
+
+        heappush(active, (sighting["last_seen"], sighting["url"]))
+
+    if period is not None:
+        # Ends when the second latest range still open does
+        period["last_seen"] = sorted(active)[-2][0]
+        overlaps.append(period)
+
+    return overlaps
+
+
+def print_lookup(lookup):
+    """Prints the result of ResultStore.lookup() as a readable summary."""
+
+    def format_range(first_seen, last_seen):
+        if not first_seen:
+            return "not archived"
+        return f"{get_date_from_timestamp(first_seen)} - {get_date_from_timestamp(last_seen)}"
+
+    for code, result in lookup["codes"].items():
+        print(f"{code}: seen on {len(result['sites'])} site(s)")
+
+        for sighting in result["sites"]:
+            current = " (current)" if sighting["is_current"] else ""
+            print(
+                f"  {sighting['url']}: {format_range(sighting['first_seen'], sighting['last_seen'])}{current}"
+            )
+
+        if result["overlaps"]:
+            print("  Used at the same time by:")
+        for overlap in result["overlaps"]:
+            print(
+                f"    {' & '.join(overlap['urls'])}: {format_range(overlap['first_seen'], overlap['last_seen'])}"
+            )
+
+    for url, codes in lookup["shared_sites"].items():
+        print(f"{url} used {', '.join(codes)}")
+
+
+def format_store_date(date):
+    """Formats a datetime from get_sighting_rows() as a 14-digit timestamp (or None)."""
+
+    return date.strftime(TIMESTAMP_FORMAT) if date else None
@@ -0,0 +1,108 @@
+from array import array
+from bisect import bisect_right
+
+from wayback_google_analytics.models import CODE_TYPES, format_timestamp
+
+
+class CodeTimeline:
+    """Every run of consecutive snapshots a code was present in, as parallel int64 arrays.
+
+    A run starts at the first snapshot the code was found in and ends at the last snapshot
+    before one where it wasn't, so a code removed in 2015 and restored in 2019 has two runs
+    with a gap between them. Runs are stored as array("q") rather than Python objects, so a
+    timeline costs 16 bytes per run however many snapshots it covers.
+    """
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self):
+        self.starts = array("q")
+        self.ends = array("q")
+
+    def add_run(self, timestamp):
+        """Starts a new run at timestamp."""
+
+        self.starts.append(timestamp)
+        self.ends.append(timestamp)
+
+    def extend_run(self, timestamp):
+        """Extends the latest run to timestamp."""
+
+        self.ends[-1] = timestamp
+
+    def is_active(self, timestamp):
+        """Returns True if timestamp falls within a run of snapshots the code was present in.
+
+        Args:
+            timestamp (int or str): 14-digit timestamp.
+
+        Returns:
+            bool
+        """
+
+        index = bisect_right(self.starts, int(timestamp)) - 1
+        return index >= 0 and int(timestamp) <= self.ends[index]
+
+    def get_gaps(self):
+        """Returns the periods between runs, as (last seen before, first seen after) tuples.
+
+        Returns:
+            [(20151231000000, 20190101000000)]
+        """
+
+        return list(zip(self.ends[:-1], self.starts[1:]))
+
+    def to_list(self):
+        """Returns runs as [{"first_seen": "01/01/2012:00:00", "last_seen": "31/12/2015:00:00"}, ...]."""
+
+        return [
+            {"first_seen": format_timestamp(start), "last_seen": format_timestamp(end)}
+            for start, end in zip(self.starts, self.ends)
+        ]
+
+
+def build_timelines(records):
+    """Run-length encodes per-snapshot records into a CodeTimeline for every code.
+
+    A code's run continues while it is found in consecutive snapshots and a new run starts
+    after any snapshot it is missing from. Failed snapshots (None records) are skipped, so
+    they neither break nor extend a run.
+
+    Args:
+        records (iterable): (timestamp, {"UA": [...], "GA": [...], "GTM": [...]}) records from
+            get_codes_from_single_timestamp().
+
+    Returns:
+        {
+            "UA_codes": {"UA-12345678-1": CodeTimeline},
+            "GA_codes": {},
+            "GTM_codes": {},
+        }
+    """
+
+    timelines = {f"{code_type}_codes": {} for code_type in CODE_TYPES}
+    # Index of the last snapshot each code was found in
+    last_index = {}
+
+    records = sorted(
+        (record for record in records if record), key=lambda record: record[0]
+    )
+
+    for index, (timestamp, found) in enumerate(records):
+        timestamp = int(timestamp)
+        for code_type, codes in found.items():
+            code_timelines = timelines[f"{code_type}_codes"]
+            for code in codes:
+                key = (code_type, code)
+                previous = last_index.get(key)
+                last_index[key] = index
+
+                if previous is None:
+                    code_timelines[code] = CodeTimeline()
+                    code_timelines[code].add_run(timestamp)
+                elif previous == index - 1:
+                    code_timelines[code].extend_run(timestamp)
+                elif previous < index:
+                    code_timelines[code].add_run(timestamp)
+
+    return timelines
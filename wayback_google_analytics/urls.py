@@ -0,0 +1,85 @@
+from urllib.parse import urlsplit
+
+# Ports that can be dropped from a url without changing what it points to
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+
+
+def normalize_url(url):
+    """Returns a canonical form of a url so that equivalent inputs can be deduplicated.
+
+    Scheme, "www.", default ports, fragments and trailing slashes are dropped and the host
+    is lowercased. Path and query are kept, since they point to a different page.
+
+    Args:
+        url (str): Url as entered by the user.
+
+    Returns:
+        str: Canonical url.
+
+    Example:
+        "https://www.Example.com:443/about/#team" -> "example.com/about"
+    """
+
+    url = url.strip()
+
+    # urlsplit only finds the host if a scheme is present
+    if "://" not in url:
+        url = "http://" + url
+
+    parts = urlsplit(url)
+
+    host = parts.hostname or ""
+    if host.startswith("www."):
+        host = host[len("www."):]
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+
+    if port and str(port) != DEFAULT_PORTS.get(parts.scheme.lower()):
+        host += f":{port}"
+
+    path = parts.path.rstrip("/")
+
+    canonical = host + path
+    if parts.query:
+        canonical += "?" + parts.query
+
+    return canonical
+
+
+def get_domain(url):
+    """Returns the domain that the CDX api searches for a url with matchType=domain.
+
+    Args:
+        url (str): Url as entered by the user.
+
+    Returns:
+        str: Lowercase host without "www.".
+
+    Example:
+        "https://www.example.com/about" -> "example.com"
+    """
+
+    return normalize_url(url).split("/", 1)[0].split("?", 1)[0]
+
+
+def group_urls(urls):
+    """Groups urls that normalize to the same canonical url, preserving input order.
+
+    Args:
+        urls (list): Urls as entered by the user.
+
+    Returns:
+        {
+            "example.com": ["example.com", "https://www.example.com/"],
+            "example.com/about": ["example.com/about"],
+        }
+    """
+
+    groups = {}
+    for url in urls:
+        groups.setdefault(normalize_url(url), []).append(url)
+
+    return groups
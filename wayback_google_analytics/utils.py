@@ -6,6 +6,9 @@ DEFAULT_HEADERS = {
     "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/75.0.3770.142 Safari/537.36"
 }
 
+# Requests per second shared by all worker processes when --rate_limit isn't set
+DEFAULT_RATE_LIMIT = 5
+
 # Collapse options for CDX api
 COLLAPSE_OPTIONS = {
     "hourly": "10",
@@ -151,4 +154,37 @@ def generate_semaphore(url_list, limit):
         return 5
 
     if operations <= 10000:
-        return 1
\ No newline at end of file
+        return 1
+
+
+def order_progressive(timestamps):
+    """Orders timestamps coarse to fine: one snapshot per year first, then one for every
+    month, day and hour (see COLLAPSE_OPTIONS) not covered yet, then the rest. Snapshots
+    fetched in this order cover the whole time range early, so a run cut short still has
+    the best coverage it could get.
+
+    Args:
+        timestamps (list): Sorted 14-digit timestamps.
+
+    Returns:
+        list: The same timestamps, reordered.
+
+    Example: ["20190101000000", "20190102000000", "20200101000000"] -> ["20190101000000", "20200101000000", "20190102000000"]
+    """
+
+    ordered = []
+    picked = set()
+
+    for digits in sorted(int(option) for option in COLLAPSE_OPTIONS.values()):
+        covered = {timestamps[index][:digits] for index in picked}
+        for index, timestamp in enumerate(timestamps):
+            if index not in picked and timestamp[:digits] not in covered:
+                covered.add(timestamp[:digits])
+                picked.add(index)
+                ordered.append(timestamp)
+
+    ordered += [
+        timestamp for index, timestamp in enumerate(timestamps) if index not in picked
+    ]
+
+    return ordered
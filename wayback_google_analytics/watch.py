@@ -0,0 +1,207 @@
+import aiohttp
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+from wayback_google_analytics.async_utils import (
+    get_snapshot_timestamps,
+    get_codes_from_snapshots,
+)
+from wayback_google_analytics.inputs import iter_urls
+from wayback_google_analytics.models import CODE_TYPES
+from wayback_google_analytics.scraper import get_current_codes
+from wayback_google_analytics.single_flight import SingleFlightSession
+
+# Captures can take days to appear in the CDX index, so incremental queries reach back
+# this far before the last check
+INDEX_LAG = timedelta(days=7)
+
+
+def get_changes(url, previous, entry):
+    """Compares a url's new results with what the store knew before this check.
+
+    Args:
+        url (str): Url.
+        previous (list): Sightings of url before this check, from ResultStore.get_codes().
+        entry (dict): {url: results} from this check.
+
+    Returns:
+        List of changes:
+        [
+            {"url": "someurl.com", "change": "new_code", "code": "GTM-ABC1234", "code_type": "GTM"},
+            {"url": "someurl.com", "change": "disappeared_code", "code": "UA-12345678-1", "code_type": "UA"},
+            {"url": "someurl.com", "change": "current_changed", "code_type": "UA", "before": ["UA-12345678-1"], "after": []},
+        ]
+    """
+
+    info = entry[url]
+    known = {sighting["code"] for sighting in previous}
+    changes = []
+
+    for code_type in CODE_TYPES:
+        found = list(info.get(f"archived_{code_type}_codes", {}))
+        found += [
+            code
+            for code in info.get(f"current_{code_type}_code", [])
+            if code not in found
+        ]
+        for code in found:
+            if code not in known:
+                changes.append(
+                    {"url": url, "change": "new_code", "code": code, "code_type": code_type}
+                )
+
+    # Current codes can only be compared if the live page was retrieved
+    if not any(key.startswith("current_") for key in info):
+        return changes
+
+    for code_type in CODE_TYPES:
+        before = sorted(
+            sighting["code"]
+            for sighting in previous
+            if sighting["is_current"] and sighting["code_type"] == code_type
+        )
+        after = sorted(info.get(f"current_{code_type}_code", []))
+
+        for code in before:
+            if code not in after:
+                changes.append(
+                    {
+                        "url": url,
+                        "change": "disappeared_code",
+                        "code": code,
+                        "code_type": code_type,
+                    }
+                )
+
+        if before != after:
+            changes.append(
+                {
+                    "url": url,
+                    "change": "current_changed",
+                    "code_type": code_type,
+                    "before": before,
+                    "after": after,
+                }
+            )
+
+    return changes
+
+
+async def check_url(session, url, store, semaphore, limit=None):
+    """Checks one watched url: current codes from the live page and codes from snapshots
+    captured since the last check. Results are added to the store.
+
+    Args:
+        session (aiohttp.ClientSession)
+        url (str): Url to check.
+        store (ResultStore): Store holding what earlier checks found.
+        semaphore: asyncio.Semaphore()
+        limit (int, optional): Limit number of snapshots per check. Defaults to None.
+
+    Returns:
+        List of changes from get_changes(), or [] the first time a url is checked.
+    """
+
+    previous = store.get_codes(url)
+    last_checked = store.get_last_updated(url)
+
+    start_date = None
+    if last_checked:
+        start_date = (
+            datetime.strptime(last_checked, "%Y%m%d%H%M%S") - INDEX_LAG
+        ).strftime("%Y%m%d%H%M%S")
+
+    current_codes = await get_current_codes(session, url, semaphore)
+    timestamps = await get_snapshot_timestamps(
+        session=session,
+        url=url,
+        start_date=start_date,
+        end_date=None,
+        frequency=None,
+        limit=limit,
+        semaphore=semaphore,
+    )
+    archived_codes = await get_codes_from_snapshots(
+        session=session, url=url, timestamps=timestamps, semaphore=semaphore
+    )
+
+    info = dict(current_codes)
+    for code_type in CODE_TYPES:
+        info[f"archived_{code_type}_codes"] = archived_codes[f"{code_type}_codes"]
+    entry = {url: info}
+
+    # The first check only records a baseline
+    changes = get_changes(url, previous, entry) if last_checked else []
+    store.add_results(entry)
+
+    return changes
+
+
+async def watch(
+    watchlist,
+    store,
+    interval,
+    semaphore,
+    limit=None,
+    cycles=None,
+    on_change=print,
+):
+    """Re-checks every url in a watchlist once per interval, reporting only changes.
+
+    Checks are started evenly across the interval (e.g. 1000 urls over 24 hours start
+    one every 86.4 seconds), so requests go out at a steady rate instead of in bursts. The
+    watchlist is read again every cycle, so it can be edited while watching.
+
+    Args:
+        watchlist (str): Path to a list of urls (txt, csv or jsonl).
+        store (ResultStore): Store holding what earlier checks found.
+        interval (float): Seconds per cycle.
+        semaphore: asyncio.Semaphore()
+        limit (int, optional): Limit number of snapshots per check. Defaults to None.
+        cycles (int, optional): Stop after this many cycles. Defaults to None (run forever).
+        on_change (callable): Called with each change. Defaults to print.
+
+    Returns:
+        None
+    """
+
+    loop = asyncio.get_running_loop()
+    cycle = 0
+
+    async with aiohttp.ClientSession() as session:
+        session = SingleFlightSession(session)
+
+        while cycles is None or cycle < cycles:
+            started = loop.time()
+            urls = list(iter_urls(watchlist))
+            spacing = interval / max(len(urls), 1)
+            print(f"Watch cycle {cycle + 1}: checking {len(urls)} urls, one every {spacing:.1f}s")
+
+            async def check(url):
+                try:
+                    for change in await check_url(session, url, store, semaphore, limit):
+                        on_change(change)
+                except Exception as e:
+                    print(f"Error checking {url}: ", e)
+
+            tasks = []
+            for index, url in enumerate(urls):
+                await asyncio.sleep(max(0, started + index * spacing - loop.time()))
+                tasks.append(asyncio.create_task(check(url)))
+            await asyncio.gather(*tasks)
+
+            cycle += 1
+            if cycles is None or cycle < cycles:
+                await asyncio.sleep(max(0, started + interval - loop.time()))
+
+
+def print_change(change, changes_file=None):
+    """Prints a change as a json line, appending it to changes_file if given."""
+
+    line = json.dumps(change)
+    print(line)
+
+    if changes_file:
+        with open(changes_file, "a") as f:
+            f.write(line + "\n")
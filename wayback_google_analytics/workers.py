@@ -0,0 +1,109 @@
+import aiohttp
+import asyncio
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+from wayback_google_analytics.event_loop import install_uvloop
+from wayback_google_analytics.rate_limit import RateLimitedSemaphore
+from wayback_google_analytics.scraper import get_analytics_codes
+from wayback_google_analytics.single_flight import SingleFlightSession
+from wayback_google_analytics.urls import get_domain
+
+# Rate limiter shared by every url in a worker process, set by _init_worker()
+_worker_limiter = None
+
+
+def shard_urls(urls, workers):
+    """Splits urls into shards, keeping every url on the same domain in the same shard so
+    CDX queries can still be shared within a shard.
+
+    Args:
+        urls (list): Urls to scrape.
+        workers (int): Number of shards.
+
+    Returns:
+        List of shards, each a list of (index in urls, url) tuples:
+            [[(0, "example.com"), (2, "example.com/about")], [(1, "otherurl.org")]]
+    """
+
+    shards = [[] for _ in range(workers)]
+
+    for index, url in enumerate(urls):
+        # crc32 rather than hash(), which is randomized per process
+        shard = zlib.crc32(get_domain(url).encode()) % workers
+        shards[shard].append((index, url))
+
+    return shards
+
+
+def _init_worker(limiter, use_uvloop=False):
+    """Stores the shared rate limiter in each worker process and sets its event loop."""
+
+    global _worker_limiter
+    _worker_limiter = limiter
+
+    if use_uvloop:
+        install_uvloop()
+
+
+def _run_shard(urls, kwargs):
+    """Runs get_analytics_codes() for one shard in its own event loop."""
+
+    return asyncio.run(_scrape_shard(urls, **kwargs))
+
+
+async def _scrape_shard(urls, **kwargs):
+    """Scrapes a shard of urls with a new session, sharing the process-wide rate limiter."""
+
+    if _worker_limiter:
+        semaphore = RateLimitedSemaphore(10, _worker_limiter)
+    else:
+        semaphore = asyncio.Semaphore(10)
+
+    async with aiohttp.ClientSession() as session:
+        return await get_analytics_codes(
+            session=SingleFlightSession(session),
+            urls=urls,
+            semaphore=semaphore,
+            **kwargs,
+        )
+
+
+async def run_sharded(urls, workers, limiter=None, use_uvloop=False, **kwargs):
+    """Shards urls across worker processes, each running get_analytics_codes() in its own
+    event loop, and merges their results back into input order.
+
+    Args:
+        urls (list): Urls to scrape.
+        workers (int): Number of worker processes.
+        limiter (RateLimiter, optional): Rate budget shared by all workers. Defaults to None.
+        use_uvloop (bool): Run each worker's event loop on uvloop. Defaults to False.
+        **kwargs: start_date, end_date, frequency, limit and skip_current for get_analytics_codes().
+
+    Returns:
+        Results in the same format and order as get_analytics_codes().
+    """
+
+    shards = [shard for shard in shard_urls(urls, workers) if shard]
+    loop = asyncio.get_running_loop()
+
+    with ProcessPoolExecutor(
+        max_workers=len(shards) or 1,
+        initializer=_init_worker,
+        initargs=(limiter, use_uvloop),
+    ) as executor:
+        futures = [
+            loop.run_in_executor(
+                executor, _run_shard, [url for _, url in shard], kwargs
+            )
+            for shard in shards
+        ]
+        shard_results = await asyncio.gather(*futures)
+
+    # Merge shard results back into input order
+    results = [None] * len(urls)
+    for shard, shard_result in zip(shards, shard_results):
+        for (index, _), entry in zip(shard, shard_result):
+            results[index] = entry
+
+    return results